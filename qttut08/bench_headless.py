@@ -0,0 +1,99 @@
+"""
+Compares the widget backed Browser with the headless one, by the number of
+instances fitting in 1 GB of memory, construction time and pages/sec.
+
+    $ python bench_headless.py
+
+Each mode runs in a fresh process, so the memory figures don't mix.
+"""
+import sys
+import time
+import logging
+import subprocess
+
+from PySide.QtGui import QApplication
+from PySide.QtCore import QEventLoop
+
+from farm import rss_bytes
+from httpserver import ServerProcess
+from qttut08_02_ok import Browser
+
+
+INSTANCES = 50
+PAGES = 200
+ADDRESS = '127.0.0.1'
+PORT = 8088
+
+
+def measure_instances(options):
+    logger = logging.getLogger('bench')
+    browsers = []
+    start_rss = rss_bytes()
+    start = time.time()
+    for _ in range(INSTANCES):
+        browsers.append(Browser(lambda result: None, logger, dict(options)))
+    elapsed = time.time() - start
+    per_instance = (rss_bytes() - start_rss) / float(INSTANCES)
+    return browsers, per_instance, elapsed / INSTANCES
+
+
+def measure_pages(browser_options):
+    url = 'http://{0}:{1}'.format(ADDRESS, PORT)
+    event_loop = QEventLoop()
+    state = {'remaining': PAGES}
+
+    def finished(result):
+        state['remaining'] -= 1
+        if state['remaining']:
+            browser.make('get', url, {})
+        else:
+            event_loop.quit()
+
+    browser = Browser(finished, logging.getLogger('bench'),
+                      dict(browser_options))
+    start = time.time()
+    browser.make('get', url, {})
+    event_loop.exec_()
+    return PAGES / (time.time() - start)
+
+
+def run_mode(mode):
+    options = {'images': False, 'javascript': True}
+    if mode == 'headless':
+        options['headless'] = True
+
+    app = QApplication([])
+    _browsers, per_instance, construction = measure_instances(options)
+    pages_per_sec = measure_pages(options)
+
+    per_gb = (1024 ** 3) / per_instance if per_instance else float('inf')
+    print '{0:<10} {1:>14.0f} {2:>16.2f} {3:>12.1f}'.format(
+        mode, per_gb, construction * 1000, pages_per_sec)
+    app.quit()
+
+
+def main():
+    with open('html/simple_page.html', 'r') as html_file:
+        html = html_file.read()
+
+    server_context = {'delay': 0.0,
+                      'response': 200,
+                      'response_data': html,
+                      'headers': {'content-type': 'text/html;'}}
+    server = ServerProcess(ADDRESS, PORT, server_context)
+    server.start()
+    try:
+        print '{0:<10} {1:>14} {2:>16} {3:>12}'.format(
+            'mode', 'instances/GB', 'construction ms', 'pages/sec')
+        for mode in ('widget', 'headless'):
+            subprocess.check_call([sys.executable, __file__, mode])
+    finally:
+        server.shutdown()
+        server.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run_mode(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,95 @@
+"""
+Measures what the network manager spends on the bookkeeping of 10k
+requests: SmartNetworkAccessManager._add_record as it is, against the
+former bookkeeping, a dict per request plus a functools.partial connected
+to the destroyed signal of each reply.
+
+    $ python bench_request_records.py
+
+Both run on real replies (LocalReply objects which are never delivered), so
+the properties and signal connections are part of the time. Only python
+objects are counted as allocated, not what QT allocates for them.
+"""
+import sys
+import time
+import logging
+
+from functools import partial
+
+from PySide.QtCore import QCoreApplication, QUrl
+from PySide.QtNetwork import QNetworkAccessManager, QNetworkRequest
+
+from qttut08_02_ok import SmartNetworkAccessManager
+from replies import LocalReply
+
+
+REQUESTS = 10000
+REPEAT = 5
+
+
+def forget(reply_id):
+    pass
+
+
+def dict_records(manager, replies, request):
+    records = dict()
+    slots = []
+    for reply in replies:
+        records[id(reply)] = {'reply': reply,
+                              'outgoing_data': None,
+                              'finished': False,
+                              'retry_count': 0,
+                              'page': None,
+                              'host': 'example.com'}
+        slot = partial(forget, id(reply))
+        reply.destroyed.connect(slot)
+        slots.append(slot)
+    return records, slots
+
+
+def manager_records(manager, replies, request):
+    for reply in replies:
+        manager._add_record(reply, None, request)
+    # the slots are bound methods of the manager, not objects per reply
+    return manager._requests, []
+
+
+def allocated_bytes(records, slots):
+    size = sum(sys.getsizeof(record) for record in records.values())
+    return size + sum(sys.getsizeof(slot) for slot in slots)
+
+
+def measure(func, request):
+    # the replies keep their connections, so every run gets fresh ones
+    best = None
+    for _ in range(REPEAT):
+        manager = SmartNetworkAccessManager(logging.getLogger('bench'), 3)
+        replies = [LocalReply(manager,
+                              QNetworkAccessManager.GetOperation,
+                              request)
+                   for _ in range(REQUESTS)]
+        started = time.time()
+        (records, slots) = func(manager, replies, request)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return (best, allocated_bytes(records, slots))
+
+
+def main():
+    # only kept alive for the replies, the event loop is never run
+    _app = QCoreApplication([])
+    request = QNetworkRequest(QUrl('http://example.com/'))
+    print 'Bookkeeping of {0} requests'.format(REQUESTS)
+    print '{0:<16} {1:>14} {2:>14}'.format('', 'time ms', 'allocated KB')
+
+    for (name, func) in (('dict + partial', dict_records),
+                         ('_add_record', manager_records)):
+        (elapsed, size) = measure(func, request)
+        print '{0:<16} {1:>14.2f} {2:>14.1f}'.format(name,
+                                                     elapsed * 1000,
+                                                     size / 1024.0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import re
+import mimetypes
+
+from itertools import product
+from urlparse import urlsplit
+
+
+RESOURCE_TYPES = {
+    'script': ('js', ),
+    'stylesheet': ('css', ),
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'svg', 'ico', 'bmp'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'media': ('mp4', 'webm', 'ogg', 'ogv', 'mp3', 'm4a', 'wav', 'flv',
+              'avi', 'mov'),
+    'document': ('html', 'htm', 'xhtml', 'php', 'asp', 'aspx', 'jsp')
+}
+
+EXTENSION_TYPES = dict((ext, resource_type)
+                       for (resource_type, exts) in RESOURCE_TYPES.items()
+                       for ext in exts)
+
+# extensions the mimetypes module doesn't know about
+EXTRA_MIME_TYPES = {'woff': 'font/woff',
+                    'woff2': 'font/woff2',
+                    'webp': 'image/webp',
+                    'webm': 'video/webm',
+                    'flv': 'video/x-flv',
+                    'eot': 'application/vnd.ms-fontobject'}
+
+
+def url_extension(path):
+    filename = path.rsplit('/', 1)[-1]
+    if '.' not in filename:
+        return ''
+    return filename.rsplit('.', 1)[-1].lower()
+
+
+def guess_resource_type(path, accept=None):
+    """
+    Webkit doesn't tell what a resource is going to be used for, so it is
+    guessed from the extension in the url, or the Accept header.
+    """
+    resource_type = EXTENSION_TYPES.get(url_extension(path))
+    if resource_type is not None:
+        return resource_type
+
+    accept = accept or ''
+    if accept.startswith('text/html') or 'xhtml' in accept:
+        return 'document'
+    if accept.startswith('text/css'):
+        return 'stylesheet'
+    if accept.startswith('image/'):
+        return 'image'
+    return None
+
+
+def guess_mime_type(path):
+    ext = url_extension(path)
+    if not ext:
+        return None
+    return (EXTRA_MIME_TYPES.get(ext) or
+            mimetypes.guess_type('file.' + ext, strict=False)[0])
+
+
+class BlockingRules(object):
+    """
+    A set of rules deciding which requests should never reach the network.
+    Each rule is a dict with one or more of the following conditions, all
+    of which must match for the rule to block a request:
+
+        host  - blocks the host and all of its subdomains
+        url   - a regular expression searched for in the full url, using
+                only non-capturing groups
+        type  - a resource type, one of RESOURCE_TYPES
+        mime  - the mime type guessed from the url, e.g. 'video/mp4', or
+                'video/*' for all the types of a kind
+
+    The rules are compiled into a trie of reversed host labels, and a single
+    combined regular expression per type and mime constraint, so matching a
+    request costs about the same with a few or thousands of rules.
+    """
+
+    def __init__(self, rules):
+        # reversed host labels -> nested dicts, a node's None key holds the
+        # rules ending at that node, by (type, mime) constraint
+        self._host_trie = dict()
+        # (type, mime) constraint -> rules without host and url condition
+        self._kind_rules = dict()
+        url_rules = dict()
+
+        for rule in rules:
+            key = (rule.get('type'), rule.get('mime'))
+            if 'host' in rule:
+                self._add_host_rule(rule, key)
+            elif 'url' in rule:
+                url_rules.setdefault(key, []).append(rule)
+            elif key != (None, None):
+                self._kind_rules.setdefault(key, rule)
+            else:
+                raise ValueError('Empty blocking rule: {0}'.format(rule))
+
+        self._url_patterns = dict((key, self._combine(rules))
+                                  for (key, rules) in url_rules.items())
+
+    def _add_host_rule(self, rule, key):
+        node = self._host_trie
+        for label in reversed(rule['host'].lower().strip('.').split('.')):
+            node = node.setdefault(label, dict())
+
+        pattern = re.compile(rule['url']) if 'url' in rule else None
+        node.setdefault(None, dict()).setdefault(key, []).append((pattern,
+                                                                  rule))
+
+    def _combine(self, rules):
+        # one alternation of all the patterns, python can't have more than
+        # 100 groups in a pattern, so they can't tell which rule matched,
+        # that is found out separately, but only for blocked requests
+        combined = '|'.join('(?:{0})'.format(rule['url']) for rule in rules)
+        patterns = [(re.compile(rule['url']), rule) for rule in rules]
+        return re.compile(combined), patterns
+
+    def _keys(self, resource_type, mime_type):
+        types = [None]
+        if resource_type is not None:
+            types.append(resource_type)
+
+        mimes = [None]
+        if mime_type is not None:
+            mimes.extend([mime_type, mime_type.split('/')[0] + '/*'])
+
+        return list(product(types, mimes))
+
+    def _match_host(self, url, host, keys):
+        node = self._host_trie
+        for label in reversed(host.lower().split('.')):
+            node = node.get(label)
+            if node is None:
+                return None
+
+            ending = node.get(None)
+            if ending is None:
+                continue
+
+            for key in keys:
+                for (pattern, rule) in ending.get(key, ()):
+                    if pattern is None or pattern.search(url) is not None:
+                        return rule
+        return None
+
+    def _match_url(self, url, keys):
+        for key in keys:
+            try:
+                combined, patterns = self._url_patterns[key]
+            except KeyError:
+                continue
+
+            if combined.search(url) is not None:
+                for (pattern, rule) in patterns:
+                    if pattern.search(url) is not None:
+                        return rule
+        return None
+
+    def match(self, url, accept=None):
+        """
+        Return the rule blocking the given url, or None if it is allowed.
+        """
+        parts = urlsplit(url)
+        resource_type = guess_resource_type(parts.path, accept)
+        keys = self._keys(resource_type, guess_mime_type(parts.path))
+
+        for key in keys:
+            if key in self._kind_rules:
+                return self._kind_rules[key]
+
+        if self._host_trie and parts.hostname:
+            rule = self._match_host(url, parts.hostname, keys)
+            if rule is not None:
+                return rule
+
+        return self._match_url(url, keys)
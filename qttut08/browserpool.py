@@ -0,0 +1,189 @@
+import time
+import collections
+
+from functools import partial
+
+from PySide.QtCore import QTimer
+
+from qttut08_02_ok import Browser
+from scheduling import HostLimits, HostScheduler
+from validators import ValidatorStore
+
+
+class BrowserPool(object):
+    """
+    Keeps a number of warm Browser instances around and hands them out for
+    tasks. A returned browser is reset in place and reused, it is shut down
+    only after it served max_uses tasks, lived longer than max_age seconds,
+    or if its last task failed. A retired browser is replaced right away, it
+    doesn't take up a slot of the pool while it's shutting down.
+    """
+
+    def __init__(self, logger, options=None, size=4, min_idle=1,
+                 max_uses=50, max_age=None, browser_cls=Browser):
+        self.logger = logger
+        self._options = dict(options or dict())
+        host_limits = self._options.get('host_limits')
+        if isinstance(host_limits, list):
+            host_limits = HostLimits(host_limits)
+        if isinstance(host_limits, HostLimits):
+            # the limits hold for all the browsers of the pool together
+            self._options['host_limits'] = HostScheduler(host_limits)
+        validator_store = self._options.get('validator_store')
+        if isinstance(validator_store, basestring):
+            # one connection to the database for all the browsers
+            self._options['validator_store'] = ValidatorStore(validator_store)
+        self._size = size
+        self._min_idle = min(min_idle, size)
+        self._max_uses = max_uses
+        self._max_age = max_age
+        self._browser_cls = browser_cls
+
+        # id(browser) -> entry dict, holds all the browsers owned by the pool,
+        # including the ones which are currently being shut down
+        self._entries = dict()
+        self._idle = collections.deque()
+        self._waiters = collections.deque()
+        self._shutdown_callback = None
+
+        self._fill()
+
+    @property
+    def size(self):
+        return len(self._entries)
+
+    def _active_count(self):
+        return sum(1 for entry in self._entries.values()
+                   if entry['state'] != 'shutting_down')
+
+    @property
+    def idle_count(self):
+        return len(self._idle)
+
+    def _create(self):
+        entry = {'browser': None,
+                 'uses': 0,
+                 'state': 'idle',
+                 'result_callback': None,
+                 'successful': True,
+                 'created': time.time()}
+        # Browser mutates the options it receives, so each one gets a copy
+        browser = self._browser_cls(partial(self._task_finished, entry),
+                                    self.logger,
+                                    dict(self._options))
+        entry['browser'] = browser
+        self._entries[id(browser)] = entry
+        self._idle.append(entry)
+        self.logger.info('Browser {0} created in pool.'.format(id(browser)))
+        return entry
+
+    def _fill(self):
+        # keep at least min_idle warm browsers around, as long as the pool
+        # size allows it
+        if self._shutdown_callback is not None:
+            return
+
+        while (len(self._idle) < self._min_idle and
+               self._active_count() < self._size):
+            self._create()
+
+    def _task_finished(self, entry, result):
+        entry['successful'] = result['successful']
+        entry['result_callback'](result)
+
+    def _dispatch(self):
+        while self._waiters:
+            if not self._idle:
+                if self._active_count() >= self._size:
+                    # all browsers are busy, the waiters will be served by
+                    # the next checkin
+                    return
+                self._create()
+
+            entry = self._idle.popleft()
+            ready_callback, result_callback = self._waiters.popleft()
+            entry['state'] = 'busy'
+            entry['result_callback'] = result_callback
+            entry['successful'] = True
+            # don't start a new task from within the caller's stack, which
+            # might be a slot of the very same browser
+            QTimer.singleShot(0, partial(ready_callback, entry['browser']))
+
+        self._fill()
+
+    def checkout(self, ready_callback, result_callback):
+        """
+        Request a browser from the pool. ready_callback will be invoked with
+        the browser as soon as one is available, and result_callback will
+        receive the results of the tasks made with it.
+        """
+        self._waiters.append((ready_callback, result_callback))
+        self._dispatch()
+
+    def _is_worn_out(self, entry):
+        if entry['uses'] >= self._max_uses:
+            return True
+        return (self._max_age is not None and
+                time.time() - entry['created'] >= self._max_age)
+
+    def checkin(self, browser, failed=False):
+        """
+        Return a browser to the pool once its task is finished. A failed or
+        worn out browser is shut down and replaced.
+        """
+        entry = self._entries[id(browser)]
+        entry['uses'] += 1
+        entry['result_callback'] = None
+
+        if (failed or not entry['successful'] or self._is_worn_out(entry) or
+                self._shutdown_callback is not None):
+            self._retire(entry)
+            # the replacement doesn't wait for the old one to be destroyed
+            self._dispatch()
+            return
+
+        entry['state'] = 'resetting'
+        browser.reset(partial(self._reset_finished, entry))
+
+    def _reset_finished(self, entry):
+        if self._shutdown_callback is not None:
+            self._retire(entry)
+            return
+
+        entry['state'] = 'idle'
+        self._idle.append(entry)
+        self._dispatch()
+
+    def _retire(self, entry):
+        browser = entry['browser']
+        self.logger.info('Browser {0} retired after {1} uses.'.format(
+            id(browser), entry['uses']))
+        entry['state'] = 'shutting_down'
+        browser.shutdown(partial(self._browser_destroyed, entry))
+
+    def _browser_destroyed(self, entry):
+        self._entries.pop(id(entry['browser']), None)
+        entry['browser'] = None
+
+        if self._shutdown_callback is not None:
+            if not self._entries:
+                self._shutdown_callback()
+            return
+        # a slot was freed, it may be used by a waiter, or to restore the
+        # number of idle browsers
+        self._dispatch()
+
+    def shutdown(self, callback):
+        """
+        Shut down all idle browsers immediately, and the busy ones as soon as
+        they are checked in. The callback is invoked when all are destroyed.
+        """
+        self._shutdown_callback = callback
+        self._waiters.clear()
+
+        if not self._entries:
+            callback()
+            return
+
+        while self._idle:
+            self._retire(self._idle.popleft())
@@ -0,0 +1,47 @@
+import fnmatch
+
+
+class ContentPolicy(object):
+    """
+    Limits on what a task may download, all of them optional:
+
+        max_resource_bytes  - the size of a single response
+        max_task_bytes      - the size of all the responses of a task
+        allowed_mime_types  - patterns of the mime types which may be
+                              downloaded, e.g. ['text/*', 'image/png'],
+                              responses without a content type are allowed
+
+    The checks return the reason a response is rejected, or None.
+    """
+
+    def __init__(self, max_resource_bytes=None, max_task_bytes=None,
+                 allowed_mime_types=None):
+        self.max_resource_bytes = max_resource_bytes
+        self.max_task_bytes = max_task_bytes
+        if allowed_mime_types is not None:
+            allowed_mime_types = [pattern.lower()
+                                  for pattern in allowed_mime_types]
+        self.allowed_mime_types = allowed_mime_types
+
+    def check_mime_type(self, content_type):
+        if self.allowed_mime_types is None or not content_type:
+            return None
+
+        mime_type = content_type.split(';', 1)[0].strip().lower()
+        for pattern in self.allowed_mime_types:
+            if fnmatch.fnmatchcase(mime_type, pattern):
+                return None
+        return 'mime type {0} is not allowed'.format(mime_type)
+
+    def check_size(self, resource_bytes, task_bytes):
+        if (self.max_resource_bytes is not None and
+                resource_bytes > self.max_resource_bytes):
+            return 'resource of {0} bytes is over the limit of {1}'.format(
+                resource_bytes, self.max_resource_bytes
+            )
+        if (self.max_task_bytes is not None and
+                task_bytes > self.max_task_bytes):
+            return 'task of {0} bytes is over the limit of {1}'.format(
+                task_bytes, self.max_task_bytes
+            )
+        return None
@@ -0,0 +1,35 @@
+from urlparse import urlsplit, urlunsplit
+
+
+# request headers which may change the response, requests differing in any
+# other header (e.g. the Referer) still get the same response
+KEY_HEADERS = ('accept', 'accept-language', 'accept-encoding',
+               'authorization', 'user-agent')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def canonical_url(url):
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        host = '{0}:{1}'.format(host, parts.port)
+    if parts.username is not None:
+        host = '{0}@{1}'.format(parts.netloc.rsplit('@', 1)[0], host)
+    # the fragment is never sent to the server
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+def request_key(url, headers):
+    """
+    Return the key under which identical GET requests are coalesced, or
+    None if the request shouldn't be coalesced with any other.
+    """
+    headers = dict((name.lower(), value) for (name, value) in headers)
+    if 'range' in headers:
+        # partial content, which part depends on the requester
+        return None
+
+    return (canonical_url(url), ) + tuple((name, headers.get(name))
+                                          for name in KEY_HEADERS)
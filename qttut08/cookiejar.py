@@ -0,0 +1,185 @@
+import sqlite3
+
+from PySide.QtCore import QCoreApplication, QDateTime, QTimer
+from PySide.QtNetwork import QNetworkCookie, QNetworkCookieJar
+
+
+# the handful of public suffixes with more than one label we care about, a
+# full public suffix list would be overkill for grouping cookies
+MULTI_LABEL_SUFFIXES = frozenset([
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'co.jp', 'ne.jp', 'or.jp',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'com.br', 'com.cn', 'com.mx',
+    'co.in', 'co.za', 'com.tr', 'com.ar', 'co.kr', 'com.tw'
+])
+
+
+def registrable_domain(host):
+    """
+    Return the part of the host a site can set cookies for, e.g.
+    www.news.example.co.uk -> example.co.uk.
+    """
+    host = host.lower().strip('.')
+    labels = host.split('.')
+    if labels[-1].isdigit():
+        # an ip address
+        return host
+
+    if '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def domain_matches(cookie_domain, host):
+    if cookie_domain.startswith('.'):
+        return host == cookie_domain[1:] or host.endswith(cookie_domain)
+    return host == cookie_domain
+
+
+def path_matches(cookie_path, path):
+    if not path.startswith(cookie_path):
+        return False
+    return (len(path) == len(cookie_path) or cookie_path.endswith('/') or
+            path[len(cookie_path)] == '/')
+
+
+class PersistentCookieJar(QNetworkCookieJar):
+    """
+    A cookie jar backed by an sqlite database, so sessions survive browsers
+    being recreated and processes being restarted. One jar may be shared by
+    all the browsers of a pool.
+
+    Cookies are grouped by the registrable domain of the host they belong to.
+    A group is loaded from the database the first time a host of that domain
+    is visited, and lookups only look at the cookies of that group. Changes
+    are written back in batches, every flush_interval milliseconds at most,
+    and when the application quits. Whoever is done with the jar earlier
+    should flush it.
+    """
+
+    def __init__(self, path, flush_interval=1000):
+        QNetworkCookieJar.__init__(self)
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS cookies ('
+                         'registrable_domain TEXT NOT NULL, '
+                         'raw TEXT NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS cookies_domain '
+                         'ON cookies (registrable_domain)')
+        self._db.commit()
+
+        # registrable domain -> {(name, domain, path): QNetworkCookie}
+        self._domains = dict()
+        self._dirty = set()
+
+        self._flush_timer = QTimer()
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(flush_interval)
+        self._flush_timer.timeout.connect(self.flush)
+        app = QCoreApplication.instance()
+        if app is not None:
+            # the last batch would be lost otherwise
+            app.aboutToQuit.connect(self.flush)
+
+    def _load(self, reg_domain):
+        try:
+            return self._domains[reg_domain]
+        except KeyError:
+            pass
+
+        cookies = dict()
+        rows = self._db.execute('SELECT raw FROM cookies '
+                                'WHERE registrable_domain = ?', (reg_domain,))
+        now = QDateTime.currentDateTime()
+        for (raw, ) in rows:
+            for cookie in QNetworkCookie.parseCookies(str(raw)):
+                if cookie.isSessionCookie() or cookie.expirationDate() > now:
+                    cookies[self._cookie_key(cookie)] = cookie
+
+        self._domains[reg_domain] = cookies
+        return cookies
+
+    def _cookie_key(self, cookie):
+        return (str(cookie.name()), cookie.domain(), cookie.path())
+
+    def cookiesForUrl(self, url):
+        host = url.host().lower()
+        path = url.path() or '/'
+        secure = url.scheme() == 'https'
+        now = QDateTime.currentDateTime()
+
+        matching = []
+        for cookie in self._load(registrable_domain(host)).values():
+            if cookie.isSecure() and not secure:
+                continue
+            if not domain_matches(cookie.domain(), host):
+                continue
+            if not path_matches(cookie.path(), path):
+                continue
+            if (not cookie.isSessionCookie() and
+                    cookie.expirationDate() <= now):
+                continue
+            matching.append(cookie)
+
+        # more specific paths go first
+        matching.sort(key=lambda cookie: len(cookie.path()), reverse=True)
+        return matching
+
+    def setCookiesFromUrl(self, cookie_list, url):
+        host = url.host().lower()
+        reg_domain = registrable_domain(host)
+        cookies = self._load(reg_domain)
+        now = QDateTime.currentDateTime()
+        changed = False
+
+        for cookie in cookie_list:
+            cookie = QNetworkCookie(cookie)
+            if not cookie.domain():
+                cookie.setDomain(host)
+            elif not cookie.domain().startswith('.'):
+                cookie.setDomain('.' + cookie.domain())
+
+            if not cookie.path():
+                default_path = url.path()
+                cookie.setPath(default_path[:default_path.rfind('/')] or '/')
+
+            # a site may only set cookies for its own domain
+            if (not domain_matches(cookie.domain(), host) or
+                    registrable_domain(cookie.domain()) != reg_domain):
+                continue
+
+            key = self._cookie_key(cookie)
+            if (not cookie.isSessionCookie() and
+                    cookie.expirationDate() <= now):
+                # an expiration date in the past deletes the cookie
+                changed = cookies.pop(key, None) is not None or changed
+            else:
+                cookies[key] = cookie
+                changed = True
+
+        if changed:
+            self._dirty.add(reg_domain)
+            if not self._flush_timer.isActive():
+                self._flush_timer.start()
+
+        return changed
+
+    def allCookies(self):
+        return [cookie for cookies in self._domains.values()
+                for cookie in cookies.values()]
+
+    def flush(self):
+        """
+        Write the cookies of all changed domains to the database.
+        """
+        self._flush_timer.stop()
+        if not self._dirty:
+            return
+
+        for reg_domain in self._dirty:
+            self._db.execute('DELETE FROM cookies '
+                             'WHERE registrable_domain = ?', (reg_domain,))
+            rows = [(reg_domain, str(cookie.toRawForm()))
+                    for cookie in self._domains[reg_domain].values()]
+            self._db.executemany('INSERT INTO cookies VALUES (?, ?)', rows)
+
+        self._db.commit()
+        self._dirty.clear()
@@ -0,0 +1,46 @@
+import os
+import fcntl
+
+from PySide.QtNetwork import QNetworkDiskCache
+
+
+class SharedDiskCache(QNetworkDiskCache):
+    """
+    A disk cache whose directory can be used by several network managers at
+    once, be it from the same process (each manager needs its own cache
+    object) or from different worker processes.
+
+    QNetworkDiskCache already writes new entries into temporary files which
+    are renamed into place, so readers never see a half written entry. What
+    is left to coordinate is eviction, where every instance would scan and
+    trim the same directory at the same time. Eviction is therefore guarded
+    by a lock file, and only one instance evicts while the others move on.
+    """
+    lock_filename = '.expire.lock'
+
+    def __init__(self, directory, max_size):
+        QNetworkDiskCache.__init__(self)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another process created it in the meantime
+                pass
+
+        self.setCacheDirectory(directory)
+        self.setMaximumCacheSize(max_size)
+        self._lock_path = os.path.join(directory, self.lock_filename)
+
+    def expire(self):
+        with open(self._lock_path, 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                # somebody else is evicting right now, report a size below
+                # the limit so we're asked again only after a few inserts
+                return self.maximumCacheSize() * 9 / 10
+
+            try:
+                return QNetworkDiskCache.expire(self)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
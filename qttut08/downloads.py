@@ -0,0 +1,72 @@
+from functools import partial
+
+
+class Sink(object):
+    """
+    Where the body of a downloaded resource goes, chunk by chunk, as it
+    arrives from the network, each chunk being passed to write. A sink is
+    restarted if the download has to start over, e.g. when it's retried or
+    redirected, and closed once it's done, with the final url and whether it
+    was successful. restart and close are optional callables, invoked with
+    no arguments.
+    """
+
+    def __init__(self, write, restart=None, close=None):
+        self._write = write
+        self._restart = restart
+        self._close = close
+        self.bytes = 0
+        self.url = None
+        self.successful = False
+        self.closed = False
+
+    def write(self, data):
+        self.bytes += len(data)
+        self._write(data)
+
+    def restart(self):
+        self.bytes = 0
+        if self._restart is not None:
+            self._restart()
+
+    def close(self, url, successful):
+        if self.closed:
+            return
+        self.url = url
+        self.successful = successful
+        self.closed = True
+        if self._close is not None:
+            self._close()
+
+    def result(self):
+        return {'url': self.url,
+                'successful': self.successful,
+                'bytes': self.bytes}
+
+
+class FileSink(Sink):
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb')
+        Sink.__init__(self, self._file.write, self._truncate,
+                      self._file.close)
+
+    def _truncate(self):
+        self._file.seek(0)
+        self._file.truncate()
+
+    def result(self):
+        result = Sink.result(self)
+        result['path'] = self.path
+        return result
+
+
+class CallbackSink(Sink):
+    """
+    Passes the chunks on to the callback, which gets None when the download
+    starts over, meaning the chunks received so far must be thrown away.
+    """
+
+    def __init__(self, callback):
+        Sink.__init__(self, callback, partial(callback, None))
@@ -0,0 +1,413 @@
+import os
+import sys
+import time
+import Queue
+import signal
+import logging
+import itertools
+import multiprocessing
+
+from collections import namedtuple
+from functools import partial
+
+from PySide.QtCore import QTimer
+from PySide.QtGui import QApplication
+
+from browserpool import BrowserPool
+from qttut08_02_ok import (Browser, LogLevelFilter, get_log_handler,
+                           install_certificates)
+
+
+Job = namedtuple('Job', 'id method url headers raw_data browser_cls')
+
+signal_names = dict((getattr(signal, name), name) for name in dir(signal)
+                    if name.startswith('SIG') and not name.startswith('SIG_'))
+
+
+def rss_bytes():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class Worker(multiprocessing.Process):
+    """
+    A crawler process, running its own QApplication and event loop. Jobs are
+    received on the inbox queue and executed by browsers taken from a pool,
+    the results are sent back through the outbox queue.
+
+    QtWebKit slowly leaks memory, so once the worker crosses one of its
+    limits (resident memory in bytes, pages served or uptime in seconds) it
+    asks the supervisor to be replaced, finishes the jobs it is running and
+    shuts down its browsers safely before exiting.
+    """
+    poll_interval = 10
+
+    def __init__(self, worker_id, inbox, outbox, options, concurrency,
+                 limits=None, log_options=None):
+        multiprocessing.Process.__init__(self)
+        self.worker_id = worker_id
+        self.inbox = inbox
+        self.outbox = outbox
+        self.options = options
+        self.concurrency = concurrency
+        self.limits = limits or dict()
+        # rotation of the log files, see get_log_handler
+        self.log_options = log_options or dict()
+
+    def _init_logger(self):
+        logger = logging.getLogger('webkit_logger')
+        logger.setLevel(logging.DEBUG)
+
+        filename = 'requests-{0}.log'.format(self.worker_id)
+        request_log_handler = get_log_handler(filename, **self.log_options)
+        request_log_handler.addFilter(LogLevelFilter(logging.DEBUG))
+
+        filename = 'process-{0}.log'.format(self.worker_id)
+        process_log_handler = get_log_handler(filename, **self.log_options)
+        process_log_handler.addFilter(LogLevelFilter(logging.INFO))
+
+        logger.addHandler(request_log_handler)
+        logger.addHandler(process_log_handler)
+        return logger
+
+    def run(self):
+        install_certificates()
+        self.app = QApplication([])
+        self.logger = self._init_logger()
+        # one pool per browser class, created when the first job needs it,
+        # except the default one, so a spare has a warm browser when promoted
+        self._pools = dict()
+        self._get_pool(Browser)
+        self._busy = 0
+        self._stopping = False
+        self._pages_served = 0
+        self._started = time.time()
+
+        self._poll_timer = QTimer()
+        self._poll_timer.timeout.connect(self._poll)
+        self._poll_timer.start(self.poll_interval)
+
+        self.outbox.put(('ready', self.worker_id, None, None))
+        self.app.exec_()
+        # the process exits without running logging's atexit hook, so the
+        # records still queued must be written now
+        for handler in self.logger.handlers:
+            handler.close()
+
+    def _get_pool(self, browser_cls):
+        try:
+            return self._pools[browser_cls]
+        except KeyError:
+            pool = BrowserPool(self.logger,
+                               self.options,
+                               size=self.concurrency,
+                               max_uses=self.limits.get('browser_uses', 50),
+                               browser_cls=browser_cls)
+            self._pools[browser_cls] = pool
+            return pool
+
+    def _poll(self):
+        # the queue can't wake up the qt event loop, so it's polled, but
+        # only while there is capacity left for new jobs
+        while not self._stopping and self._busy < self.concurrency:
+            try:
+                job = self.inbox.get_nowait()
+            except Queue.Empty:
+                return
+
+            if job is None:
+                self._stop()
+                return
+
+            self._start_job(job)
+
+    def _start_job(self, job):
+        self._busy += 1
+        pool = self._get_pool(job.browser_cls)
+        holder = dict()
+
+        def ready(browser):
+            holder['browser'] = browser
+            browser.make(job.method, job.url, job.headers, job.raw_data)
+
+        def finished(result):
+            pool.checkin(holder['browser'])
+            self._busy -= 1
+            self._pages_served += 1
+            self.outbox.put(('result', self.worker_id, job.id, result))
+            if not self._stopping and self._is_worn_out():
+                # let the supervisor bring in a replacement before we drain
+                self.outbox.put(('recycle', self.worker_id, None, None))
+                self._stop()
+            elif self._stopping:
+                self._stop()
+
+        pool.checkout(ready, finished)
+
+    def _is_worn_out(self):
+        limits = self.limits
+        if self._pages_served >= limits.get('pages', float('inf')):
+            return True
+        if time.time() - self._started >= limits.get('uptime', float('inf')):
+            return True
+        return rss_bytes() >= limits.get('rss', float('inf'))
+
+    def _stop(self):
+        # stop taking new jobs, and quit after the running ones are finished
+        self._stopping = True
+        if self._busy:
+            return
+
+        self._poll_timer.stop()
+        pools = self._pools.values()
+        self._pools = dict()
+        self._shutdown_pools(pools)
+
+    def _shutdown_pools(self, pools):
+        if not pools:
+            self.app.quit()
+            return
+
+        pool = pools.pop()
+        pool.shutdown(partial(self._shutdown_pools, pools))
+
+
+class Supervisor(object):
+    """
+    Starts a number of worker processes, feeds them with jobs and collects
+    the result dicts the browsers produce. Each worker gets at most
+    concurrency jobs at once, the rest wait in the supervisor.
+
+    A worker can die at any time, most likely from a segfault deep in QT,
+    taking all the jobs it was running with it. The supervisor knows which
+    jobs each worker held, so those are requeued and the worker is replaced
+    by a warm spare. A job which was running in more than max_job_crashes
+    crashed workers is reported as failed instead of being retried again.
+
+    Workers which reached their limits are replaced by a spare as soon as
+    they ask for it, and they just finish their running jobs meanwhile.
+    """
+    health_check_interval = 0.5
+
+    def __init__(self, processes=None, concurrency=2, options=None,
+                 spares=1, max_job_crashes=2, limits=None, log_options=None):
+        self.processes = processes or multiprocessing.cpu_count()
+        self.concurrency = concurrency
+        self.options = options or dict()
+        self.spares = spares
+        self.max_job_crashes = max_job_crashes
+        self.limits = limits
+        self.log_options = log_options
+
+        self.outbox = multiprocessing.Queue()
+        self._worker_ids = itertools.count()
+        self._workers = dict()
+        self._spares = []
+        self._draining = dict()
+        self._job_ids = itertools.count()
+        self._pending = []
+        self._in_flight = dict()
+        self._crash_counts = dict()
+        self._callback = None
+
+    def start(self):
+        for _ in range(self.processes):
+            worker = self._start_worker()
+            self._workers[worker['id']] = worker
+
+        for _ in range(self.spares):
+            self._spares.append(self._start_worker())
+
+    def _start_worker(self):
+        worker_id = next(self._worker_ids)
+        process = Worker(worker_id,
+                         multiprocessing.Queue(),
+                         self.outbox,
+                         self.options,
+                         self.concurrency,
+                         self.limits,
+                         self.log_options)
+        process.daemon = True
+        process.start()
+        return {'id': worker_id,
+                'process': process,
+                'ready': False,
+                'jobs': set()}
+
+    def submit(self, method, url, headers=None, raw_data=None,
+               browser_cls=Browser):
+        job = Job(next(self._job_ids), method, url, headers or dict(),
+                  raw_data, browser_cls)
+        self._pending.append(job)
+        return job.id
+
+    def _assign(self):
+        for worker in self._workers.values():
+            while self._pending and len(worker['jobs']) < self.concurrency:
+                job = self._pending.pop(0)
+                worker['jobs'].add(job.id)
+                self._in_flight[job.id] = job
+                worker['process'].inbox.put(job)
+
+    def _find_worker(self, worker_id):
+        try:
+            return self._workers[worker_id]
+        except KeyError:
+            if worker_id in self._draining:
+                return self._draining[worker_id]
+            for spare in self._spares:
+                if spare['id'] == worker_id:
+                    return spare
+
+    def _handle_message(self, message):
+        kind, worker_id, job_id, result = message
+        worker = self._find_worker(worker_id)
+
+        if kind == 'ready':
+            if worker is not None:
+                worker['ready'] = True
+        elif kind == 'recycle':
+            if worker_id in self._workers:
+                self._draining[worker_id] = self._workers.pop(worker_id)
+                self._promote_spare()
+        elif kind == 'result':
+            if worker is not None:
+                worker['jobs'].discard(job_id)
+            # a result may arrive for a job which was already requeued after
+            # its worker died, the job is then reported only once
+            if self._in_flight.pop(job_id, None) is not None:
+                self._crash_counts.pop(job_id, None)
+                self._callback(job_id, result)
+
+    def _drain_messages(self):
+        while True:
+            try:
+                message = self.outbox.get_nowait()
+            except Queue.Empty:
+                return
+            self._handle_message(message)
+
+    def _check_workers(self):
+        for spare in list(self._spares):
+            if not spare['process'].is_alive():
+                self._spares.remove(spare)
+                self._spares.append(self._start_worker())
+
+        for worker in self._workers.values():
+            if not worker['process'].is_alive():
+                self._worker_died(worker)
+
+        for worker in self._draining.values():
+            if not worker['process'].is_alive():
+                self._worker_drained(worker)
+
+    def _worker_drained(self, worker):
+        self._drain_messages()
+        del self._draining[worker['id']]
+        worker['process'].join()
+
+        if worker['process'].exitcode != 0:
+            # it crashed while draining, treat it like any other crash
+            self._requeue_jobs(worker)
+            return
+
+        # the jobs which were assigned before it asked to be recycled were
+        # never started, they are not to blame
+        for job_id in sorted(worker['jobs'], reverse=True):
+            self._pending.insert(0, self._in_flight.pop(job_id))
+
+    def _describe_exit(self, exitcode):
+        if exitcode is not None and exitcode < 0:
+            try:
+                return signal_names[-exitcode]
+            except KeyError:
+                return 'signal {0}'.format(-exitcode)
+        return 'exit code {0}'.format(exitcode)
+
+    def _worker_died(self, worker):
+        # results which were sent right before the crash are still valid
+        self._drain_messages()
+        del self._workers[worker['id']]
+        self._requeue_jobs(worker)
+        self._promote_spare()
+
+    def _requeue_jobs(self, worker):
+        reason = self._describe_exit(worker['process'].exitcode)
+        for job_id in sorted(worker['jobs']):
+            job = self._in_flight.pop(job_id)
+            crashes = self._crash_counts.get(job_id, 0) + 1
+            self._crash_counts[job_id] = crashes
+
+            if crashes > self.max_job_crashes:
+                # a poison job, it would just keep killing the workers
+                self._crash_counts.pop(job_id)
+                msg = 'Worker crashed ({0}) {1} times while running this job.'
+                self._callback(job_id, {'url': job.url,
+                                        'successful': False,
+                                        'html': u'',
+                                        'errors': [msg.format(reason,
+                                                              crashes)]})
+            else:
+                # put it back in front of the queue
+                self._pending.insert(0, job)
+
+    def _promote_spare(self):
+        # prefer a spare which already finished its start up
+        self._spares.sort(key=lambda spare: not spare['ready'])
+        try:
+            worker = self._spares.pop(0)
+        except IndexError:
+            worker = self._start_worker()
+
+        self._workers[worker['id']] = worker
+        if len(self._spares) < self.spares:
+            self._spares.append(self._start_worker())
+
+    def run(self, callback):
+        """
+        Block until all the submitted jobs are finished, passing each result
+        to callback(job_id, result) as it arrives.
+        """
+        self._callback = callback
+        self._assign()
+        while self._pending or self._in_flight:
+            try:
+                message = self.outbox.get(timeout=self.health_check_interval)
+            except Queue.Empty:
+                pass
+            else:
+                self._handle_message(message)
+
+            self._check_workers()
+            self._assign()
+
+    def shutdown(self):
+        workers = (self._workers.values() + self._draining.values() +
+                   self._spares)
+        for worker in workers:
+            worker['process'].inbox.put(None)
+
+        for worker in workers:
+            worker['process'].join()
+
+        self._workers = dict()
+        self._draining = dict()
+        self._spares = []
+
+
+def start_farm(urls, processes=None, concurrency=2):
+    supervisor = Supervisor(processes, concurrency, {'images': False,
+                                                     'javascript': True})
+    supervisor.start()
+    for url in urls:
+        supervisor.submit('get', url)
+
+    def report(job_id, result):
+        print job_id, result['url'], result['successful']
+
+    supervisor.run(report)
+    supervisor.shutdown()
+
+
+if __name__ == '__main__':
+    start_farm(sys.argv[1:])
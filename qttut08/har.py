@@ -0,0 +1,133 @@
+import json
+import datetime
+
+from urlparse import urlsplit, parse_qsl
+
+
+CREATOR = {'name': 'qttut08', 'version': '1.0'}
+
+
+def iso_time(timestamp):
+    moment = datetime.datetime.utcfromtimestamp(timestamp)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + '{0:03d}Z'.format(
+        moment.microsecond // 1000
+    )
+
+
+def milliseconds(seconds):
+    return int(round(seconds * 1000))
+
+
+def name_values(pairs):
+    return [{'name': name, 'value': value} for (name, value) in pairs]
+
+
+def request_entry(method, url, headers, body_size=0, post_data=None):
+    """
+    The request part of an entry, headers being (name, value) pairs, and
+    post_data a (mime type, text) pair if a body was sent.
+    """
+    query = parse_qsl(urlsplit(url).query, keep_blank_values=True)
+    entry = {'method': method,
+             'url': url,
+             'httpVersion': 'HTTP/1.1',
+             'cookies': [],
+             'headers': name_values(headers),
+             'queryString': name_values(query),
+             'headersSize': -1,
+             'bodySize': body_size}
+    if post_data is not None:
+        (mime_type, text) = post_data
+        entry['postData'] = {'mimeType': mime_type, 'text': text}
+    return entry
+
+
+def response_entry(status, status_text, headers, mime_type, size,
+                   redirect=''):
+    """
+    The response part of an entry, status being 0 for requests which never
+    got a response, and size the bytes of the body received.
+    """
+    return {'status': status,
+            'statusText': status_text,
+            'httpVersion': 'HTTP/1.1' if status else '',
+            'cookies': [],
+            'headers': name_values(headers),
+            'content': {'size': size, 'mimeType': mime_type},
+            'redirectURL': redirect,
+            'headersSize': -1,
+            'bodySize': size}
+
+
+def entry_timings(queued, waiting, receiving):
+    """
+    Timings in HAR terms from the phases of the timings module, in seconds.
+    The connection is not timed separately, it's a part of waiting.
+    """
+    return {'blocked': milliseconds(queued),
+            'dns': -1,
+            'connect': -1,
+            'send': 0,
+            'wait': milliseconds(waiting),
+            'receive': milliseconds(receiving)}
+
+
+class HarWriter(object):
+    """
+    Writes the requests of a page load to a HAR 1.2 file as they finish, so
+    they don't pile up in memory for large pages. The page itself is written
+    by close, once its title and load time are known.
+    """
+
+    def __init__(self, path, started, page_id='page_1'):
+        self.path = path
+        self.page_id = page_id
+        self._started = started
+        self._count = 0
+        self._file = open(path, 'w')
+        self._file.write('{{"log":{{"version":"1.2","creator":{0},'
+                         '"entries":['.format(json.dumps(CREATOR)))
+
+    @property
+    def closed(self):
+        return self._file is None
+
+    def add_entry(self, started, request, response, timings, **extra):
+        """
+        Write an entry, the keyword arguments are custom fields, which HAR
+        wants prefixed with an underscore, e.g. _error.
+        """
+        entry = {'pageref': self.page_id,
+                 'startedDateTime': iso_time(started),
+                 'time': sum(value for value in timings.values()
+                             if value > 0),
+                 'request': request,
+                 'response': response,
+                 'cache': {},
+                 'timings': timings}
+        entry.update(extra)
+        if self._count:
+            self._file.write(',')
+        self._file.write(json.dumps(entry, separators=(',', ':')))
+        self._count += 1
+
+    def close(self, title='', on_load=None):
+        """
+        Write the page and finish the file, on_load being the seconds the
+        page took to load, if it did.
+        """
+        if self._file is None:
+            return
+
+        page = {'startedDateTime': iso_time(self._started),
+                'id': self.page_id,
+                'title': title,
+                'pageTimings': {
+                    'onContentLoad': -1,
+                    'onLoad': -1 if on_load is None else milliseconds(on_load)
+                }}
+        self._file.write('],"pages":[{0}]}}}}'.format(
+            json.dumps(page, separators=(',', ':'))
+        ))
+        self._file.close()
+        self._file = None
@@ -15,12 +15,22 @@ class TestHTTPRequestHandler(BaseHTTPRequestHandler):
         delay = 0.1 + self.server.context.get('delay', 0)
         time.sleep(delay)
 
+        etag = self.server.context.get('etag', None)
+        if (etag is not None and
+                self.headers.getheader('If-None-Match') == etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
         response = self.server.context.get('response', None)
         if response is not None:
             self.send_response(response)
 
         for name, value in self.server.context.get('headers', {}).items():
             self.send_header(name, value)
+        if etag is not None:
+            self.send_header('ETag', etag)
 
         self.end_headers()
 
@@ -0,0 +1,273 @@
+import os
+import gzip
+import json
+import time
+import Queue
+import shutil
+import logging
+import threading
+
+
+class QueueHandler(logging.Handler):
+    """
+    Hands the records over to a queue instead of writing them, so whoever
+    logs never waits for the disk. The queue is bounded, records which
+    don't fit are dropped and counted. Python 2 doesn't have one of these.
+    """
+
+    def __init__(self, queue, listener=None):
+        logging.Handler.__init__(self)
+        self.queue = queue
+        # stopped along with the handler
+        self.listener = listener
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the message is formatted here, as the arguments may change once
+        # this returns, and the exception info can't be pickled or shared
+        record.msg = self.format(record)
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except Queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        logging.Handler.close(self)
+
+
+class QueueListener(object):
+    """
+    Takes the records off the queue in a background thread, and passes them
+    on to the handlers in batches of up to batch_size, flushing the handlers
+    once per batch. Records dropped by the queue handler are reported with a
+    warning written along with the next batch.
+    """
+
+    _sentinel = None
+
+    def __init__(self, queue, handlers, queue_handler=None, batch_size=500):
+        self.queue = queue
+        self.handlers = handlers
+        self.queue_handler = queue_handler
+        self.batch_size = batch_size
+        self._reported_drops = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        # don't keep the process alive just for the logs
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Write whatever is still queued and stop the thread.
+        """
+        if self._thread is None:
+            return
+        self.queue.put(self._sentinel)
+        self._thread.join()
+        self._thread = None
+
+    def _take_batch(self):
+        batch = [self.queue.get()]
+        while len(batch) < self.batch_size and batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _drops_record(self):
+        dropped = self.queue_handler and self.queue_handler.dropped
+        if not dropped or dropped == self._reported_drops:
+            return None
+
+        msg = '{0} log records dropped, the log queue was full.'.format(
+            dropped - self._reported_drops
+        )
+        self._reported_drops = dropped
+        return logging.makeLogRecord({'msg': msg,
+                                      'levelno': logging.WARNING,
+                                      'levelname': 'WARNING'})
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = self._take_batch()
+            if batch[-1] is self._sentinel:
+                batch.pop()
+                stopping = True
+
+            drops = self._drops_record()
+            if drops is not None:
+                batch.append(drops)
+            if not batch:
+                continue
+
+            for handler in self.handlers:
+                for record in batch:
+                    handler.handle(record)
+                handler.flush()
+
+        for handler in self.handlers:
+            handler.close()
+
+
+class RotatingFileHandler(logging.Handler):
+    """
+    Writes to a file which is rotated once it's larger than max_bytes, or
+    older than interval seconds, whichever comes first (either may be None).
+    Rotated files are renamed to file.1, file.2, ... with the oldest beyond
+    backup_count deleted, and gzipped if compress is set. Writes are not
+    flushed one by one, flush is up to the caller, e.g. a QueueListener.
+    """
+
+    def __init__(self, filename, max_bytes=None, interval=None,
+                 backup_count=5, compress=False):
+        logging.Handler.__init__(self)
+        self.filename = os.path.abspath(filename)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.compress = compress
+        self._stream = None
+        self._open()
+
+    def _open(self):
+        self._stream = open(self.filename, 'a')
+        self._size = self._stream.tell()
+        self._opened = time.time()
+
+    def _should_rotate(self, size):
+        if self.max_bytes is not None and self._size + size > self.max_bytes:
+            return self._size > 0
+        return (self.interval is not None and
+                time.time() - self._opened >= self.interval)
+
+    def _backup_name(self, number):
+        name = '{0}.{1}'.format(self.filename, number)
+        return name + '.gz' if self.compress else name
+
+    def _rotate(self):
+        self._stream.close()
+        for number in range(self.backup_count - 1, 0, -1):
+            source = self._backup_name(number)
+            if os.path.exists(source):
+                os.rename(source, self._backup_name(number + 1))
+
+        if self.backup_count > 0:
+            if self.compress:
+                with open(self.filename, 'rb') as source:
+                    with gzip.open(self._backup_name(1), 'wb') as target:
+                        shutil.copyfileobj(source, target)
+                os.remove(self.filename)
+            else:
+                os.rename(self.filename, self._backup_name(1))
+        else:
+            os.remove(self.filename)
+        self._open()
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + '\n'
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            if self._should_rotate(len(line)):
+                self._rotate()
+            self._stream.write(line)
+            self._size += len(line)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self._stream is not None:
+            self._stream.flush()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+        logging.Handler.close(self)
+
+
+def queued_file_handler(filename, formatter=None, max_queue=10000, **kwargs):
+    """
+    Return a handler writing to the file from a background thread, the
+    keyword arguments are those of RotatingFileHandler. Closing the handler
+    writes the records still queued.
+    """
+    file_handler = RotatingFileHandler(filename, **kwargs)
+    if formatter is not None:
+        file_handler.setFormatter(formatter)
+
+    queue = Queue.Queue(max_queue)
+    queue_handler = QueueHandler(queue)
+    listener = QueueListener(queue, [file_handler], queue_handler)
+    queue_handler.listener = listener
+    listener.start()
+    return queue_handler
+
+
+class JsonLinesLog(object):
+    """
+    A log of one compact JSON object per line, e.g. one per finished request,
+    which can be analyzed with ordinary tools. The lines are written by a
+    background thread in batches, see queued_file_handler, whose keyword
+    arguments are accepted too.
+    """
+
+    def __init__(self, filename, **kwargs):
+        self._handler = queued_file_handler(filename, **kwargs)
+
+    def write(self, entry):
+        line = json.dumps(entry, separators=(',', ':'))
+        self._handler.handle(logging.makeLogRecord({'msg': line,
+                                                    'levelno': logging.INFO}))
+
+    @property
+    def dropped(self):
+        return self._handler.dropped
+
+    def close(self):
+        self._handler.close()
+
+
+# path -> [log, number of users]
+_process_logs = dict()
+
+
+def open_process_log(filename):
+    """
+    Return the JsonLinesLog of this process for the filename, suffixed with
+    the process id, as the processes of a farm are given the same one. The
+    log is shared by all its users in the process, each of them has to
+    close it with close_process_log, the file is closed after the last one.
+    """
+    path = '{0}.{1}'.format(filename, os.getpid())
+    entry = _process_logs.get(path)
+    if entry is None:
+        entry = _process_logs[path] = [JsonLinesLog(path), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def close_process_log(log):
+    for (path, entry) in _process_logs.items():
+        if entry[0] is log:
+            entry[1] -= 1
+            if not entry[1]:
+                del _process_logs[path]
+                log.close()
+            return
@@ -1,16 +1,45 @@
 import os
+import time
+import tempfile
+import random
 import logging
+import sqlite3
+import itertools
+import collections
 
 from functools import partial
 
-from PySide.QtCore import (QByteArray, QIODevice, QBuffer, QFile,
-                           QUrl, QCryptographicHash, QTimer)
+from PySide.QtCore import (QByteArray, QIODevice, QBuffer, QFile, QObject,
+                           QUrl, QCryptographicHash, QTimer, QSize, Signal)
 from PySide.QtGui import QApplication
 from PySide.QtWebKit import QWebView, QWebPage, QWebSettings
 from PySide.QtNetwork import (QNetworkAccessManager, QNetworkRequest,
                               QNetworkReply, QSslCertificate, QSsl,
                               QSslConfiguration)
 
+from blocking import BlockingRules, guess_resource_type
+from diskcache import SharedDiskCache
+from cookiejar import PersistentCookieJar
+from records import RequestRecord
+from replies import (LocalReply, DeferredReply, FanOutReply, ReplyHub,
+                     RevalidatingReply)
+from retrying import backoff_delay, HostCircuitBreakers
+from scheduling import HostLimits, HostScheduler
+from uploads import MultipartBody
+from downloads import FileSink, CallbackSink
+from budgets import ContentPolicy
+from coalescing import request_key
+from validators import ValidatorStore
+from logutils import queued_file_handler, open_process_log, close_process_log
+from timings import breakdown, TimingStats
+from har import request_entry, response_entry, entry_timings, HarWriter
+
+
+# the requests and browsers of the process are numbered, so the entries of a
+# request log they share can be told apart
+request_numbers = itertools.count(1)
+browser_numbers = itertools.count(1)
+
 
 def smart_str(src):
     try:
@@ -19,16 +48,31 @@ def smart_str(src):
         return unicode(src).encode('utf-8')
 
 
+def raw_headers(obj):
+    """
+    The (name, value) pairs of a request's or reply's raw headers, the
+    values being latin-1 as far as http is concerned.
+    """
+    return [(str(name), str(obj.rawHeader(name)).decode('latin-1'))
+            for name in obj.rawHeaderList()]
+
+
 def make_abs_path(*args):
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(current_dir, *args)
 
 
-def get_log_handler(filename):
+def get_log_handler(filename, **kwargs):
+    """
+    The records are only queued by the returned handler, and written to the
+    file by a background thread, so the event loop never waits for the disk.
+    The keyword arguments set up the rotation of the file, see
+    logutils.RotatingFileHandler. Close the handler to write what's queued.
+    """
     log_path = make_abs_path(filename)
-    log_handler = logging.FileHandler(log_path)
-    log_handler.setFormatter(logging.Formatter('%(message)s'))
-    return log_handler
+    return queued_file_handler(log_path,
+                               logging.Formatter('%(message)s'),
+                               **kwargs)
 
 
 def install_certificates():
@@ -64,23 +108,110 @@ class ElementNotFound(Exception):
 
 class SmartNetworkAccessManager(QNetworkAccessManager):
 
-    def __init__(self, logger, max_request_retries):
+    # emitted with the key of the page whose last pending request finished
+    requests_idle = Signal(object)
+
+    # shared by all instances, the manager is passed in explicitly
+    _http_methods = {
+        QNetworkAccessManager.HeadOperation:
+        lambda manager, r, d: manager.head(r),
+        QNetworkAccessManager.GetOperation:
+        lambda manager, r, d: manager.get(r),
+        QNetworkAccessManager.PutOperation:
+        lambda manager, r, d: manager.put(r, d),
+        QNetworkAccessManager.PostOperation:
+        lambda manager, r, d: manager.post(r, d),
+        QNetworkAccessManager.DeleteOperation:
+        lambda manager, r, d: manager.deleteResource(r)
+    }
+
+    # errors telling that something is wrong with the host itself, rather
+    # than with the particular request
+    _host_failures = (QNetworkReply.ConnectionRefusedError,
+                      QNetworkReply.RemoteHostClosedError,
+                      QNetworkReply.HostNotFoundError,
+                      QNetworkReply.TimeoutError,
+                      QNetworkReply.TemporaryNetworkFailureError,
+                      QNetworkReply.UnknownNetworkError)
+    _host_failure_statuses = (502, 503, 504)
+
+    _operation_names = {QNetworkAccessManager.HeadOperation: 'HEAD',
+                        QNetworkAccessManager.GetOperation: 'GET',
+                        QNetworkAccessManager.PutOperation: 'PUT',
+                        QNetworkAccessManager.PostOperation: 'POST',
+                        QNetworkAccessManager.DeleteOperation: 'DELETE'}
+
+    # webkit only passes raw headers through to the network manager, this
+    # one tells which prepared upload body belongs to the request, and is
+    # removed before the request is sent
+    upload_header = 'X-Upload-Body'
+
+    # bytes of a download qt keeps in memory before it stops reading from
+    # the socket, until they are written to the sink
+    download_buffer_size = 256 * 1024
+    max_download_redirects = 10
+
+    def __init__(self, logger, max_request_retries, blocking_rules=None,
+                 retry_backoff=0.5, retry_backoff_cap=30.0,
+                 circuit_breakers=None, host_scheduler=None,
+                 content_policy=None, coalesce=False, validator_store=None,
+                 log_sample_rate=1, request_log=None, waterfall=False,
+                 browser_number=None):
         QNetworkAccessManager.__init__(self)
 
-        self._http_methods = {
-            QNetworkAccessManager.HeadOperation: lambda r, d: self.head(r),
-            QNetworkAccessManager.GetOperation: lambda r, d: self.get(r),
-            QNetworkAccessManager.PutOperation: lambda r, d: self.put(r, d),
-            QNetworkAccessManager.PostOperation: lambda r, d: self.post(r, d),
-            QNetworkAccessManager.DeleteOperation:
-            lambda r, d: self.deleteResource(r)
-        }
-
         self.logger = logger
+        # only 1 in log_sample_rate requests is dumped to the debug log
+        self._log_sample_rate = log_sample_rate
+        # a JsonLinesLog getting an entry for each finished request, which
+        # may be shared by many browsers, so the entries tell theirs apart
+        self._request_log = request_log
+        self._browser_number = browser_number
         self._max_request_retries = max_request_retries
+        self._blocking_rules = blocking_rules
+        # seconds, see backoff_delay
+        self._retry_backoff = retry_backoff
+        self._retry_backoff_cap = retry_backoff_cap
+        self._circuit_breakers = circuit_breakers
+        self._content_policy = content_policy
+        # identical GET requests in flight at the same time share a single
+        # request, its hub is found by the coalescing key
+        self._coalesce = coalesce
+        self._hubs = dict()
+        # GET responses with validators are remembered here, page key ->
+        # urls of the responses which were served from it as not modified
+        self._validator_store = validator_store
+        self._unchanged = dict()
+        # bytes received by the requests of each page, for the task budget
+        self._page_bytes = collections.Counter()
+        # requests over their host's limits wait in the scheduler's queues,
+        # the scheduler may be shared by many managers
+        self._scheduler = host_scheduler
+        self._queue_timer = QTimer(self)
+        self._queue_timer.setSingleShot(True)
+        self._queue_timer.timeout.connect(self._drain_queue)
+        # set once the manager is about to be deleted, see close
+        self._closing = False
 
         self._requests = dict()
-        self.errors = []
+        # ids of the replies still in flight, and their number per page and
+        # per host, kept up to date as requests start and finish
+        self._live = set()
+        self._page_pending = collections.Counter()
+        self._host_pending = collections.Counter()
+        # id(page) -> errors of the requests made by that page, requests
+        # which can't be attributed to any page are filed under None
+        self._pages = set()
+        self._errors = dict()
+        # uploads prepared for requests not made yet, by their token
+        self._uploads = dict()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0}
+        # wait times are in seconds
+        self.queue_stats = {'queued': 0, 'total_wait': 0.0, 'max_wait': 0.0}
+        self.coalesce_stats = {'coalesced': 0}
+        # latencies per host, and the timings of each task's requests
+        self.timing_stats = TimingStats(waterfall)
+        # page key -> the HarWriter its finished requests are written to
+        self._har_writers = dict()
 
         self.sslErrors.connect(self._ssl_errors)
         self.finished.connect(self._finished)
@@ -106,6 +237,15 @@ class SmartNetworkAccessManager(QNetworkAccessManager):
             msg = 'ERROR: {0} - {1}'.format(reply.error(), reply.errorString())
             self.logger.debug(msg)
 
+        if self.cache() is not None:
+            from_cache = reply.attribute(
+                QNetworkRequest.SourceIsFromCacheAttribute
+            )
+            msg = ('CACHE: {0} (hits: {hits}, misses: {misses}, '
+                   'bytes saved: {bytes_saved})')
+            self.logger.debug(msg.format('HIT' if from_cache else 'MISS',
+                                         **self.cache_stats))
+
         # Request headers
         self.logger.debug("REQUEST HEADERS:")
         for hdr in reply.request().rawHeaderList():
@@ -119,19 +259,30 @@ class SmartNetworkAccessManager(QNetworkAccessManager):
 
         self.logger.debug("-" * 50)
 
-    def log_post_data(self, data):
-        try:
-            raw_data = smart_str(data.peek(8192))
-        except AttributeError:
-            # data is None, nothing will be sent in this request
-            pass
+    def log_post_data(self, body):
+        if body is None:
+            # nothing will be sent in this request
+            return
+
+        if isinstance(body, QByteArray):
+            raw_data = smart_str(body.left(8192))
+        elif isinstance(body, MultipartBody):
+            raw_data = '<{0} bytes of {1}>'.format(body.size,
+                                                   body.content_type)
         else:
-            self.logger.debug('POST DATA: {0}'.format(raw_data))
+            raw_data = '<{0} bytes streamed from {1}>'.format(
+                body.size(), smart_str(body.fileName())
+            )
+        self.logger.debug('POST DATA: {0}'.format(raw_data))
 
     def log_ssl(self, reply):
         """
         Print ssl related informations to stdout.
         """
+        if not reply.attribute(QNetworkRequest.ConnectionEncryptedAttribute):
+            # no certificate to compute digests of
+            return
+
         ssl_status = reply.sslConfiguration()
         ssl_protocol = str(ssl_status.protocol())
 
@@ -151,6 +302,138 @@ class SmartNetworkAccessManager(QNetworkAccessManager):
         self.logger.debug('{0}'.format(certificate.publicKey().toPem()))
         self.logger.debug("-" * 50)
 
+    def _should_dump(self):
+        # decided once per request, as it's created, and kept on its record,
+        # dumping a reply formats every header, and computes digests of its
+        # certificate, which is wasted work if no handler wants debug messages
+        if not self.logger.isEnabledFor(logging.DEBUG):
+            return False
+        return (self._log_sample_rate <= 1 or
+                random.random() * self._log_sample_rate < 1)
+
+    def _add_timings(self, request):
+        entry = breakdown(request.created, request.queue_wait,
+                          request.responded, request.completed)
+        entry['started'] = request.created
+        entry['bytes'] = request.received
+        if self.timing_stats.waterfall:
+            reply = request.reply
+            status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            entry['url'] = smart_str(reply.url().toString())
+            entry['status'] = int(status) if status else None
+            if request.first_byte is not None:
+                entry['first_byte'] = int(
+                    (request.first_byte - request.created) * 1000
+                )
+        self.timing_stats.add(request.page, request.host, entry)
+
+    def timings_for(self, page_key):
+        """
+        The totals of the page's requests, along with their waterfall if the
+        manager keeps one.
+        """
+        timings = self.timing_stats.task_totals(page_key)
+        if self.timing_stats.waterfall:
+            timings['waterfall'] = self.timing_stats.waterfall_for(page_key)
+        return timings
+
+    def start_har(self, page_key, path):
+        """
+        Write the requests of the page finishing from now on to a HAR file
+        at the given path, until finish_har is called.
+        """
+        self.finish_har(page_key)
+        self._har_writers[page_key] = HarWriter(path, time.time())
+
+    def finish_har(self, page_key, title='', on_load=None):
+        """
+        Complete the page's HAR file and return its path, or None if there
+        is none. Requests finishing later are not in it.
+        """
+        har_writer = self._har_writers.pop(page_key, None)
+        if har_writer is None:
+            return None
+        har_writer.close(title, on_load)
+        return har_writer.path
+
+    def _har_post_data(self, request):
+        body = request.outgoing_data
+        if body is None:
+            return (0, None)
+
+        content_type = request.reply.request().header(
+            QNetworkRequest.ContentTypeHeader
+        )
+        mime_type = smart_str(content_type or '')
+        if isinstance(body, QByteArray):
+            text = str(body).decode('utf-8', 'replace')
+            return (body.size(), (mime_type, text))
+        elif isinstance(body, MultipartBody):
+            # streamed from the disk, so the content is not at hand
+            return (body.size, (body.content_type, ''))
+        return (body.size(), (mime_type, ''))
+
+    def _write_har_entry(self, har_writer, request):
+        reply = request.reply
+        url = smart_str(reply.url().toString())
+        (body_size, post_data) = self._har_post_data(request)
+        har_request = request_entry(
+            self._operation_names.get(reply.operation(), 'GET'),
+            url,
+            raw_headers(reply.request()),
+            body_size,
+            post_data
+        )
+
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        reason = reply.attribute(QNetworkRequest.HttpReasonPhraseAttribute)
+        redirect = reply.attribute(QNetworkRequest.RedirectionTargetAttribute)
+        if redirect:
+            redirect = smart_str(reply.url().resolved(redirect).toString())
+        content_type = reply.header(QNetworkRequest.ContentTypeHeader)
+        har_response = response_entry(int(status) if status else 0,
+                                      smart_str(reason or ''),
+                                      raw_headers(reply),
+                                      smart_str(content_type or ''),
+                                      request.received,
+                                      redirect or '')
+
+        phases = breakdown(request.created, request.queue_wait,
+                           request.responded, request.completed)
+        extra = dict()
+        if reply.error() != QNetworkReply.NoError:
+            extra['_error'] = smart_str(reply.errorString())
+        har_writer.add_entry(request.created,
+                             har_request,
+                             har_response,
+                             entry_timings(**phases),
+                             **extra)
+
+    def _log_entry(self, request):
+        reply = request.reply
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        redirect = reply.attribute(QNetworkRequest.RedirectionTargetAttribute)
+        if redirect:
+            redirect = smart_str(reply.url().resolved(redirect).toString())
+        return {'id': request.number,
+                'browser': self._browser_number,
+                'url': smart_str(reply.url().toString()),
+                'method': self._operation_names.get(reply.operation()),
+                'status': int(status) if status else None,
+                'redirect': redirect or None,
+                'error': int(reply.error()),
+                'retry_count': request.retry_count,
+                'bytes': request.received,
+                'started': request.created,
+                'duration': request.completed - request.created,
+                'queue_wait': request.queue_wait,
+                'from_cache': bool(reply.attribute(
+                    QNetworkRequest.SourceIsFromCacheAttribute
+                )),
+                'bytes_saved': request.bytes_saved,
+                'request_headers': dict(raw_headers(reply.request())),
+                'response_headers': dict(raw_headers(reply))}
+
     def _ssl_errors(self, reply, errors):
         # currently we ignore all ssl related errors
         for error in errors:
@@ -158,41 +441,296 @@ class SmartNetworkAccessManager(QNetworkAccessManager):
                                                 error.errorString())
             self.logger.debug(msg)
 
+    def _count_cache_use(self, reply):
+        # returns the bytes the cache saved, the size of the cached body, as
+        # chunked responses have no Content-Length
+        if (self.cache() is None or
+                reply.operation() != QNetworkAccessManager.GetOperation or
+                reply.error() != QNetworkReply.NoError):
+            return 0
+
+        if not reply.attribute(QNetworkRequest.SourceIsFromCacheAttribute):
+            self.cache_stats['misses'] += 1
+            return 0
+
+        self.cache_stats['hits'] += 1
+        cached = self.cache().data(reply.url())
+        if cached is None:
+            return 0
+        size = cached.size()
+        cached.close()
+        self.cache_stats['bytes_saved'] += size
+        return size
+
     def _finished(self, reply):
         # Called when a request is finished, whether it was successful or not.
         self.logger.info('Request {0} finished.'.format(id(reply)))
-        self.log_reply(reply)
-        self.log_ssl(reply)
+        bytes_saved = self._count_cache_use(reply)
+        request = self._requests.get(id(reply))
+        if request is None:
+            # the request was forgotten by a reset while it was still running,
+            # nothing else to do than to get rid of the reply object
+            reply.deleteLater()
+            return
+
+        request.bytes_saved = bytes_saved
+
+        if request.dump:
+            self.log_reply(reply)
+            self.log_ssl(reply)
+
+        if request.sink is not None:
+            # whatever arrived since the last readyRead
+            self._stream(request)
 
-        request = self._requests[id(reply)]
-        retry_count = request['retry_count']
+        request.completed = time.time()
+        self._add_timings(request)
+        if self._request_log is not None:
+            self._request_log.write(self._log_entry(request))
+        har_writer = self._har_writers.get(request.page)
+        if har_writer is not None:
+            self._write_har_entry(har_writer, request)
 
-        if (retry_count < self._max_request_retries and
+        if request.sink is not None and self._follow_redirect(request):
+            return
+        if request.rejection is not None:
+            # aborted by us for breaking the content policy, retrying it
+            # would only download the same thing again
+            errors = self.errors_for(request.page)
+            errors.append('ContentRejected: {0}'.format(request.rejection))
+            self._complete(request)
+            return
+
+        self._record_host_health(request, reply)
+
+        if (request.retry_count < self._max_request_retries and
             reply.error() in (QNetworkReply.TemporaryNetworkFailureError,
-                              QNetworkReply.ContentReSendError)):
+                              QNetworkReply.ContentReSendError) and
+                self._host_available(request.host) and
+                self._rewind_body(request)):
             # this request could be retried, it may succeed next time but
             # retry only if we didnt retry it already more than the allowed
-            # number of times
-            self.logger.info('Retrying request {0}'.format(id(reply)))
-            outgoing_data = request['outgoing_data']
-            http_method = self._http_methods[reply.operation()]
-            new_reply = http_method(reply.request(), outgoing_data)
-            # as a new reply object is created when we retry a failed one, we
-            # must pass the old retry_count value to the new one
-            self._requests[id(new_reply)]['retry_count'] = retry_count + 1
-
-        elif reply.error() not in (QNetworkReply.NoError,):
+            # number of times, the host isn't known to be down, and the body
+            # can be sent again
+            self._schedule_retry(request)
+            return
+
+        if reply.error() not in (QNetworkReply.NoError,):
             # request not successful and can't be retried
-            self.errors.append('{0}: {1}'.format(reply.error(),
-                                                 reply.errorString()))
+            self._add_error(request.page, reply.error(), reply.errorString())
+        elif reply.hasRawHeader(RevalidatingReply.unchanged_header):
+            unchanged = self._unchanged.setdefault(request.page, set())
+            unchanged.add(smart_str(reply.url().toString()))
+        self._complete(request)
+
+    def _add_error(self, page_key, error, error_string):
+        errors = self.errors_for(page_key)
+        errors.append('{0}: {1}'.format(error, error_string))
+
+    def _complete(self, request):
+        if request.sink is not None:
+            reply = request.reply
+            request.sink.close(smart_str(reply.url().toString()),
+                               reply.error() == QNetworkReply.NoError)
+            request.sink = None
+
         # as the request is finished, mark it as finished
-        self._requests[id(reply)]['finished'] = True
+        request.finished = True
+        self._untrack(request)
         # schedule the reply object for deletion
-        reply.deleteLater()
+        request.reply.deleteLater()
+        if self._scheduler is not None:
+            # let the next queued request to this host go
+            self._schedule_queue(0)
+
+        if not self.pending_count_for(request.page):
+            if self._validator_store is not None:
+                # what the page stored is written while it's quiet
+                self._validator_store.flush()
+            self.requests_idle.emit(request.page)
+
+    def _schedule_retry(self, request):
+        # the retry is not reissued right away, but after a randomized,
+        # exponentially growing delay
+        delay = backoff_delay(request.retry_count,
+                              self._retry_backoff,
+                              self._retry_backoff_cap)
+        self.logger.info('Retrying request {0} in {1:.2f}s.'.format(
+            id(request.reply), delay
+        ))
+        timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(partial(self._retry, request))
+        request.retry_timer = timer
+        # the request stays pending in the meantime, until it's retried, or
+        # cancelled as the page's next task starts
+        timer.start(int(delay * 1000))
+
+    def _retry(self, request):
+        request.retry_timer.deleteLater()
+        request.retry_timer = None
+
+        reply = request.reply
+        self.logger.info('Retrying request {0}'.format(id(reply)))
+        body = request.outgoing_data
+        network_request = reply.request()
+        if isinstance(body, MultipartBody):
+            # its files are opened again, instead of keeping a copy around
+            self.prepare_upload(network_request, body, request.page)
+            body = QByteArray()
+        http_method = self._http_methods[reply.operation()]
+        new_reply = http_method(self, network_request, body)
+        # as a new reply object is created when we retry a failed one, we
+        # must pass the old retry_count value to the new one
+        new_request = self._requests.get(id(new_reply))
+        if new_request is not None:
+            new_request.retry_count = request.retry_count + 1
+        self._pass_sink(request, new_request)
+        # the old reply is kept until now, as its request and upload data
+        # were needed for the retry
+        self._complete(request)
+
+    def download(self, request, operation, data, sink):
+        """
+        Make the request without webkit, and stream the body of the reply
+        into the sink as it arrives, instead of keeping it in memory.
+        Return False if the request was blocked, in which case nothing will
+        ever be written to the sink.
+        """
+        reply = self._http_methods[operation](self, request, data)
+        record = self._requests.get(id(reply))
+        if record is None:
+            sink.close(smart_str(request.url().toString()), False)
+            return False
+
+        self._attach_sink(record, sink)
+        return True
+
+    def _attach_sink(self, record, sink):
+        record.sink = sink
+        sink.url = smart_str(record.reply.url().toString())
+        record.reply.setReadBufferSize(self.download_buffer_size)
+        record.reply.readyRead.connect(partial(self._stream, record))
+
+    def _pass_sink(self, request, new_request):
+        # the download continues with the reply of a retry or redirect
+        sink = request.sink
+        if sink is None:
+            return
+
+        request.sink = None
+        if new_request is None:
+            sink.close(sink.url, False)
+        else:
+            sink.restart()
+            self._attach_sink(new_request, sink)
+
+    def _stream(self, request):
+        if request.sink is None:
+            # passed on to a newer reply already
+            return
+
+        data = request.reply.readAll()
+        if not data.isEmpty():
+            request.sink.write(data.data())
+
+    def _follow_redirect(self, request):
+        # webkit follows the redirects of the pages it loads, downloads have
+        # to do that themselves
+        reply = request.reply
+        target = reply.attribute(QNetworkRequest.RedirectionTargetAttribute)
+        if (not target or reply.error() != QNetworkReply.NoError or
+                request.redirects >= self.max_download_redirects):
+            return False
+
+        network_request = QNetworkRequest(reply.request())
+        network_request.setUrl(reply.url().resolved(target))
+        self.logger.info('Download {0} redirected to {1}.'.format(
+            id(reply), smart_str(network_request.url().toString())
+        ))
+        new_reply = self.get(network_request)
+        new_request = self._requests.get(id(new_reply))
+        if new_request is not None:
+            new_request.redirects = request.redirects + 1
+        self._pass_sink(request, new_request)
+        self._complete(request)
+        return True
+
+    def _cancel_retry(self, request):
+        request.retry_timer.stop()
+        request.retry_timer.deleteLater()
+        request.retry_timer = None
+        self._add_error(request.page,
+                        QNetworkReply.OperationCanceledError,
+                        'Operation canceled')
+        self._complete(request)
+
+    def _host_available(self, host):
+        if self._circuit_breakers is None:
+            return True
+        return self._circuit_breakers.allow(host)
+
+    def _record_host_health(self, request, reply):
+        if (self._circuit_breakers is None or
+                isinstance(reply, LocalReply) or
+                reply.error() == QNetworkReply.OperationCanceledError):
+            # local replies say nothing about the host, and aborted requests
+            # were aborted by us
+            return
+
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if (reply.error() in self._host_failures or
+                (status and int(status) in self._host_failure_statuses)):
+            self._circuit_breakers.record_failure(request.host)
+        else:
+            self._circuit_breakers.record_success(request.host)
+
+    def _track(self, request):
+        self._live.add(id(request.reply))
+        self._page_pending[request.page] += 1
+        self._host_pending[request.host] += 1
 
-    def _reply_destroyed(self, reply_id):
+    def _untrack(self, request):
+        try:
+            self._live.remove(id(request.reply))
+        except KeyError:
+            # already finished
+            return
+
+        self._page_pending[request.page] -= 1
+        if not self._page_pending[request.page]:
+            del self._page_pending[request.page]
+
+        self._host_pending[request.host] -= 1
+        if not self._host_pending[request.host]:
+            del self._host_pending[request.host]
+
+        if request.host_slot:
+            # the queue is drained by the caller, this may be called while
+            # the manager itself is being destroyed
+            request.host_slot = False
+            self._scheduler.release(request.host)
+            if self._closing:
+                self._hand_over_queue()
+
+    def _hand_over_queue(self):
+        # the timer of a closing manager may never fire, a manager which still
+        # has requests queued in the shared scheduler drains it instead
+        for entry in self._scheduler.queued():
+            manager = entry[0]
+            if not manager._closing:
+                manager._schedule_queue(0)
+                return
+
+    def _reply_destroyed(self, reply):
+        # the reply is half destroyed already, only its QObject part can be
+        # touched, that's where the id of its record was stored
+        reply_id = int(reply.property('record_id'))
         self.logger.info('Reply {0} destroyed.'.format(reply_id))
-        self._requests.pop(reply_id, None)
+        request = self._requests.pop(reply_id, None)
+        if request is not None:
+            # destroyed without ever finishing
+            self._untrack(request)
 
     def _new_buffer(self, raw_data):
         buff = QBuffer()
@@ -200,44 +738,464 @@ class SmartNetworkAccessManager(QNetworkAccessManager):
         buff.open(QIODevice.ReadOnly)
         return buff
 
+    def _outgoing_body(self, data):
+        # what is kept of the upload data to send it, and resend it if the
+        # request is retried, files are streamed straight from the disk,
+        # anything else (webkit's form data is a sequential device) is read
+        # once into an implicitly shared byte array, which every buffer sent
+        # refers to without copying it, a buffer's own array is kept as is
+        if data is None:
+            return None
+        if isinstance(data, QFile):
+            return data
+        if isinstance(data, QBuffer):
+            return data.data()
+        return data.readAll()
+
+    def _rewind_body(self, request):
+        # a file can be sent again only if it can be read from the beginning
+        body = request.outgoing_data
+        if not isinstance(body, QIODevice):
+            return True
+        return body.reset()
+
+    def _blocked(self, request):
+        if self._blocking_rules is None:
+            return False
+
+        url = smart_str(request.url().toString())
+        accept = str(request.rawHeader('Accept'))
+        rule = self._blocking_rules.match(url, accept)
+        if rule is None:
+            return False
+
+        self.logger.info('Request to {0} blocked by {1}.'.format(url, rule))
+        return True
+
     def _create_request(self, operation, request, data):
-        self.log_post_data(data)
+        (request, body) = self._take_upload(request)
+        if self._blocked(request):
+            # answer it with an empty reply, without touching the network
+            return LocalReply(self, operation, request)
+
+        host = str(request.url().host())
+        if not self._host_available(host):
+            # the host is down, fail fast instead of waiting for it to time
+            # out again, the failure is reported like any other
+            self.logger.info('Circuit open for {0}, request failed.'.format(
+                host
+            ))
+            error = (QNetworkReply.UnknownNetworkError,
+                     'Circuit breaker open for host {0}'.format(host))
+            reply = LocalReply(self, operation, request, status=None,
+                               error=error)
+            self._add_record(reply, None, request)
+            return reply
+
         # store the request object with the upload data
-        try:
-            raw_data = data.readAll()
-        except AttributeError:
-            original_data = backup_data = None
+        if body is None:
+            body = self._outgoing_body(data)
+        dump = self._should_dump()
+        if dump:
+            self.log_post_data(body)
+
+        key = self._coalescing_key(operation, request)
+        hub = self._hubs.get(key)
+        if hub is not None:
+            # the same request is in flight already, its response is shared
+            reply = FanOutReply(self, operation, request, hub)
+            hub.subscribe(reply)
+            self.logger.info('Request {0} joined a running one.'.format(
+                id(reply)
+            ))
+            self.coalesce_stats['coalesced'] += 1
+            self._add_record(reply, body, request, dump)
+            return reply
+
+        if self._scheduler is None or self._scheduler.acquire(host):
+            reply = self._send(operation, request, body)
+            if key is not None:
+                reply = self._share(operation, request, reply, key)
+            self.logger.info('Request {0} started.'.format(id(reply)))
+            record = self._add_record(reply, body, request, dump)
+            record.host_slot = self._scheduler is not None
+            return reply
+
+        # over the host's limits, the real request is made once it gets out
+        # of the queue, a stand-in reply is returned until then
+        reply = DeferredReply(self, operation, request)
+        self.logger.info('Request {0} queued.'.format(id(reply)))
+        record = self._add_record(reply, body, request, dump)
+        # the request passed in is only valid during this call
+        entry = (self, record, operation, QNetworkRequest(request),
+                 time.time())
+        self._scheduler.enqueue(host, entry)
+        self.queue_stats['queued'] += 1
+        self._schedule_queue()
+        return reply
+
+    def prepare_upload(self, request, body, page_key=None):
+        """
+        Make the given request, once it reaches the manager, upload the body
+        instead of whatever data it carries, which is how bodies too large
+        to be kept in memory get through webkit. The body is dropped if the
+        page making the request is reset or unregistered before that.
+        """
+        token = str(id(body))
+        self._uploads[token] = (page_key, body)
+        request.setRawHeader(self.upload_header, token)
+
+    def _take_upload(self, request):
+        token = str(request.rawHeader(self.upload_header))
+        (_, body) = self._uploads.pop(token, (None, None))
+        if body is None:
+            return (request, None)
+
+        request = QNetworkRequest(request)
+        # a null value removes the header
+        request.setRawHeader(self.upload_header, QByteArray())
+        request.setHeader(QNetworkRequest.ContentTypeHeader,
+                          body.content_type)
+        # sequential devices are buffered whole, unless the length is known
+        request.setHeader(QNetworkRequest.ContentLengthHeader, body.size)
+        return (request, body)
+
+    def _send(self, operation, request, body):
+        if (self._validator_store is not None and
+                operation == QNetworkAccessManager.GetOperation and
+                not request.hasRawHeader('If-None-Match') and
+                not request.hasRawHeader('If-Modified-Since') and
+                self._revalidated(request)):
+            return self._send_revalidating(operation, request)
+
+        if isinstance(body, QByteArray):
+            # a buffer only keeps a reference to the implicitly shared array,
+            # so the data is never copied, however many times it is sent
+            device = self._new_buffer(body)
+        elif isinstance(body, MultipartBody):
+            device = body.open()
         else:
-            original_data = self._new_buffer(raw_data)
-            backup_data = self._new_buffer(raw_data)
+            device = body
 
         reply = QNetworkAccessManager.createRequest(self,
                                                     operation,
                                                     request,
-                                                    original_data)
-        self.logger.info('Request {0} started.'.format(id(reply)))
+                                                    device)
+        if device is not body:
+            device.setParent(reply)
+        return reply
 
-        if original_data is not None:
-            original_data.setParent(reply)
-            backup_data.setParent(reply)
+    def _revalidated(self, request):
+        # only the resource types the store keeps are captured, by default
+        # the documents, the rest is left to the disk cache
+        path = smart_str(request.url().path())
+        accept = str(request.rawHeader('Accept'))
+        resource_type = guess_resource_type(path, accept)
+        return resource_type in self._validator_store.resource_types
 
-        self._requests[id(reply)] = {'reply': reply,
-                                     'outgoing_data': backup_data,
-                                     'finished': False,
-                                     'retry_count': 0}
-        # in case the request object is destroyed, remove it from the dict
-        # of request objects
-        reply.destroyed.connect(partial(self._reply_destroyed, id(reply)))
+    def _send_revalidating(self, operation, request):
+        url = smart_str(request.url().toString())
+        try:
+            entry = self._validator_store.get(url)
+        except sqlite3.OperationalError:
+            # locked by another process for too long, fetched in full
+            entry = None
+        request = QNetworkRequest(request)
+        if entry is not None:
+            if entry['etag']:
+                request.setRawHeader('If-None-Match', entry['etag'])
+            if entry['last_modified']:
+                request.setRawHeader('If-Modified-Since',
+                                     entry['last_modified'])
+            # the server has to see the validators, not the disk cache
+            request.setAttribute(QNetworkRequest.CacheLoadControlAttribute,
+                                 QNetworkRequest.AlwaysNetwork)
+
+        upstream = QNetworkAccessManager.createRequest(self,
+                                                       operation,
+                                                       request,
+                                                       None)
+        reply = RevalidatingReply(self, operation, request,
+                                  self._validator_store, entry)
+        reply.attach(upstream)
+        return reply
+
+    def unchanged_for(self, page_key):
+        """
+        The urls whose responses were served as not modified to the page.
+        """
+        return self._unchanged.get(page_key, set())
+
+    def _coalescing_key(self, operation, request):
+        # queued requests are never shared, only those sent right away
+        if (not self._coalesce or
+                operation != QNetworkAccessManager.GetOperation):
+            return None
+
+        headers = [(str(name), str(request.rawHeader(name)))
+                   for name in request.rawHeaderList()]
+        return request_key(smart_str(request.url().toString()), headers)
+
+    def _share(self, operation, request, upstream, key):
+        hub = ReplyHub(self, upstream, self._hub_closed)
+        hub.key = key
+        self._hubs[key] = hub
+        reply = FanOutReply(self, operation, request, hub)
+        hub.subscribe(reply)
         return reply
 
-    def abort_requests(self):
-        for request in self._requests.values():
-            request['reply'].abort()
+    def _hub_closed(self, hub):
+        if self._hubs.get(hub.key) is hub:
+            del self._hubs[hub.key]
+
+    def _schedule_queue(self, delay=None):
+        if delay is None:
+            delay = self._scheduler.next_delay()
+            if delay is None:
+                # the queued requests wait for a slot, not for time to pass
+                return
+        self._queue_timer.start(int(delay * 1000))
+
+    def _drain_queue(self):
+        # a shared scheduler hands out the requests queued by other managers
+        # too, they are started by the manager which queued them, requests
+        # aborted while queued are not alive anymore
+        is_alive = lambda entry: id(entry[1].reply) in entry[0]._live
+        for entry in self._scheduler.ready(is_alive):
+            manager = entry[0]
+            manager._start_queued(*entry[1:])
+
+        self._schedule_queue()
+
+    def _start_queued(self, record, operation, request, enqueued):
+        record.host_slot = True
+        record.queue_wait = time.time() - enqueued
+        self.queue_stats['total_wait'] += record.queue_wait
+        self.queue_stats['max_wait'] = max(self.queue_stats['max_wait'],
+                                           record.queue_wait)
+
+        upstream = self._send(operation, request, record.outgoing_data)
+        record.reply.attach(upstream)
+        msg = 'Request {0} started after {1:.2f}s in queue.'
+        self.logger.info(msg.format(id(record.reply), record.queue_wait))
+
+    def _add_record(self, reply, outgoing_data, request, dump=False):
+        record = RequestRecord(reply,
+                               outgoing_data,
+                               self._page_key(request),
+                               str(request.url().host()),
+                               next(request_numbers))
+        record.dump = dump
+        self._requests[id(reply)] = record
+        self._track(record)
+        # in case the request object is destroyed, remove it from the dict
+        # of request objects, all replies share the same slot, which finds
+        # the record by the id stored on the reply itself, as a string, as
+        # a 64 bit id may not survive the conversion to a QVariant int
+        reply.setProperty('record_id', str(id(reply)))
+        reply.destroyed[QObject].connect(self._reply_destroyed)
+
+        # the same way, through the sender, so nothing is created per reply,
+        # and progress is followed only if something counts the bytes
+        reply.metaDataChanged.connect(self._responded)
+        if self.timing_stats.waterfall:
+            reply.readyRead.connect(self._first_byte)
+        if (self._content_policy is not None or
+                self._request_log is not None or
+                self.timing_stats.waterfall or
+                record.page in self._har_writers):
+            reply.downloadProgress.connect(self._download_progress)
+        return record
+
+    def _sender_record(self):
+        # the record of the reply which emitted the signal being handled,
+        # unless it was forgotten already
+        reply_id = int(self.sender().property('record_id'))
+        return self._requests.get(reply_id)
+
+    def _responded(self):
+        request = self._sender_record()
+        if request is None:
+            return
+
+        if request.responded is None:
+            # may be emitted more than once, the first time counts
+            request.responded = time.time()
+        if self._content_policy is not None:
+            self._check_meta_data(request)
+
+    def _first_byte(self):
+        request = self._sender_record()
+        if request is not None and request.first_byte is None:
+            request.first_byte = time.time()
+        # only the first one counts
+        self.sender().readyRead.disconnect(self._first_byte)
+
+    def _check_meta_data(self, request):
+        reply = request.reply
+        content_type = reply.header(QNetworkRequest.ContentTypeHeader)
+        reason = self._content_policy.check_mime_type(content_type)
+        if reason is None:
+            # refuse early what would be too large, if the size is known
+            size = int(reply.header(QNetworkRequest.ContentLengthHeader) or 0)
+            reason = self._content_policy.check_size(
+                size, self._page_bytes[request.page] + size
+            )
+        if reason is not None:
+            self._reject(request, reason)
+
+    def _download_progress(self, received, total):
+        request = self._sender_record()
+        if request is None:
+            return
+
+        self._page_bytes[request.page] += received - request.received
+        request.received = received
+        if self._content_policy is None:
+            return
+
+        reason = self._content_policy.check_size(
+            received, self._page_bytes[request.page]
+        )
+        if reason is not None:
+            self._reject(request, reason)
+
+    def _reject(self, request, reason):
+        if request.rejection is not None or request.reply.isFinished():
+            return
+
+        self.logger.info('Request {0} rejected, {1}.'.format(
+            id(request.reply), reason
+        ))
+        request.rejection = reason
+        request.reply.abort()
+
+    def register_page(self, page):
+        """
+        Pages sharing this manager must be registered, so the requests they
+        make can be attributed to them.
+        """
+        self._pages.add(id(page))
+
+    def unregister_page(self, page):
+        self._pages.discard(id(page))
+        self._drop_uploads(id(page))
+        self._errors.pop(id(page), None)
+        self._page_bytes.pop(id(page), None)
+        self._unchanged.pop(id(page), None)
+        self.timing_stats.forget(id(page))
+        self.finish_har(id(page))
+
+    def start_task(self, page_key):
+        """
+        Forget what was counted for the previous task of the given page, as
+        the next one starts. The errors already reported keep their list.
+        """
+        for request in self._page_requests(page_key):
+            if request.retry_timer is not None:
+                # its retry would be attributed to the next task
+                self._cancel_retry(request)
+        self._errors.pop(page_key, None)
+        self._page_bytes.pop(page_key, None)
+        self._unchanged.pop(page_key, None)
+        # the timings of the previous task's requests don't belong to this one
+        self.timing_stats.forget(page_key)
+
+    def _page_key(self, request):
+        # webkit sets the frame which made the request as the originating
+        # object, and frames are children of their parent frame, with the
+        # main frame being a child of the page itself
+        obj = request.originatingObject()
+        while obj is not None:
+            if id(obj) in self._pages:
+                return id(obj)
+            obj = obj.parent()
+
+    def _drop_uploads(self, page_key=None):
+        # uploads prepared for requests which will never be made
+        for (token, (page, _)) in self._uploads.items():
+            if page_key is None or page == page_key:
+                del self._uploads[token]
+
+    def errors_for(self, page_key):
+        return self._errors.setdefault(page_key, [])
+
+    def _page_requests(self, page_key):
+        return [req for req in self._requests.values()
+                if page_key is None or req.page == page_key]
+
+    def close(self):
+        """
+        Abort all the requests, as the manager is about to be deleted. The
+        slots they free in a shared scheduler go to the requests of the
+        other managers.
+        """
+        self._closing = True
+        self.abort_requests()
+
+    def abort_requests(self, page_key=None):
+        """
+        Abort the requests made by the given page, or all of them if no page
+        is specified.
+        """
+        for request in self._page_requests(page_key):
+            if request.retry_timer is not None:
+                # finished already, only waiting to be retried
+                self._cancel_retry(request)
+            else:
+                request.reply.abort()
+
+    def reset(self, page_key=None):
+        """
+        Forget everything about the previous task of the given page (or all
+        pages), so the manager can be reused by the next one.
+        """
+        self.abort_requests(page_key)
+        # aborted replies are still scheduled for deletion in _finished, they
+        # just won't be tracked anymore
+        for request in self._page_requests(page_key):
+            self._requests.pop(id(request.reply), None)
+            self._untrack(request)
+        if self._scheduler is not None:
+            # slots of the other pages' queued requests may have been freed
+            self._schedule_queue(0)
+        self._drop_uploads(page_key)
+        # results already reported keep their own list of errors
+        if page_key is None:
+            self._errors = dict()
+            self._page_bytes.clear()
+            self._unchanged.clear()
+            for page in list(self._har_writers):
+                self.finish_har(page)
+        else:
+            self._errors.pop(page_key, None)
+            self._page_bytes.pop(page_key, None)
+            self._unchanged.pop(page_key, None)
+            self.finish_har(page_key)
+        self.timing_stats.forget(page_key)
+
+    def active_requests_for(self, page_key):
+        if page_key is None:
+            return list(self._live)
+        return [reply_id for reply_id in self._live
+                if self._requests[reply_id].page == page_key]
 
     @property
     def active_requests(self):
-        return [id(req['reply']) for req in self._requests.values()
-                if not req['finished']]
+        return self.active_requests_for(None)
+
+    def pending_count_for(self, page_key):
+        if page_key is None:
+            return len(self._live)
+        return self._page_pending[page_key]
+
+    @property
+    def pending_count(self):
+        return len(self._live)
+
+    @property
+    def pending_by_host(self):
+        return dict(self._host_pending)
 
 
 class CraftyWebPage(QWebPage):
@@ -251,77 +1209,77 @@ class CraftyWebPage(QWebPage):
                 'Chrome/18.0.1025.142 Safari/535.19')
 
 
-class Browser(object):
+class BrowserTab(object):
+    """
+    A single page driven by a Browser. Every tab has its own task state,
+    timeout timer and result callback, while the network manager (along with
+    its cookie jar and cache) is shared by all the tabs of a browser.
+    """
 
-    def __init__(self, callback, logger, options=None):
+    def __init__(self, callback, logger, network_manager, settings, timeout,
+                 viewport=None, network_quiet=100, har_dir=None):
         self.logger = logger
-        options = options or dict()
-
-        self._request_ops = {'head': QNetworkAccessManager.HeadOperation,
-                             'get': QNetworkAccessManager.GetOperation,
-                             'put': QNetworkAccessManager.PutOperation,
-                             'post': QNetworkAccessManager.PostOperation,
-                             'delete': QNetworkAccessManager.DeleteOperation}
-
-        self._timeout = int(options.pop('timeout', 30)) * 1000
+        self._timeout = timeout
+        self._network_manager = network_manager
+        network_manager.requests_idle.connect(self._requests_idle)
 
-        max_request_retries = options.pop('max_request_retries', 3)
-        self._network_manager = SmartNetworkAccessManager(logger,
-                                                          max_request_retries)
         self._web_page = CraftyWebPage()
-        self._web_page.setNetworkAccessManager(self._network_manager)
+        self._web_page.setNetworkAccessManager(network_manager)
+        network_manager.register_page(self._web_page)
+        self._page_key = id(self._web_page)
 
-        self._web_view = QWebView()
-        self._web_view.setPage(self._web_page)
+        if viewport is None:
+            self._web_view = QWebView()
+            self._web_view.setPage(self._web_page)
+        else:
+            # headless mode, nothing is ever shown anyway so the widget is
+            # not needed, the page has a fixed viewport to lay out the
+            # content, which is what gives the elements their geometry
+            self._web_view = None
+            self._web_page.setViewportSize(QSize(*viewport))
 
         # connect the loadFinished signal to a method defined by us.
         # loadFinished is the signal which is triggered when a page is loaded
-        self._web_view.loadFinished.connect(self._load_finished)
-
-        settings = self._web_view.settings()
-        settings.setAttribute(QWebSettings.AutoLoadImages,
-                              options.pop('images', False))
-        settings.setAttribute(QWebSettings.JavascriptEnabled,
-                              options.pop('javascript', False))
-        settings.setAttribute(QWebSettings.JavascriptCanOpenWindows,
-                              options.pop('popups', False))
-        settings.setAttribute(QWebSettings.PrivateBrowsingEnabled,
-                              options.pop('private_browsing', False))
-        settings.setAttribute(QWebSettings.JavaEnabled, False)
-        settings.setAttribute(QWebSettings.PluginsEnabled, False)
-        settings.setAttribute(QWebSettings.DnsPrefetchEnabled, True)
+        self._web_page.loadFinished.connect(self._load_finished)
+
+        web_settings = self._web_page.settings()
+        for (attribute, value) in settings.items():
+            web_settings.setAttribute(attribute, value)
 
         # store the callback function which will be called when a request is
         # finished
         self._result_callback = callback
         self._is_task_finished = False
+        self._timeout_timer = None
+        self._reset_callback = None
+        # when loadFinished is emitted while requests are still running, the
+        # result is returned once the network was quiet for network_quiet ms
+        self._pending_load = None
+        self._quiet_timer = QTimer()
+        self._quiet_timer.setSingleShot(True)
+        self._quiet_timer.setInterval(network_quiet)
+        self._quiet_timer.timeout.connect(self._network_quiet)
+        # the sink of the current task, if it's a download
+        self._download = None
+        self._task_started = None
+        # each task's requests are written to a HAR file in this directory
+        self._har_dir = har_dir
+        self._javascript_enabled = web_settings.testAttribute(
+            QWebSettings.JavascriptEnabled
+        )
         self._destroyed_status = dict()
 
-    def _prepare_request(self, url, headers):
-        # create an empty request
-        request = QNetworkRequest()
-        # assign a url to it
-        request.setUrl(QUrl(url))
-
-        # add some custom headers to the request
-        for (header_name, header_value) in headers.items():
-            request.setRawHeader(header_name, QByteArray(header_value))
-
-        return request
-
-    def _urlencode_request_data(self, raw_data):
-        # the data which we want to send to the server must be urlencoded
-        request_data = QUrl()
-        for (name, value) in raw_data.items():
-            request_data.addQueryItem(name, unicode(value))
-
-        return request_data.encodedQuery()
-
     def _load_finished(self, ok):
         """
         Called when the page is fully loaded. It will get the html file of
         the loaded page and call the callback function with that result.
         """
+        if self._reset_callback is not None:
+            # the blank page requested by reset is loaded, the tab is clean
+            # and ready to accept a new task
+            self._reset_finished()
+            return
+
         if self._is_task_finished:
             # in case loadFinished fires more than once and we already
             # reported back with a result, don't do that again
@@ -329,36 +1287,81 @@ class Browser(object):
                              'finished.')
             return
 
-        pending_requests = self._network_manager.active_requests
+        manager = self._network_manager
+        pending_count = manager.pending_count_for(self._page_key)
+        errors = manager.errors_for(self._page_key)
 
         if ok == 'timed_out':
             self.logger.info('loadFinished emitted, request timed out.')
-            self._network_manager.errors.append('Request timed out.')
+            errors.append('Request timed out.')
             # to avoid treating the request by the driver as successful
             ok = False
-        elif len(pending_requests) > 0:
-            self.logger.info("loadFinished emitted, waiting for requests:"
-                             " {0}".format(pending_requests))
-            loaded = partial(lambda x: self._load_finished(x), ok)
-            QTimer.singleShot(1000, loaded)
+        elif pending_count > 0:
+            self.logger.info("loadFinished emitted, waiting for {0} "
+                             "requests.".format(pending_count))
+            self._pending_load = ok
             return
 
         self.logger.info('loadFinshed emitted, returning result.')
-        frame = self._web_view.page().mainFrame()
-        url = smart_str(frame.url().toString())
-        html = frame.toHtml()
+        if self._download is not None:
+            # the body is in the sink already, not in the page
+            result = self._download.result()
+            result['successful'] = bool(ok and result['successful'])
+        else:
+            frame = self._web_page.mainFrame()
+            url = smart_str(frame.url().toString())
+            html = frame.toHtml()
+
+            result = {'html': html,
+                      'url': url,
+                      'successful': ok}
+
+        if errors:
+            result['errors'] = errors
+        if result['url'] in manager.unchanged_for(self._page_key):
+            # same as the last time, processing it again can be skipped
+            result['unchanged'] = True
+        if manager.timing_stats.waterfall:
+            timings = manager.timings_for(self._page_key)
+            # the difference to the span of the requests is the time spent
+            # waiting for the page to settle
+            timings['elapsed'] = time.time() - self._task_started
+            result['timings'] = timings
+        if self._har_dir is not None:
+            title = smart_str(self._web_page.mainFrame().title())
+            on_load = time.time() - self._task_started
+            result['har'] = manager.finish_har(self._page_key, title, on_load)
 
-        result = {'html': html,
-                  'url': url,
-                  'successful': ok}
+        self._finish_task(result)
 
-        if self._network_manager.errors:
-            result['errors'] = self._network_manager.errors
+    def _requests_idle(self, page_key):
+        if page_key == self._page_key and self._pending_load is not None:
+            # javascript may still start new requests, so don't jump at it
+            self._quiet_timer.start()
 
-        self._finish_task(result)
+    def _network_quiet(self):
+        ok = self._pending_load
+        if ok is None or self._is_task_finished:
+            return
+
+        self._pending_load = None
+        # checks once more for pending requests, and keeps waiting if a new
+        # one was started in the meantime
+        self._load_finished(ok)
 
     def _start_task(self):
         self._is_task_finished = False
+        self._pending_load = None
+        self._download = None
+        self._task_started = time.time()
+        self._network_manager.start_task(self._page_key)
+        if self._har_dir is not None:
+            (fd, path) = tempfile.mkstemp(suffix='.har', dir=self._har_dir)
+            os.close(fd)
+            self._network_manager.start_har(self._page_key, path)
+        self._quiet_timer.stop()
+        if self._timeout_timer is not None:
+            self._timeout_timer.stop()
         # abusing the ok param of loadFinished
         timed_out = lambda: self._load_finished('timed_out')
         self._timeout_timer = QTimer()
@@ -367,17 +1370,34 @@ class Browser(object):
 
     def _finish_task(self, result):
         self._is_task_finished = True
+        self._pending_load = None
+        self._quiet_timer.stop()
         self._timeout_timer.stop()
         # calling the callback function which we passed upon instantiation to
         # report the results there
         self._result_callback(result)
 
-    def make(self, method, url, headers, raw_data=None):
-        request = self._prepare_request(url, headers)
-        operation = self._request_ops[method.lower()]
-        request_data = self._urlencode_request_data(raw_data or dict())
+    def load(self, request, operation, request_data):
+        self._start_task()
+        self._web_page.mainFrame().load(request, operation, request_data)
+
+    def prepare_upload(self, request, body):
+        self._network_manager.prepare_upload(request, body, self._page_key)
+
+    def download(self, request, operation, request_data, sink):
         self._start_task()
-        self._web_view.load(request, operation, request_data)
+        self._download = sink
+        # so the request is attributed to this page, as if webkit made it
+        request.setOriginatingObject(self._web_page.mainFrame())
+        if self._network_manager.download(request,
+                                          operation,
+                                          request_data,
+                                          sink):
+            # the result is returned once the network is quiet, as for
+            # pages which are still loading after loadFinished
+            self._pending_load = True
+        else:
+            QTimer.singleShot(0, lambda: self._load_finished(False))
 
     def _find_element(self, selector):
         main_frame = self._web_page.mainFrame()
@@ -429,29 +1449,322 @@ class Browser(object):
         self._start_task()
         element.evaluateJavaScript(js_click)
 
+    def _reset_finished(self):
+        self._web_page.settings().setAttribute(QWebSettings.JavascriptEnabled,
+                                               self._javascript_enabled)
+        callback = self._reset_callback
+        self._reset_callback = None
+        callback()
+
+    def reset(self, callback, result_callback=None):
+        """
+        Bring the tab back to a clean state in place, instead of closing it
+        and opening a new one. The callback is invoked as soon as the tab is
+        ready for the next task.
+        """
+        # anything loadFinished reports from now on belongs to no task
+        self._is_task_finished = True
+        self._pending_load = None
+        self._quiet_timer.stop()
+        if self._timeout_timer is not None:
+            self._timeout_timer.stop()
+
+        if result_callback is not None:
+            self._result_callback = result_callback
+
+        self._web_page.triggerAction(QWebPage.Stop)
+        # same precautions as in shutdown, first stop the javascript code,
+        # then cancel the requests it may have started in the meantime
+        self._web_page.settings().setAttribute(QWebSettings.JavascriptEnabled,
+                                               False)
+        self._network_manager.reset(self._page_key)
+
+        self._reset_callback = callback
+        self._web_page.mainFrame().load(QUrl('about:blank'))
+
+    def _stop(self):
+        self._is_task_finished = True
+        self._quiet_timer.stop()
+        if self._timeout_timer is not None:
+            self._timeout_timer.stop()
+        self._web_page.triggerAction(QWebPage.Stop)
+        if self._web_view is not None:
+            self._web_view.close()
+        # will immediately stop any running javascript code
+        self._web_page.settings().setAttribute(QWebSettings.JavascriptEnabled,
+                                               False)
+
+    def _schedule_deletion(self, destroyed):
+        # destroyed is called with the name of each component once it's gone
+        self._network_manager.requests_idle.disconnect(self._requests_idle)
+        self._network_manager.unregister_page(self._web_page)
+
+        page_name = 'web_page_{0}'.format(self._page_key)
+        self._web_page.destroyed.connect(lambda: destroyed(page_name))
+        self._web_page.deleteLater()
+
+        if self._web_view is None:
+            return [page_name]
+
+        view_name = 'web_view_{0}'.format(self._page_key)
+        self._web_view.destroyed.connect(lambda: destroyed(view_name))
+        self._web_view.deleteLater()
+
+        return [page_name, view_name]
+
+    def _destroyed(self, component):
+        self._destroyed_status[component] = True
+        if all(self._destroyed_status.values()):
+            self._shutdown_callback()
+
+    def close(self, callback):
+        """
+        Close just this tab, the network manager stays alive for the others.
+        """
+        self._shutdown_callback = callback
+        self._stop()
+        self._network_manager.abort_requests(self._page_key)
+        components = self._schedule_deletion(self._destroyed)
+        self._destroyed_status.update((name, False) for name in components)
+
+
+class Browser(object):
+
+    def __init__(self, callback, logger, options=None):
+        self.logger = logger
+        options = options or dict()
+
+        self._request_ops = {'head': QNetworkAccessManager.HeadOperation,
+                             'get': QNetworkAccessManager.GetOperation,
+                             'put': QNetworkAccessManager.PutOperation,
+                             'post': QNetworkAccessManager.PostOperation,
+                             'delete': QNetworkAccessManager.DeleteOperation}
+
+        self._timeout = int(options.pop('timeout', 30)) * 1000
+        self._network_quiet = int(options.pop('network_quiet', 100))
+        # in headless mode the tabs use a bare page with a fixed viewport,
+        # instead of a widget which is never shown anyway
+        if options.pop('headless', False):
+            self._viewport = options.pop('viewport', (1024, 768))
+        else:
+            self._viewport = None
+
+        max_request_retries = options.pop('max_request_retries', 3)
+        retry_backoff = options.pop('retry_backoff', 0.5)
+        retry_backoff_cap = options.pop('retry_backoff_cap', 30.0)
+        # either compiled rules shared by many browsers, or a list of rules
+        blocking_rules = options.pop('block', None)
+        if isinstance(blocking_rules, list):
+            blocking_rules = BlockingRules(blocking_rules)
+        # either breakers shared by many browsers, or True for own ones
+        circuit_breakers = options.pop('circuit_breakers', None)
+        if circuit_breakers is True:
+            circuit_breakers = HostCircuitBreakers()
+        # either a scheduler shared by many browsers, counting the requests
+        # of all of them against the limits, or the limits (compiled or a
+        # list of rules) for an own one
+        host_scheduler = options.pop('host_limits', None)
+        if isinstance(host_scheduler, list):
+            host_scheduler = HostLimits(host_scheduler)
+        if isinstance(host_scheduler, HostLimits):
+            host_scheduler = HostScheduler(host_scheduler)
+
+        # the same policy applies to all the tasks, limits are in bytes
+        content_policy = options.pop('content_policy', None)
+        if isinstance(content_policy, dict):
+            content_policy = ContentPolicy(**content_policy)
+        coalesce = options.pop('coalesce', False)
+        log_sample_rate = options.pop('log_sample_rate', 1)
+        # either a store shared by many browsers, or the path of its database
+        validator_store = options.pop('validator_store', None)
+        if isinstance(validator_store, basestring):
+            validator_store = ValidatorStore(validator_store)
+        self._validator_store = validator_store
+        # either a log shared by many browsers, or a path, whose log is
+        # shared by the browsers of the process, see open_process_log
+        request_log = options.pop('request_log', None)
+        self._own_request_log = None
+        if isinstance(request_log, basestring):
+            request_log = self._own_request_log = open_process_log(
+                request_log
+            )
+        self.number = next(browser_numbers)
+        # whether the results include the timings of the task's requests
+        waterfall = options.pop('waterfall', False)
+        # the directory the HAR file of each task is written to, its path is
+        # passed along with the result
+        self._har_dir = options.pop('har_dir', None)
+
+        self._network_manager = SmartNetworkAccessManager(logger,
+                                                          max_request_retries,
+                                                          blocking_rules,
+                                                          retry_backoff,
+                                                          retry_backoff_cap,
+                                                          circuit_breakers,
+                                                          host_scheduler,
+                                                          content_policy,
+                                                          coalesce,
+                                                          validator_store,
+                                                          log_sample_rate,
+                                                          request_log,
+                                                          waterfall,
+                                                          self.number)
+
+        cache_dir = options.pop('cache_dir', None)
+        cache_size = options.pop('cache_size', 100 * 1024 * 1024)
+        if cache_dir is not None:
+            # a cache can't be shared by network managers, but its directory
+            # can, so all browsers pointed to the same one benefit from it
+            cache = SharedDiskCache(cache_dir, cache_size)
+            self._network_manager.setCache(cache)
+
+        cookie_jar = self._cookie_jar = options.pop('cookie_jar', None)
+        if cookie_jar is not None:
+            # the jar may be shared with other browsers (e.g. a
+            # PersistentCookieJar), so it must not be deleted along with the
+            # network manager which would otherwise take ownership of it
+            self._network_manager.setCookieJar(cookie_jar)
+            cookie_jar.setParent(None)
+
+        # the same settings are applied to the pages of all the tabs
+        self._settings = {
+            QWebSettings.AutoLoadImages: options.pop('images', False),
+            QWebSettings.JavascriptEnabled: options.pop('javascript', False),
+            QWebSettings.JavascriptCanOpenWindows: options.pop('popups',
+                                                               False),
+            QWebSettings.PrivateBrowsingEnabled:
+            options.pop('private_browsing', False),
+            QWebSettings.JavaEnabled: False,
+            QWebSettings.PluginsEnabled: False,
+            QWebSettings.DnsPrefetchEnabled: True
+        }
+
+        self._tabs = []
+        self._main_tab = self.new_tab(callback)
+        self._destroyed_status = dict()
+
+    def new_tab(self, callback):
+        """
+        Open an additional page sharing this browser's network manager. The
+        results of the tasks made with the returned tab are passed to the
+        given callback.
+        """
+        tab = BrowserTab(callback,
+                         self.logger,
+                         self._network_manager,
+                         self._settings,
+                         self._timeout,
+                         self._viewport,
+                         self._network_quiet,
+                         self._har_dir)
+        self._tabs.append(tab)
+        return tab
+
+    def close_tab(self, tab, callback):
+        self._tabs.remove(tab)
+        tab.close(callback)
+
+    def _prepare_request(self, url, headers):
+        # create an empty request
+        request = QNetworkRequest()
+        # assign a url to it
+        request.setUrl(QUrl(url))
+
+        # add some custom headers to the request
+        for (header_name, header_value) in headers.items():
+            request.setRawHeader(header_name, QByteArray(header_value))
+
+        return request
+
+    def _urlencode_request_data(self, raw_data):
+        # the data which we want to send to the server must be urlencoded
+        request_data = QUrl()
+        for (name, value) in raw_data.items():
+            request_data.addQueryItem(name, unicode(value))
+
+        return request_data.encodedQuery()
+
+    def make(self, method, url, headers, raw_data=None, tab=None,
+             multipart=None):
+        """
+        Load the url in the given tab, or in the main tab if none is given.
+        The data is sent either urlencoded from the raw_data dict, or as
+        multipart/form-data from the list of multipart parts, see
+        MultipartBody, whose files are streamed from the disk.
+        """
+        tab = tab or self._main_tab
+        request = self._prepare_request(url, headers)
+        operation = self._request_ops[method.lower()]
+        request_data = self._request_data(request, raw_data, multipart, tab)
+        tab.load(request, operation, request_data)
+
+    def download(self, method, url, headers, raw_data=None, tab=None,
+                 multipart=None, path=None, chunk_callback=None):
+        """
+        Like make, but the response is not loaded as a page. Its body is
+        streamed into the file at path, or passed chunk by chunk to the
+        chunk_callback, and the result has the number of bytes received
+        (and the path) instead of the html.
+        """
+        if path is not None:
+            sink = FileSink(path)
+        else:
+            sink = CallbackSink(chunk_callback)
+
+        tab = tab or self._main_tab
+        request = self._prepare_request(url, headers)
+        operation = self._request_ops[method.lower()]
+        request_data = self._request_data(request, raw_data, multipart, tab)
+        tab.download(request, operation, request_data, sink)
+
+    def _request_data(self, request, raw_data, multipart, tab):
+        if multipart is None:
+            return self._urlencode_request_data(raw_data or dict())
+
+        tab.prepare_upload(request, MultipartBody(multipart))
+        return QByteArray()
+
+    def fill_input(self, selector, value, tab=None):
+        (tab or self._main_tab).fill_input(selector, value)
+
+    def click(self, selector, tab=None):
+        (tab or self._main_tab).click(selector)
+
+    def reset(self, callback, result_callback=None):
+        """
+        Bring the main tab back to a clean state in place, instead of shutting
+        down the browser and creating a new one. The callback is invoked as
+        soon as the browser is ready for the next task.
+        """
+        self._main_tab.reset(callback, result_callback)
+
     def _destroyed(self, component):
         self._destroyed_status[component] = True
         if all(self._destroyed_status.values()):
+            if self._own_request_log is not None:
+                # the network manager is gone, nothing more to write
+                close_process_log(self._own_request_log)
+                self._own_request_log = None
             self._shutdown_callback()
 
     def shutdown(self, callback):
         self._shutdown_callback = callback
-        self._web_view.stop()
-        self._web_view.close()
-        # will immediately stop any running javascript code
-        self._web_view.settings().setAttribute(QWebSettings.JavascriptEnabled,
-                                               False)
+        for tab in self._tabs:
+            tab._stop()
         # if any requests were started by javascript after loadFinished was
         # emitted, and before we stopped javascript execution, cancel them
-        self._network_manager.abort_requests()
-
-        self._destroyed_status['web_page'] = False
-        self._web_page.destroyed.connect(lambda: self._destroyed('web_page'))
-        self._web_page.deleteLater()
-
-        self._destroyed_status['web_view'] = False
-        self._web_view.destroyed.connect(lambda: self._destroyed('web_view'))
-        self._web_view.deleteLater()
+        self._network_manager.close()
+        if isinstance(self._cookie_jar, PersistentCookieJar):
+            # the changes since the last batch, e.g. a login which just
+            # happened, would wait for the flush interval otherwise
+            self._cookie_jar.flush()
+        if self._validator_store is not None:
+            # likewise the responses stored since the last commit
+            self._validator_store.flush()
+
+        for tab in self._tabs:
+            components = tab._schedule_deletion(self._destroyed)
+            self._destroyed_status.update((name, False) for name in components)
 
         self._destroyed_status['network_manager'] = False
         destroyer = lambda: self._destroyed('network_manager')
@@ -0,0 +1,47 @@
+import time
+
+
+class RequestRecord(object):
+    """
+    Everything the network manager keeps about a request, from its creation
+    until its reply is destroyed. There may be hundreds of these alive per
+    page, hence the slots instead of a dict per request.
+    """
+    __slots__ = ('reply', 'outgoing_data', 'finished', 'retry_count',
+                 'page', 'host', 'created', 'completed', 'retry_timer',
+                 'host_slot', 'queue_wait', 'sink', 'redirects',
+                 'received', 'rejection', 'responded', 'first_byte',
+                 'dump', 'bytes_saved', 'number')
+
+    def __init__(self, reply, outgoing_data, page, host, number=None):
+        self.reply = reply
+        # unlike the id of the reply, never reused within the process
+        self.number = number
+        self.outgoing_data = outgoing_data
+        self.finished = False
+        self.retry_count = 0
+        self.page = page
+        self.host = host
+        # wall clock timestamps of the reply's creation, its response headers,
+        # the first data it received, and its end
+        self.created = time.time()
+        self.responded = None
+        self.first_byte = None
+        self.completed = None
+        # set while a failed request waits to be retried
+        self.retry_timer = None
+        # whether the request holds one of its host's slots in the scheduler,
+        # and the seconds it waited in its queue for that
+        self.host_slot = False
+        self.queue_wait = 0.0
+        # downloads stream the body into a sink, following redirects
+        self.sink = None
+        self.redirects = 0
+        # bytes of the response received so far, and the reason it was
+        # rejected for, if it broke the content policy
+        self.received = 0
+        self.rejection = None
+        # the size of the body, if it was served from the disk cache
+        self.bytes_saved = 0
+        # whether the request and its reply are dumped to the debug log
+        self.dump = False
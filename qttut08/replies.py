@@ -0,0 +1,408 @@
+import sqlite3
+
+from functools import partial
+
+from PySide.QtCore import QIODevice, QObject, QTimer
+from PySide.QtNetwork import QNetworkReply, QNetworkRequest
+
+
+class LocalReply(QNetworkReply):
+    """
+    A reply answered locally, without any network I/O. Just like real
+    replies, it reports its content asynchronously, once the caller had the
+    chance to connect to its signals.
+    """
+
+    def __init__(self, parent, operation, request, data='', status=200,
+                 reason='OK', headers=None, error=None):
+        QNetworkReply.__init__(self, parent)
+        self.setRequest(request)
+        self.setUrl(request.url())
+        self.setOperation(operation)
+
+        self._data = data
+        self._offset = 0
+        self._error = error
+
+        if status is not None:
+            self.setAttribute(QNetworkRequest.HttpStatusCodeAttribute, status)
+            self.setAttribute(QNetworkRequest.HttpReasonPhraseAttribute,
+                              reason)
+        for (name, value) in (headers or dict()).items():
+            self.setRawHeader(name, value)
+        self.setHeader(QNetworkRequest.ContentLengthHeader, len(data))
+
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+        QTimer.singleShot(0, self._deliver)
+
+    def _deliver(self):
+        if self.isFinished():
+            # aborted in the meantime
+            return
+
+        if self._error is not None:
+            self.setError(*self._error)
+
+        self.metaDataChanged.emit()
+        if self._data:
+            self.readyRead.emit()
+            self.downloadProgress.emit(len(self._data), len(self._data))
+
+        self.setFinished(True)
+        self.finished.emit()
+
+    def abort(self):
+        if self.isFinished():
+            return
+
+        self.setError(QNetworkReply.OperationCanceledError,
+                      'Operation canceled')
+        self.setFinished(True)
+        self.finished.emit()
+
+    def bytesAvailable(self):
+        return (len(self._data) - self._offset +
+                QNetworkReply.bytesAvailable(self))
+
+    def isSequential(self):
+        return True
+
+    def readData(self, max_size):
+        chunk = self._data[self._offset:self._offset + max_size]
+        self._offset += len(chunk)
+        return chunk
+
+
+class ProxyReply(QNetworkReply):
+    """
+    Base of the replies reporting what another, real reply received.
+    """
+
+    _attributes = (QNetworkRequest.HttpStatusCodeAttribute,
+                   QNetworkRequest.HttpReasonPhraseAttribute,
+                   QNetworkRequest.RedirectionTargetAttribute,
+                   QNetworkRequest.SourceIsFromCacheAttribute,
+                   QNetworkRequest.ConnectionEncryptedAttribute)
+
+    def copy_meta_data(self, source):
+        self.setUrl(source.url())
+        for attribute in self._attributes:
+            value = source.attribute(attribute)
+            if value is not None:
+                self.setAttribute(attribute, value)
+        for name in source.rawHeaderList():
+            self.setRawHeader(name, source.rawHeader(name))
+
+    def finish(self, source):
+        self.copy_meta_data(source)
+        if source.error() != QNetworkReply.NoError:
+            self.setError(source.error(), source.errorString())
+        self.setFinished(True)
+        self.finished.emit()
+
+    def isSequential(self):
+        return True
+
+
+class DeferredReply(ProxyReply):
+    """
+    A reply handed out before its request is actually sent, e.g. while the
+    request waits in a queue. Once the real reply is created it is attached,
+    and everything it reports is passed on as if it came from this one.
+    """
+
+    def __init__(self, parent, operation, request):
+        ProxyReply.__init__(self, parent)
+        self.setRequest(request)
+        self.setUrl(request.url())
+        self.setOperation(operation)
+
+        self._upstream = None
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+
+    @property
+    def upstream(self):
+        return self._upstream
+
+    def attach(self, upstream):
+        self._upstream = upstream
+        # deleted along with this reply
+        upstream.setParent(self)
+        upstream.setReadBufferSize(self.readBufferSize())
+        upstream.metaDataChanged.connect(self._meta_data_changed)
+        upstream.readyRead.connect(self.readyRead)
+        upstream.downloadProgress.connect(self.downloadProgress)
+        upstream.uploadProgress.connect(self.uploadProgress)
+        upstream.sslErrors.connect(self.sslErrors)
+        upstream.finished.connect(self._upstream_finished)
+
+    def _meta_data_changed(self):
+        self.copy_meta_data(self._upstream)
+        self.metaDataChanged.emit()
+
+    def _upstream_finished(self):
+        self.finish(self._upstream)
+
+    def abort(self):
+        if self.isFinished():
+            return
+
+        if self._upstream is not None:
+            # its finished signal is passed on
+            self._upstream.abort()
+            return
+
+        self.setError(QNetworkReply.OperationCanceledError,
+                      'Operation canceled')
+        self.setFinished(True)
+        self.finished.emit()
+
+    def ignoreSslErrors(self):
+        if self._upstream is not None:
+            self._upstream.ignoreSslErrors()
+
+    def bytesAvailable(self):
+        upstream = 0
+        if self._upstream is not None:
+            upstream = self._upstream.bytesAvailable()
+        return upstream + QNetworkReply.bytesAvailable(self)
+
+    def readData(self, max_size):
+        if self._upstream is None:
+            return ''
+        return self._upstream.read(max_size).data()
+
+
+class RevalidatingReply(DeferredReply):
+    """
+    The reply to a GET request which may be answered from a ValidatorStore.
+    If the request was made conditional with the validators of the stored
+    entry and the server answers 304 Not Modified, the stored response is
+    served as a 200 marked by the unchanged_header. Otherwise the body is
+    captured as it is read, and stored if it has validators.
+    """
+
+    unchanged_header = 'X-Not-Modified'
+
+    def __init__(self, parent, operation, request, store, entry=None):
+        DeferredReply.__init__(self, parent, operation, request)
+        self._store = store
+        self._entry = entry
+        # the stored body once it's being served, and the position in it
+        self._stored = None
+        self._offset = 0
+        self._captured = bytearray()
+
+    def _not_modified(self):
+        status = self._upstream.attribute(
+            QNetworkRequest.HttpStatusCodeAttribute
+        )
+        return self._entry is not None and status == 304
+
+    def _serve_stored(self):
+        self.copy_meta_data(self._upstream)
+        self.setAttribute(QNetworkRequest.HttpStatusCodeAttribute, 200)
+        self.setAttribute(QNetworkRequest.HttpReasonPhraseAttribute, 'OK')
+        for (name, value) in self._entry['headers']:
+            self.setRawHeader(name, value)
+        self.setRawHeader(self.unchanged_header, '1')
+        self.setHeader(QNetworkRequest.ContentLengthHeader,
+                       len(self._entry['body']))
+        self._stored = self._entry['body']
+
+        self.metaDataChanged.emit()
+        if self._stored:
+            self.readyRead.emit()
+            self.downloadProgress.emit(len(self._stored), len(self._stored))
+
+    def _meta_data_changed(self):
+        if self._not_modified():
+            self._serve_stored()
+        else:
+            DeferredReply._meta_data_changed(self)
+
+    def _upstream_finished(self):
+        if not self._not_modified():
+            DeferredReply._upstream_finished(self)
+            self._store_response()
+            return
+
+        if self._stored is None:
+            self._serve_stored()
+        self.setFinished(True)
+        self.finished.emit()
+
+    def _store_response(self):
+        upstream = self._upstream
+        status = upstream.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if (self._captured is None or status != 200 or
+                upstream.error() != QNetworkReply.NoError):
+            return
+
+        # the body is decoded already, so its encoding isn't kept
+        headers = [(name, str(upstream.rawHeader(name)))
+                   for name in ('Content-Type', )
+                   if upstream.hasRawHeader(name)]
+        url = unicode(self.request().url().toString()).encode('utf-8')
+        try:
+            self._store.put(url,
+                            str(upstream.rawHeader('ETag')) or None,
+                            str(upstream.rawHeader('Last-Modified')) or None,
+                            headers,
+                            str(self._captured))
+        except sqlite3.OperationalError:
+            # the response was served already, it's only not remembered
+            pass
+
+    def bytesAvailable(self):
+        if self._stored is None:
+            return DeferredReply.bytesAvailable(self)
+        return (len(self._stored) - self._offset +
+                QNetworkReply.bytesAvailable(self))
+
+    def readData(self, max_size):
+        if self._stored is not None:
+            chunk = self._stored[self._offset:self._offset + max_size]
+            self._offset += len(chunk)
+            return chunk
+
+        chunk = DeferredReply.readData(self, max_size)
+        if self._captured is not None:
+            self._captured.extend(chunk)
+            if len(self._captured) > self._store.max_body_size:
+                self._captured = None
+        return chunk
+
+
+class FanOutReply(ProxyReply):
+    """
+    One of the replies sharing the response to a single request, which is
+    received by a ReplyHub and fed to each of them.
+    """
+
+    def __init__(self, parent, operation, request, hub):
+        ProxyReply.__init__(self, parent)
+        self.setRequest(request)
+        self.setUrl(request.url())
+        self.setOperation(operation)
+
+        self._hub = hub
+        self._buffer = bytearray()
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+
+    def feed(self, data, notify=True):
+        self._buffer.extend(data)
+        if notify:
+            self.readyRead.emit()
+
+    def abort(self):
+        if self.isFinished():
+            return
+
+        self._hub.unsubscribe(self)
+        self.setError(QNetworkReply.OperationCanceledError,
+                      'Operation canceled')
+        self.setFinished(True)
+        self.finished.emit()
+
+    def bytesAvailable(self):
+        return len(self._buffer) + QNetworkReply.bytesAvailable(self)
+
+    def readData(self, max_size):
+        chunk = str(self._buffer[:max_size])
+        del self._buffer[:max_size]
+        return chunk
+
+
+class ReplyHub(QObject):
+    """
+    Receives the response to a request made on behalf of many requesters,
+    and fans it out to the FanOutReply of each. Requesters joining late get
+    what was received before they joined, as long as that is no more than
+    history_limit bytes, after which nobody can join anymore. The request is
+    aborted once every requester aborted.
+    """
+
+    history_limit = 1024 * 1024
+
+    def __init__(self, parent, upstream, closed_callback):
+        QObject.__init__(self, parent)
+        self._upstream = upstream
+        # deleted along with the hub
+        upstream.setParent(self)
+        # called once the hub can't be joined anymore
+        self._closed_callback = closed_callback
+
+        self._subscribers = []
+        self._history = bytearray()
+        self._has_meta_data = False
+        self.joinable = True
+
+        upstream.metaDataChanged.connect(self._meta_data_changed)
+        upstream.readyRead.connect(self._ready_read)
+        upstream.downloadProgress.connect(self._download_progress)
+        upstream.sslErrors.connect(self._ssl_errors)
+        upstream.finished.connect(self._finished)
+
+    def _close(self):
+        if self.joinable:
+            self.joinable = False
+            self._history = bytearray()
+            self._closed_callback(self)
+
+    def subscribe(self, reply):
+        self._subscribers.append(reply)
+        if not self._has_meta_data and not self._history:
+            return
+
+        # catch up without signals, the requester is not connected to them
+        # yet, they are emitted on the next iteration of the event loop
+        if self._has_meta_data:
+            reply.copy_meta_data(self._upstream)
+        reply.feed(self._history, notify=False)
+        QTimer.singleShot(0, partial(self._caught_up, reply))
+
+    def _caught_up(self, reply):
+        if reply.isFinished():
+            return
+        if self._has_meta_data:
+            reply.metaDataChanged.emit()
+        if reply.bytesAvailable():
+            reply.readyRead.emit()
+
+    def unsubscribe(self, reply):
+        self._subscribers.remove(reply)
+        if not self._subscribers:
+            self._close()
+            self._upstream.abort()
+
+    def _meta_data_changed(self):
+        self._has_meta_data = True
+        for reply in self._subscribers:
+            reply.copy_meta_data(self._upstream)
+            reply.metaDataChanged.emit()
+
+    def _ready_read(self):
+        data = self._upstream.readAll().data()
+        if self.joinable:
+            self._history.extend(data)
+            if len(self._history) > self.history_limit:
+                self._close()
+
+        for reply in list(self._subscribers):
+            reply.feed(data)
+
+    def _download_progress(self, received, total):
+        for reply in self._subscribers:
+            reply.downloadProgress.emit(received, total)
+
+    def _ssl_errors(self, errors):
+        for reply in self._subscribers:
+            reply.sslErrors.emit(errors)
+
+    def _finished(self):
+        self._close()
+        (subscribers, self._subscribers) = (self._subscribers, [])
+        for reply in subscribers:
+            reply.finish(self._upstream)
+        self.deleteLater()
@@ -0,0 +1,101 @@
+import time
+import random
+
+
+def backoff_delay(retry_count, base=0.5, cap=30.0, rand=random.random):
+    """
+    Seconds to wait before the next retry: exponential backoff with full
+    jitter, so the retries of many requests failing at the same moment
+    don't hit the host at the same moment again.
+    """
+    return rand() * min(cap, base * (2 ** retry_count))
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of a single host. After failure_threshold consecutive
+    failures the circuit opens and requests fail fast, without going to the
+    network. Once reset_timeout seconds passed, a single trial request is let
+    through (half open), and depending on its outcome the circuit closes or
+    opens again.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._trial_started_at = None
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+
+        now = self._clock()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_started_at = now
+            return True
+
+        # half open, only one trial at a time, unless its outcome was never
+        # reported (e.g. it was aborted) in which case another one may go
+        if now - self._trial_started_at < self.reset_timeout:
+            return False
+        self._trial_started_at = now
+        return True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if (self.state == self.HALF_OPEN or
+                self.failures >= self.failure_threshold):
+            self.state = self.OPEN
+            self._opened_at = self._clock()
+
+
+class HostCircuitBreakers(object):
+    """
+    A circuit breaker per host, created on first use. One instance can be
+    shared by all the network managers of a process.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._breakers = dict()
+
+    def _get(self, host):
+        try:
+            return self._breakers[host]
+        except KeyError:
+            breaker = CircuitBreaker(self.failure_threshold,
+                                     self.reset_timeout,
+                                     self._clock)
+            self._breakers[host] = breaker
+            return breaker
+
+    def allow(self, host):
+        return self._get(host).allow()
+
+    def record_success(self, host):
+        self._get(host).record_success()
+
+    def record_failure(self, host):
+        self._get(host).record_failure()
+
+    def state(self, host):
+        return self._get(host).state
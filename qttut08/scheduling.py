@@ -0,0 +1,184 @@
+import time
+import fnmatch
+import collections
+
+
+class TokenBucket(object):
+    """
+    Allows rate requests per second on average, with bursts of up to burst
+    requests at once.
+    """
+
+    def __init__(self, rate, burst=1, clock=time.time):
+        self.rate = float(rate)
+        self.burst = max(1, burst)
+        self._clock = clock
+        self._tokens = float(self.burst)
+        self._updated = clock()
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def take(self):
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def delay(self):
+        """
+        Seconds until the next token is available.
+        """
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+
+class HostLimits(object):
+    """
+    Limits for the requests sent to a host, as a list of rules, the first
+    rule whose host pattern (e.g. '*.example.com', or '*' for all hosts)
+    matches is used. A rule may have any of the following limits:
+
+        concurrency  - the number of requests in flight at once
+        rate         - the number of requests started per second
+        burst        - the number of requests which may be started at once
+                       while staying under rate, defaults to 1
+
+    Hosts not matched by any rule are not limited. The limits apply to each
+    host separately, not to all the hosts matched by a rule together.
+    """
+
+    def __init__(self, rules):
+        self._rules = list(rules)
+        self._cache = dict()
+
+    def limit_for(self, host):
+        try:
+            return self._cache[host]
+        except KeyError:
+            pass
+
+        limit = None
+        for rule in self._rules:
+            if fnmatch.fnmatchcase(host.lower(), rule['host'].lower()):
+                limit = rule
+                break
+        self._cache[host] = limit
+        return limit
+
+
+class _HostState(object):
+    __slots__ = ('running', 'concurrency', 'bucket', 'queue')
+
+    def __init__(self, limit, clock):
+        self.running = 0
+        self.concurrency = limit.get('concurrency')
+        if limit.get('rate'):
+            self.bucket = TokenBucket(limit['rate'],
+                                      limit.get('burst', 1),
+                                      clock)
+        else:
+            self.bucket = None
+        self.queue = collections.deque()
+
+    def has_slot(self):
+        return self.concurrency is None or self.running < self.concurrency
+
+
+class HostScheduler(object):
+    """
+    Decides which requests may start right away and queues the others, per
+    host, until a slot frees up or the rate limit allows them to go. The
+    queued items are opaque, the caller starts them once they're handed back
+    by ready(). A scheduler may be shared by all the network managers of a
+    process, the limits then hold for all of them together.
+    """
+
+    def __init__(self, limits, clock=time.time):
+        self._limits = limits
+        self._clock = clock
+        self._hosts = dict()
+
+    def _state(self, host):
+        try:
+            return self._hosts[host]
+        except KeyError:
+            limit = self._limits.limit_for(host)
+            state = None if limit is None else _HostState(limit, self._clock)
+            self._hosts[host] = state
+            return state
+
+    def _start(self, state):
+        if not state.has_slot():
+            return False
+        if state.bucket is not None and not state.bucket.take():
+            return False
+        state.running += 1
+        return True
+
+    def acquire(self, host):
+        """
+        Take a slot for a request to the given host, if one is available and
+        no earlier request is already waiting for it.
+        """
+        state = self._state(host)
+        if state is None:
+            return True
+        if state.queue:
+            return False
+        return self._start(state)
+
+    def enqueue(self, host, item):
+        self._state(host).queue.append(item)
+
+    def release(self, host):
+        state = self._state(host)
+        if state is not None:
+            state.running -= 1
+
+    def ready(self, is_alive=lambda item: True):
+        """
+        Return the queued items which may start now, their slots are taken.
+        Items which are no longer alive are dropped without taking one.
+        """
+        items = []
+        for state in self._hosts.values():
+            if state is None:
+                continue
+
+            while state.queue:
+                if not is_alive(state.queue[0]):
+                    state.queue.popleft()
+                elif self._start(state):
+                    items.append(state.queue.popleft())
+                else:
+                    break
+        return items
+
+    def next_delay(self):
+        """
+        Seconds until a queued item may be started because of the rate
+        limit, or None if they're all waiting for a slot, or nothing waits.
+        """
+        delays = [state.bucket.delay() for state in self._hosts.values()
+                  if state is not None and state.queue and
+                  state.bucket is not None and state.has_slot()]
+        return min(delays) if delays else None
+
+    def queued(self):
+        """
+        The items waiting in the queues, in no particular order.
+        """
+        for state in self._hosts.values():
+            if state is not None:
+                for item in state.queue:
+                    yield item
+
+    @property
+    def queued_count(self):
+        return sum(len(state.queue) for state in self._hosts.values()
+                   if state is not None)
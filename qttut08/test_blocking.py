@@ -0,0 +1,80 @@
+import unittest
+
+from blocking import BlockingRules, guess_resource_type
+
+
+class GuessResourceTypeTest(unittest.TestCase):
+
+    def test_by_extension(self):
+        self.assertEqual(guess_resource_type('/static/app.js'), 'script')
+        self.assertEqual(guess_resource_type('/f/Roboto.woff2'), 'font')
+        self.assertEqual(guess_resource_type('/clip.MP4'), 'media')
+
+    def test_by_accept_header(self):
+        self.assertEqual(guess_resource_type('/', 'text/html,*/*'),
+                         'document')
+        self.assertEqual(guess_resource_type('/pixel', 'image/png'), 'image')
+        self.assertEqual(guess_resource_type('/api/items', '*/*'), None)
+
+
+class BlockingRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = BlockingRules([
+            {'host': 'doubleclick.net'},
+            {'host': 'cdn.example.com', 'type': 'image'},
+            {'host': 'example.org', 'url': r'/track/'},
+            {'url': r'/analytics(?:\.min)?\.js'},
+            {'url': r'\?autoplay=', 'mime': 'video/*'},
+            {'type': 'font'},
+            {'mime': 'video/*'}
+        ])
+
+    def assertBlocked(self, url, accept=None):
+        self.assertIsNotNone(self.rules.match(url, accept))
+
+    def assertAllowed(self, url, accept=None):
+        self.assertIsNone(self.rules.match(url, accept))
+
+    def test_host_suffix(self):
+        self.assertBlocked('http://doubleclick.net/ad.js')
+        self.assertBlocked('http://stats.g.doubleclick.net/ad.js')
+        self.assertAllowed('http://notdoubleclick.net/ad.js')
+        self.assertAllowed('http://doubleclick.net.example.com/')
+
+    def test_host_with_type(self):
+        self.assertBlocked('http://cdn.example.com/logo.png')
+        self.assertAllowed('http://cdn.example.com/app.js')
+        self.assertAllowed('http://example.com/logo.png')
+
+    def test_host_with_url(self):
+        self.assertBlocked('http://www.example.org/track/1')
+        self.assertAllowed('http://www.example.org/page/1')
+        self.assertAllowed('http://example.com/track/1')
+
+    def test_url_pattern(self):
+        self.assertBlocked('http://example.com/js/analytics.min.js')
+        self.assertAllowed('http://example.com/js/app.js')
+
+    def test_type_and_mime(self):
+        self.assertBlocked('http://example.com/fonts/a.ttf')
+        self.assertBlocked('http://example.com/movie.webm')
+        self.assertAllowed('http://example.com/index.html')
+
+    def test_many_rules(self):
+        rules = BlockingRules([{'url': r'/ad{0}/'.format(i)}
+                               for i in range(5000)] +
+                              [{'host': 'ads{0}.example.com'.format(i)}
+                               for i in range(5000)])
+        self.assertEqual(rules.match('http://example.com/ad4321/x'),
+                         {'url': '/ad4321/'})
+        self.assertEqual(rules.match('http://ads77.example.com/'),
+                         {'host': 'ads77.example.com'})
+        self.assertIsNone(rules.match('http://example.com/add/'))
+
+    def test_empty_rule(self):
+        self.assertRaises(ValueError, BlockingRules, [{}])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+
+from PySide.QtGui import QApplication
+from PySide.QtCore import QEventLoop
+
+from httpserver import ServerProcess
+from browserpool import BrowserPool
+
+
+class MockedLogger(object):
+    error = lambda x, y: None
+    info = lambda x, y: None
+    debug = lambda x, y: None
+    isEnabledFor = lambda x, y: True
+
+
+class BrowserPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.address = '127.0.0.1'
+        self.port = 8088
+        self.logger = MockedLogger()
+        self.url = 'http://{0}:{1}'.format(self.address, self.port)
+
+        with open('html/simple_page.html', 'r') as html_file:
+            self.html = html_file.read()
+
+        server_context = {
+            'delay': 0.0,
+            'response': 200,
+            'response_data': self.html,
+            'headers': {'content-type': 'text/html;'}
+        }
+        self.server = ServerProcess(self.address, self.port, server_context)
+        self.server.start()
+
+        self.browsers = []
+        self.results = []
+        self.event_loop = QEventLoop()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.join()
+
+    def run_tasks(self, pool, count):
+        self.remaining = count
+
+        def ready(browser):
+            self.browsers.append(browser)
+            browser.make('get', self.url, {})
+
+        def finished(result):
+            self.results.append(result)
+            pool.checkin(self.browsers[len(self.results) - 1])
+            self.remaining -= 1
+            if self.remaining:
+                pool.checkout(ready, finished)
+            else:
+                pool.shutdown(self.event_loop.quit)
+
+        pool.checkout(ready, finished)
+        self.event_loop.exec_()
+
+    def test_browser_reused(self):
+        pool = BrowserPool(self.logger, {'javascript': True},
+                           size=1, min_idle=1, max_uses=10)
+        self.run_tasks(pool, 3)
+
+        self.assertEqual(len(self.results), 3)
+        for result in self.results:
+            self.assertTrue(result['successful'])
+            self.assertEqual(result['html'], self.html)
+        # the very same instance served all the tasks
+        self.assertEqual(len(set(id(b) for b in self.browsers)), 1)
+
+    def test_browser_retired_after_max_uses(self):
+        pool = BrowserPool(self.logger, {'javascript': True},
+                           size=1, min_idle=1, max_uses=2)
+        self.run_tasks(pool, 3)
+
+        self.assertEqual(len(self.results), 3)
+        self.assertIs(self.browsers[0], self.browsers[1])
+        self.assertIsNot(self.browsers[1], self.browsers[2])
+        self.assertEqual(pool.size, 0)
+
+
+if __name__ == '__main__':
+    app = QApplication([])
+    unittest.main()
+    app.exec_()
@@ -0,0 +1,31 @@
+import unittest
+
+from budgets import ContentPolicy
+
+
+class ContentPolicyTest(unittest.TestCase):
+
+    def test_no_limits(self):
+        policy = ContentPolicy()
+        self.assertIsNone(policy.check_mime_type('video/mp4'))
+        self.assertIsNone(policy.check_size(10 ** 12, 10 ** 12))
+
+    def test_mime_types(self):
+        policy = ContentPolicy(allowed_mime_types=['text/*', 'Image/PNG'])
+        self.assertIsNone(policy.check_mime_type('text/html; charset=utf-8'))
+        self.assertIsNone(policy.check_mime_type('image/png'))
+        self.assertIsNone(policy.check_mime_type(''))
+        self.assertEqual(policy.check_mime_type('video/mp4'),
+                         'mime type video/mp4 is not allowed')
+
+    def test_sizes(self):
+        policy = ContentPolicy(max_resource_bytes=100, max_task_bytes=1000)
+        self.assertIsNone(policy.check_size(100, 1000))
+        self.assertEqual(policy.check_size(101, 101),
+                         'resource of 101 bytes is over the limit of 100')
+        self.assertEqual(policy.check_size(50, 1001),
+                         'task of 1001 bytes is over the limit of 1000')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from coalescing import canonical_url, request_key
+
+
+class CanonicalUrlTest(unittest.TestCase):
+
+    def test_normalization(self):
+        self.assertEqual(canonical_url('HTTP://Example.COM:80#top'),
+                         'http://example.com/')
+        self.assertEqual(canonical_url('https://example.com:443/a?b=1'),
+                         'https://example.com/a?b=1')
+        self.assertEqual(canonical_url('http://example.com:8080/a'),
+                         'http://example.com:8080/a')
+
+    def test_credentials_kept(self):
+        self.assertEqual(canonical_url('http://user:pw@Example.com/'),
+                         'http://user:pw@example.com/')
+
+
+class RequestKeyTest(unittest.TestCase):
+
+    def test_irrelevant_headers_ignored(self):
+        first = request_key('http://example.com/app.js',
+                            [('Accept', '*/*'), ('Referer', 'http://a/')])
+        second = request_key('http://example.com/app.js#x',
+                             [('accept', '*/*'), ('Referer', 'http://b/')])
+        self.assertEqual(first, second)
+
+    def test_relevant_headers(self):
+        first = request_key('http://example.com/', [('Accept', 'text/html')])
+        second = request_key('http://example.com/', [('Accept', '*/*')])
+        self.assertNotEqual(first, second)
+
+    def test_range_not_coalesced(self):
+        self.assertIsNone(request_key('http://example.com/video.mp4',
+                                      [('Range', 'bytes=0-1023')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
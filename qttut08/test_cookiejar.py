@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from PySide.QtCore import QCoreApplication, QEventLoop, QTimer, QUrl
+from PySide.QtNetwork import QNetworkCookie
+
+from cookiejar import PersistentCookieJar, registrable_domain
+
+
+class RegistrableDomainTest(unittest.TestCase):
+
+    def test_registrable_domain(self):
+        self.assertEqual(registrable_domain('news.ycombinator.com'),
+                         'ycombinator.com')
+        self.assertEqual(registrable_domain('www.bbc.co.uk'), 'bbc.co.uk')
+        self.assertEqual(registrable_domain('localhost'), 'localhost')
+        self.assertEqual(registrable_domain('127.0.0.1'), '127.0.0.1')
+
+
+class PersistentCookieJarTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'cookies.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cookies_survive_new_jar(self):
+        url = QUrl('https://news.ycombinator.com/login')
+        jar = PersistentCookieJar(self.db_path)
+        cookies = QNetworkCookie.parseCookies('user=pyqter; Path=/')
+        self.assertTrue(jar.setCookiesFromUrl(cookies, url))
+        jar.flush()
+
+        new_jar = PersistentCookieJar(self.db_path)
+        found = new_jar.cookiesForUrl(QUrl('https://news.ycombinator.com/'))
+        self.assertEqual([(str(c.name()), str(c.value())) for c in found],
+                         [('user', 'pyqter')])
+
+    def test_changes_written_in_batches(self):
+        url = QUrl('http://example.com/')
+        jar = PersistentCookieJar(self.db_path, flush_interval=50)
+        jar.setCookiesFromUrl(QNetworkCookie.parseCookies('a=1; Path=/'), url)
+        jar.setCookiesFromUrl(QNetworkCookie.parseCookies('b=2; Path=/'), url)
+        # nothing is written right away
+        self.assertEqual(PersistentCookieJar(self.db_path).cookiesForUrl(url),
+                         [])
+
+        event_loop = QEventLoop()
+        QTimer.singleShot(200, event_loop.quit)
+        event_loop.exec_()
+
+        found = PersistentCookieJar(self.db_path).cookiesForUrl(url)
+        self.assertEqual(sorted(str(c.name()) for c in found), ['a', 'b'])
+
+    def test_domain_isolation(self):
+        jar = PersistentCookieJar(self.db_path)
+        cookies = QNetworkCookie.parseCookies('user=pyqter; Path=/')
+        jar.setCookiesFromUrl(cookies, QUrl('http://example.com/'))
+
+        self.assertEqual(jar.cookiesForUrl(QUrl('http://example.org/')), [])
+        self.assertEqual(jar.cookiesForUrl(QUrl('http://www.example.com/')),
+                         [])
+        self.assertEqual(len(jar.cookiesForUrl(QUrl('http://example.com/a'))),
+                         1)
+
+    def test_parent_domain_cookie(self):
+        jar = PersistentCookieJar(self.db_path)
+        cookies = QNetworkCookie.parseCookies('sid=1; Domain=example.com')
+        jar.setCookiesFromUrl(cookies, QUrl('http://login.example.com/'))
+
+        found = jar.cookiesForUrl(QUrl('http://www.example.com/'))
+        self.assertEqual(len(found), 1)
+
+
+if __name__ == '__main__':
+    app = QCoreApplication([])
+    unittest.main()
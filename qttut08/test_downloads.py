@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+
+from downloads import Sink, FileSink, CallbackSink
+
+
+class SinkTest(unittest.TestCase):
+
+    def test_write_only(self):
+        chunks = []
+        sink = Sink(chunks.append)
+        sink.write('ab')
+        sink.restart()
+        sink.write('c')
+        sink.close('http://example.com/', True)
+
+        self.assertEqual(chunks, ['ab', 'c'])
+        self.assertEqual(sink.bytes, 1)
+        self.assertTrue(sink.closed)
+
+
+class FileSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_write_and_close(self):
+        sink = FileSink(self.path)
+        sink.write('abc')
+        sink.write('def')
+        sink.close('http://example.com/data.csv', True)
+
+        with open(self.path, 'rb') as result_file:
+            self.assertEqual(result_file.read(), 'abcdef')
+        self.assertEqual(sink.result(), {'url': 'http://example.com/data.csv',
+                                         'successful': True,
+                                         'bytes': 6,
+                                         'path': self.path})
+
+    def test_restart(self):
+        sink = FileSink(self.path)
+        sink.write('partial')
+        sink.restart()
+        sink.write('full')
+        sink.close('http://example.com/', True)
+
+        with open(self.path, 'rb') as result_file:
+            self.assertEqual(result_file.read(), 'full')
+        self.assertEqual(sink.bytes, 4)
+
+
+class CallbackSinkTest(unittest.TestCase):
+
+    def test_chunks_passed_on(self):
+        chunks = []
+        sink = CallbackSink(chunks.append)
+        sink.write('ab')
+        sink.restart()
+        sink.write('cd')
+        sink.close('http://example.com/', False)
+
+        self.assertEqual(chunks, ['ab', None, 'cd'])
+        self.assertEqual(sink.result(), {'url': 'http://example.com/',
+                                         'successful': False,
+                                         'bytes': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import os
+import signal
+import unittest
+import threading
+
+from httpserver import ServerProcess
+from farm import Supervisor
+
+
+class ServerTestCase(unittest.TestCase):
+
+    delay = 0.0
+
+    def setUp(self):
+        self.address = '127.0.0.1'
+        self.port = 8088
+        self.url = 'http://{0}:{1}'.format(self.address, self.port)
+
+        with open('html/simple_page.html', 'r') as html_file:
+            self.html = html_file.read()
+
+        server_context = {
+            'delay': self.delay,
+            'response': 200,
+            'response_data': self.html,
+            'headers': {'content-type': 'text/html;'}
+        }
+        self.server = ServerProcess(self.address, self.port, server_context)
+        self.server.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.join()
+
+
+class SupervisorTest(ServerTestCase):
+
+    def test_jobs_spread_over_workers(self):
+        supervisor = Supervisor(processes=2, concurrency=2)
+        supervisor.start()
+        job_ids = [supervisor.submit('get', self.url) for _ in range(6)]
+
+        results = dict()
+        supervisor.run(lambda job_id, result: results.update({job_id: result}))
+        supervisor.shutdown()
+
+        self.assertEqual(sorted(results.keys()), job_ids)
+        for result in results.values():
+            self.assertTrue(result['successful'])
+            self.assertEqual(result['html'], self.html)
+
+    def test_workers_recycled_after_page_limit(self):
+        supervisor = Supervisor(processes=1, concurrency=1, spares=1,
+                                limits={'pages': 2})
+        supervisor.start()
+        first_worker = supervisor._workers.values()[0]['process']
+        job_ids = [supervisor.submit('get', self.url) for _ in range(5)]
+
+        results = dict()
+        supervisor.run(lambda job_id, result: results.update({job_id: result}))
+        supervisor.shutdown()
+
+        self.assertEqual(sorted(results.keys()), job_ids)
+        for result in results.values():
+            self.assertTrue(result['successful'])
+        # the worker drained and exited on its own
+        self.assertEqual(first_worker.exitcode, 0)
+
+
+class CrashingWorkerTest(ServerTestCase):
+    delay = 2.0
+
+    def segfault_worker(self, supervisor):
+        for worker in supervisor._workers.values():
+            os.kill(worker['process'].pid, signal.SIGSEGV)
+
+    def test_jobs_requeued_after_segfault(self):
+        supervisor = Supervisor(processes=1, concurrency=2, spares=1)
+        supervisor.start()
+        job_ids = [supervisor.submit('get', self.url) for _ in range(2)]
+        # the worker dies while both jobs are waiting for the slow server
+        crash = threading.Timer(1.0, self.segfault_worker, [supervisor])
+        crash.start()
+
+        results = dict()
+        supervisor.run(lambda job_id, result: results.update({job_id: result}))
+        supervisor.shutdown()
+
+        self.assertEqual(sorted(results.keys()), job_ids)
+        for result in results.values():
+            self.assertTrue(result['successful'])
+
+    def test_poison_job_reported_as_failed(self):
+        supervisor = Supervisor(processes=1, concurrency=1, spares=1,
+                                max_job_crashes=0)
+        supervisor.start()
+        job_id = supervisor.submit('get', self.url)
+        crash = threading.Timer(1.0, self.segfault_worker, [supervisor])
+        crash.start()
+
+        results = dict()
+        supervisor.run(lambda job_id, result: results.update({job_id: result}))
+        supervisor.shutdown()
+
+        self.assertFalse(results[job_id]['successful'])
+        self.assertIn('SIGSEGV', results[job_id]['errors'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
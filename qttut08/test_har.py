@@ -0,0 +1,93 @@
+import os
+import json
+import tempfile
+import unittest
+
+from har import (iso_time, request_entry, response_entry, entry_timings,
+                 HarWriter)
+
+
+class EntryTest(unittest.TestCase):
+
+    def test_iso_time(self):
+        self.assertEqual(iso_time(1500000000.25), '2017-07-14T02:40:00.250Z')
+
+    def test_request(self):
+        entry = request_entry('POST', 'http://example.com/?a=1&b=',
+                              [('Accept', '*/*')], 3,
+                              ('application/x-www-form-urlencoded', 'c=2'))
+        self.assertEqual(entry['headers'], [{'name': 'Accept',
+                                             'value': '*/*'}])
+        self.assertEqual(entry['queryString'], [{'name': 'a', 'value': '1'},
+                                                {'name': 'b', 'value': ''}])
+        self.assertEqual(entry['postData'],
+                         {'mimeType': 'application/x-www-form-urlencoded',
+                          'text': 'c=2'})
+        self.assertEqual(entry['bodySize'], 3)
+
+    def test_no_response(self):
+        entry = response_entry(0, '', [], '', 0)
+        self.assertEqual(entry['httpVersion'], '')
+        self.assertEqual(entry['content'], {'size': 0, 'mimeType': ''})
+
+    def test_timings(self):
+        self.assertEqual(entry_timings(0.5, 0.25, 0.0104),
+                         {'blocked': 500, 'dns': -1, 'connect': -1,
+                          'send': 0, 'wait': 250, 'receive': 10})
+
+
+class HarWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.har')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def read(self):
+        with open(self.path, 'r') as har_file:
+            return json.load(har_file)['log']
+
+    def test_empty(self):
+        writer = HarWriter(self.path, 1500000000.0)
+        writer.close()
+        log = self.read()
+        self.assertEqual(log['version'], '1.2')
+        self.assertEqual(log['entries'], [])
+        self.assertEqual(log['pages'][0]['pageTimings'],
+                         {'onContentLoad': -1, 'onLoad': -1})
+
+    def test_entries_streamed(self):
+        writer = HarWriter(self.path, 1500000000.0)
+        for path in ('/', '/app.js'):
+            writer.add_entry(1500000000.5,
+                             request_entry('GET', 'http://a.com' + path, []),
+                             response_entry(200, 'OK', [], 'text/html', 10),
+                             entry_timings(0.0, 0.1, 0.05))
+        writer.add_entry(1500000001.0,
+                         request_entry('GET', 'http://a.com/x', []),
+                         response_entry(0, '', [], '', 0),
+                         entry_timings(0.0, 1.0, 0.0),
+                         _error='Connection refused')
+        self.assertFalse(writer.closed)
+        writer.close(title='A', on_load=1.5)
+        self.assertTrue(writer.closed)
+
+        log = self.read()
+        self.assertEqual([entry['request']['url'] for entry in log['entries']],
+                         ['http://a.com/', 'http://a.com/app.js',
+                          'http://a.com/x'])
+        self.assertEqual(log['entries'][0]['time'], 150)
+        self.assertEqual(log['entries'][0]['pageref'], 'page_1')
+        self.assertEqual(log['entries'][2]['_error'], 'Connection refused')
+        self.assertEqual(log['pages'], [{
+            'startedDateTime': '2017-07-14T02:40:00.000Z',
+            'id': 'page_1',
+            'title': 'A',
+            'pageTimings': {'onContentLoad': -1, 'onLoad': 1500}
+        }])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import os
+import gzip
+import json
+import Queue
+import shutil
+import logging
+import tempfile
+import unittest
+
+from logutils import (QueueHandler, QueueListener, RotatingFileHandler,
+                      JsonLinesLog, queued_file_handler, open_process_log,
+                      close_process_log)
+
+
+def make_record(msg):
+    return logging.makeLogRecord({'msg': msg, 'levelno': logging.DEBUG})
+
+
+class RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+        self.flushes = 0
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+    def flush(self):
+        self.flushes += 1
+
+
+class QueueHandlerTest(unittest.TestCase):
+
+    def test_formats_and_drops(self):
+        handler = QueueHandler(Queue.Queue(2))
+        for i in range(5):
+            handler.handle(logging.makeLogRecord({'msg': 'record %d',
+                                                  'args': (i, )}))
+        self.assertEqual(handler.dropped, 3)
+        record = handler.queue.get_nowait()
+        self.assertEqual((record.msg, record.args), ('record 0', None))
+
+    def test_listener_batches_and_reports_drops(self):
+        queue = Queue.Queue(3)
+        queue_handler = QueueHandler(queue)
+        target = RecordingHandler()
+        listener = QueueListener(queue, [target], queue_handler)
+        for i in range(5):
+            queue_handler.handle(make_record('record {0}'.format(i)))
+
+        queue_handler.listener = listener
+        listener.start()
+        queue_handler.close()
+
+        self.assertEqual(target.messages,
+                         ['record 0', 'record 1', 'record 2',
+                          '2 log records dropped, the log queue was full.'])
+        # a single batch, flushed once
+        self.assertEqual(target.flushes, 1)
+
+
+class RotatingFileHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'requests.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as log_file:
+            return log_file.read()
+
+    def test_rotation_by_size(self):
+        handler = RotatingFileHandler(self.path, max_bytes=10, backup_count=2)
+        # two lines fit in a file
+        for msg in ('aaaa', 'bbbb', 'cccc', 'dddd', 'eeee', 'ffff', 'gggg'):
+            handler.handle(make_record(msg))
+        handler.close()
+
+        self.assertEqual(self.read(self.path), 'gggg\n')
+        self.assertEqual(self.read(self.path + '.1'), 'eeee\nffff\n')
+        self.assertEqual(self.read(self.path + '.2'), 'cccc\ndddd\n')
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_rotation_by_time_compressed(self):
+        handler = RotatingFileHandler(self.path, interval=0, compress=True)
+        handler.handle(make_record('first'))
+        handler.handle(make_record('second'))
+        handler.close()
+
+        self.assertEqual(self.read(self.path), 'second\n')
+        with gzip.open(self.path + '.1.gz', 'rb') as rotated:
+            self.assertEqual(rotated.read(), 'first\n')
+
+    def test_queued_file_handler(self):
+        handler = queued_file_handler(self.path)
+        for i in range(1000):
+            handler.handle(make_record(str(i)))
+        handler.close()
+
+        lines = self.read(self.path).splitlines()
+        self.assertEqual(lines, [str(i) for i in range(1000)])
+
+    def test_json_lines(self):
+        log = JsonLinesLog(self.path)
+        log.write({'url': 'http://example.com/?q=100%', 'status': 200})
+        log.write({'url': u'http://example.com/\u010d', 'status': None})
+        log.close()
+
+        lines = self.read(self.path).splitlines()
+        # compact, no spaces after the separators
+        self.assertNotIn(' ', lines[0])
+        self.assertEqual(json.loads(lines[0]),
+                         {'url': 'http://example.com/?q=100%', 'status': 200})
+        self.assertEqual(json.loads(lines[1]),
+                         {'url': u'http://example.com/\u010d',
+                          'status': None})
+
+    def test_process_log_shared(self):
+        first = open_process_log(self.path)
+        second = open_process_log(self.path)
+        self.assertIs(first, second)
+        first.write({'n': 1})
+        close_process_log(first)
+        # still open for the second user
+        second.write({'n': 2})
+        close_process_log(second)
+
+        path = '{0}.{1}'.format(self.path, os.getpid())
+        lines = self.read(path).splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'n': 1}, {'n': 2}])
+        # the next user gets a new log
+        log = open_process_log(self.path)
+        self.assertIsNot(log, first)
+        close_process_log(log)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,32 @@
+import os
+import json
+import shutil
+import tempfile
 import unittest
 
 from functools import partial
 
 from PySide.QtGui import QApplication
-from PySide.QtCore import QEventLoop
+from PySide.QtCore import (QBuffer, QByteArray, QEventLoop, QIODevice,
+                           QTemporaryFile, QUrl)
+from PySide.QtNetwork import (QNetworkAccessManager, QNetworkRequest,
+                              QNetworkReply)
 
+from budgets import ContentPolicy
 from httpserver import ServerProcess
-from qttut08_02_ok import Browser
+from qttut08_02_ok import Browser, SmartNetworkAccessManager
+from replies import LocalReply
+from retrying import HostCircuitBreakers
+from scheduling import HostLimits, HostScheduler
+from uploads import MultipartBody
+from validators import ValidatorStore
 
 
 class MockedLogger(object):
     error = lambda x, y: None
     info = lambda x, y: None
     debug = lambda x, y: None
+    isEnabledFor = lambda x, y: True
 
 
 def init_test(func):
@@ -32,11 +46,191 @@ def init_test(func):
     return _init_test
 
 
+class StreamedData(QIODevice):
+    # like webkit's form data device, a sequential device which is no buffer
+
+    def __init__(self, data):
+        QIODevice.__init__(self)
+        self._data = data
+        self.open(QIODevice.ReadOnly)
+
+    def isSequential(self):
+        return True
+
+    def readData(self, size):
+        (chunk, self._data) = (self._data[:size], self._data[size:])
+        return chunk
+
+    def writeData(self, data):
+        return -1
+
+
+class NetworkManagerTest(unittest.TestCase):
+
+    def test_outgoing_body(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        buff = QBuffer()
+        buff.setData('a=1&b=2')
+        buff.open(QIODevice.ReadOnly)
+        # the buffer's array is kept, the buffer isn't read
+        self.assertEqual(str(manager._outgoing_body(buff)), 'a=1&b=2')
+        self.assertEqual(buff.pos(), 0)
+
+        # read once, as it can't be read again for a retry
+        device = StreamedData('a=1&b=2')
+        body = manager._outgoing_body(device)
+        self.assertIsInstance(body, QByteArray)
+        self.assertEqual(str(body), 'a=1&b=2')
+        self.assertTrue(device.atEnd())
+
+        upload = QTemporaryFile()
+        upload.open()
+        self.assertIs(manager._outgoing_body(upload), upload)
+
+    def test_sequential_body_resent(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        request = QNetworkRequest(QUrl('http://example.com/'))
+        reply = LocalReply(manager, QNetworkAccessManager.PostOperation,
+                           request)
+        body = manager._outgoing_body(StreamedData('a=1&b=2'))
+        record = manager._add_record(reply, body, request)
+        self.assertTrue(manager._rewind_body(record))
+        # every send gets a buffer of its own over the same array
+        for _ in range(2):
+            device = manager._new_buffer(record.outgoing_data)
+            self.assertEqual(str(device.readAll()), 'a=1&b=2')
+        self.assertEqual(manager._har_post_data(record)[0], 7)
+
+    def test_record_id_round_trips(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        request = QNetworkRequest(QUrl('http://example.com/'))
+        reply = LocalReply(manager, QNetworkAccessManager.GetOperation,
+                           request)
+        manager._add_record(reply, None, request)
+        self.assertEqual(int(reply.property('record_id')), id(reply))
+
+    def test_retry_cancelled_by_next_task(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        request = QNetworkRequest(QUrl('http://example.com/'))
+        error = (QNetworkReply.TemporaryNetworkFailureError, 'Network down')
+        reply = LocalReply(manager, QNetworkAccessManager.GetOperation,
+                           request, status=None, error=error)
+        record = manager._add_record(reply, None, request)
+        self.assertEqual(manager.pending_count, 1)
+
+        reply._deliver()
+        manager._finished(reply)
+        # the page waits for the retry
+        self.assertIsNotNone(record.retry_timer)
+        self.assertEqual(manager.pending_count, 1)
+
+        manager.start_task(None)
+        self.assertIsNone(record.retry_timer)
+        self.assertEqual(manager.pending_count, 0)
+        # the cancellation belongs to the previous task
+        self.assertEqual(manager.errors_for(None), [])
+
+    def test_progress_followed_if_counted(self):
+        request = QNetworkRequest(QUrl('http://example.com/'))
+        for (policy, received) in ((None, 0),
+                                   (ContentPolicy(max_task_bytes=100), 10)):
+            manager = SmartNetworkAccessManager(MockedLogger(), 3,
+                                                content_policy=policy)
+            reply = LocalReply(manager, QNetworkAccessManager.GetOperation,
+                               request, data='x' * 10)
+            record = manager._add_record(reply, None, request)
+            reply._deliver()
+
+            # the slots shared by all replies found the record
+            self.assertIsNotNone(record.responded)
+            self.assertEqual(record.received, received)
+            manager._finished(reply)
+
+    def test_dump_decided_per_request(self):
+        logger = MockedLogger()
+        dumped = []
+        logger.debug = dumped.append
+        manager = SmartNetworkAccessManager(logger, 3)
+        request = QNetworkRequest(QUrl('http://example.com/'))
+        for dump in (False, True):
+            reply = LocalReply(manager, QNetworkAccessManager.GetOperation,
+                               request)
+            manager._add_record(reply, None, request, dump)
+            reply._deliver()
+            del dumped[:]
+            manager._finished(reply)
+            # the reply is dumped only if the request was picked for it
+            self.assertEqual(bool(dumped), dump)
+
+    def test_host_slots_shared_by_managers(self):
+        scheduler = HostScheduler(HostLimits([{'host': '127.0.0.1',
+                                               'concurrency': 1}]))
+        managers = [SmartNetworkAccessManager(MockedLogger(), 3,
+                                              host_scheduler=scheduler)
+                    for _ in range(2)]
+        # nothing listens on the port, the request is never answered here
+        request = QNetworkRequest(QUrl('http://127.0.0.1:8089/'))
+        for manager in managers:
+            manager._create_request(QNetworkAccessManager.GetOperation,
+                                    request, None)
+
+        # the second manager's request waits for the slot of the first one
+        self.assertEqual(managers[0].queue_stats['queued'], 0)
+        self.assertEqual(managers[1].queue_stats['queued'], 1)
+        self.assertEqual(scheduler.queued_count, 1)
+
+        # the first manager goes away, and leaves the draining to the second
+        managers[0].close()
+        self.assertTrue(managers[1]._queue_timer.isActive())
+        managers[1].abort_requests()
+
+    def test_reset_drops_prepared_uploads(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        for page_key in (1, 2):
+            request = QNetworkRequest(QUrl('http://example.com/'))
+            body = MultipartBody([{'name': 'a', 'value': u'1'}])
+            manager.prepare_upload(request, body, page_key)
+
+        # the tab of the first page was reset before its request was made
+        manager.reset(1)
+        self.assertEqual([page for (page, _) in manager._uploads.values()],
+                         [2])
+
+    def test_only_documents_revalidated(self):
+        manager = SmartNetworkAccessManager(
+            MockedLogger(), 3, validator_store=ValidatorStore(':memory:')
+        )
+        page = QNetworkRequest(QUrl('http://example.com/'))
+        page.setRawHeader('Accept', 'text/html,application/xhtml+xml')
+        script = QNetworkRequest(QUrl('http://example.com/app.js'))
+        script.setRawHeader('Accept', '*/*')
+
+        self.assertTrue(manager._revalidated(page))
+        self.assertFalse(manager._revalidated(script))
+
+    def test_reset_keeps_reported_errors(self):
+        manager = SmartNetworkAccessManager(MockedLogger(), 3)
+        # as passed along with the results of the previous tasks
+        reported = manager.errors_for(1)
+        reported.append('previous task')
+        unattributed = manager.errors_for(None)
+        unattributed.append('unattributed')
+
+        manager.reset(1)
+        self.assertEqual(reported, ['previous task'])
+        self.assertEqual(manager.errors_for(1), [])
+
+        manager.reset()
+        self.assertEqual(unattributed, ['unattributed'])
+        self.assertEqual(manager.errors_for(None), [])
+
+
 class BrowserTest(unittest.TestCase):
 
     def setUp(self):
         self.address = '127.0.0.1'
         self.port = 8088
+        self.url = 'http://{0}:{1}/'.format(self.address, self.port)
         self.logger = MockedLogger()
 
     def start_server(self, server_context):
@@ -154,6 +348,51 @@ class BrowserTest(unittest.TestCase):
                 'req_data': {'test': '1'},
                 'req_headers': {}}
 
+    @init_test
+    def test_headless_delayed_ajax(self):
+        with open('html/js_delayed_ajax.html', 'r') as html_file:
+            html = html_file.read()
+
+        server_context = {
+            'delay': 0.0,
+            'response': 200,
+            'response_data': html,
+            'headers': {'content-type': 'text/html;'}
+        }
+        expected = {
+            'url': 'http://127.0.0.1:8088/',
+            'successful': True,
+            'html': html,
+        }
+        browser_options = {'images': True,
+                           'javascript': True,
+                           'headless': True,
+                           'viewport': (800, 600)}
+        return {'server_context': server_context,
+                'expected': expected,
+                'browser_options': browser_options,
+                'req_method': 'post',
+                'req_data': {'test': '1'},
+                'req_headers': {}}
+
+    @init_test
+    def test_blocked_request(self):
+        # the server would be too slow, the request must not reach it
+        server_context = {'delay': 5}
+        expected = {
+            'url': 'http://127.0.0.1:8088/',
+            'successful': True,
+            'html': u'<html><head></head><body></body></html>',
+        }
+        browser_options = {'timeout': 4,
+                           'block': [{'host': '127.0.0.1'}]}
+        return {'server_context': server_context,
+                'expected': expected,
+                'browser_options': browser_options,
+                'req_method': 'get',
+                'req_data': {},
+                'req_headers': {}}
+
     @init_test
     def test_slow_request_1(self):
         server_context = {'delay': 5}
@@ -217,6 +456,301 @@ class BrowserTest(unittest.TestCase):
                 'req_data': {'test': '1'},
                 'req_headers': {}}
 
+    def page_context(self, html, delay=0.0, headers=None, **context):
+        # the server answers every request with the html page
+        context.update({'delay': delay,
+                        'response': 200,
+                        'response_data': html,
+                        'headers': headers or {'content-type': 'text/html;'}})
+        return context
+
+    def run_tasks(self, tasks, options=None, server_context=None,
+                  sequential=False, same_tab=False):
+        """
+        Run the tasks, functions taking the browser and the tab to use, and
+        return their results in the order they finished. The tasks run at
+        the same time in tabs of one browser, or if sequential, one after the
+        other, each with a new browser, or in the main tab of the same one if
+        same_tab. The server is started with the given context, and stopped
+        once the last browser is shut down.
+        """
+        if server_context is not None:
+            self.start_server(server_context)
+        results = []
+
+        def start_browser():
+            # Browser pops the options it knows
+            self.browser = Browser(finished, self.logger, dict(options or {}))
+            return self.browser
+
+        def finished(result):
+            results.append(result)
+            if len(results) == len(tasks):
+                self.browser.shutdown(self.event_loop.quit)
+            elif sequential and same_tab:
+                tasks[len(results)](self.browser, None)
+            elif sequential:
+                self.browser.shutdown(
+                    lambda: tasks[len(results)](start_browser(), None)
+                )
+
+        self.event_loop = QEventLoop()
+        browser = start_browser()
+        tasks[0](browser, None)
+        if not sequential:
+            for task in tasks[1:]:
+                task(browser, browser.new_tab(finished))
+        self.event_loop.exec_()
+
+        if server_context is not None:
+            self.server.shutdown()
+            self.server.join()
+        return results
+
+    def get_task(self, url):
+        return lambda browser, tab: browser.make('get', url, {}, tab=tab)
+
+    def test_concurrent_tabs(self):
+        with open('html/js_delayed_ajax.html', 'r') as html_file:
+            html = html_file.read()
+
+        task = self.get_task(self.url)
+        results = self.run_tasks([task, task], {'javascript': True},
+                                 self.page_context(html))
+
+        self.assertEqual(len(results), 2)
+        for result in results:
+            self.assertEqual(result, {'url': self.url,
+                                      'successful': True,
+                                      'html': html})
+
+    def test_disk_cache_shared_between_browsers(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        server_context = self.page_context(html, headers={
+            'content-type': 'text/html;',
+            'cache-control': 'max-age=3600'
+        })
+        cache_dir = tempfile.mkdtemp()
+        stats = []
+
+        def load(browser, tab):
+            stats.append(browser._network_manager.cache_stats)
+            browser.make('get', self.url, {})
+
+        self.run_tasks([load, load], {'cache_dir': cache_dir}, server_context,
+                       sequential=True)
+        shutil.rmtree(cache_dir)
+
+        self.assertEqual(stats[0]['hits'], 0)
+        self.assertEqual(stats[0]['misses'], 1)
+        # the second browser found the page in the cache of the first one
+        self.assertEqual(stats[1]['hits'], 1)
+        self.assertEqual(stats[1]['misses'], 0)
+        self.assertEqual(stats[1]['bytes_saved'], len(html))
+
+    def test_host_concurrency_limit(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        stats = []
+
+        def load(browser, tab):
+            stats.append(browser._network_manager.queue_stats)
+            browser.make('get', self.url, {}, tab=tab)
+
+        options = {'host_limits': [{'host': '127.0.0.1', 'concurrency': 1}]}
+        results = self.run_tasks([load, self.get_task(self.url)], options,
+                                 self.page_context(html, delay=0.5))
+
+        for result in results:
+            self.assertTrue(result['successful'])
+        # the second page waited for the first one to finish
+        self.assertEqual(stats[0]['queued'], 1)
+        self.assertGreater(stats[0]['max_wait'], 0.4)
+
+    def test_download_to_file(self):
+        data = 'id,value\n' + ''.join('{0},{0}\n'.format(i)
+                                      for i in range(100000))
+        server_context = self.page_context(data, headers={
+            'content-type': 'text/csv'
+        })
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+
+        task = lambda browser, tab: browser.download('get', self.url, {},
+                                                     path=path)
+        results = self.run_tasks([task], server_context=server_context)
+
+        with open(path, 'rb') as downloaded:
+            self.assertEqual(downloaded.read(), data)
+        os.remove(path)
+        self.assertEqual(results, [{'url': self.url,
+                                    'successful': True,
+                                    'bytes': len(data),
+                                    'path': path}])
+
+    def test_content_policy_rejects_download(self):
+        server_context = self.page_context('x' * 100000, headers={
+            'content-type': 'application/octet-stream'
+        })
+        task = lambda browser, tab: browser.download(
+            'get', self.url, {}, chunk_callback=lambda chunk: None
+        )
+        options = {'content_policy': {'allowed_mime_types': ['text/*']}}
+        results = self.run_tasks([task], options, server_context)
+
+        self.assertFalse(results[0]['successful'])
+        self.assertEqual(results[0]['errors'], [
+            'ContentRejected: mime type application/octet-stream is not '
+            'allowed'
+        ])
+
+    def test_task_bytes_counted_per_task(self):
+        html = '<html><body>{0}</body></html>'.format('x' * 3000)
+        options = {'content_policy': {'max_task_bytes': 5000}}
+        results = self.run_tasks([self.get_task(self.url)] * 2, options,
+                                 self.page_context(html), sequential=True,
+                                 same_tab=True)
+
+        # together the tasks are over the budget, each of them is not
+        for result in results:
+            self.assertTrue(result['successful'])
+            self.assertNotIn('errors', result)
+
+    def test_identical_requests_coalesced(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        stats = []
+
+        def load(browser, tab):
+            stats.append(browser._network_manager.coalesce_stats)
+            browser.make('get', self.url, {}, tab=tab)
+
+        results = self.run_tasks([load, self.get_task(self.url)],
+                                 {'coalesce': True},
+                                 self.page_context(html, delay=0.5))
+
+        # the second tab got the response to the request of the first one
+        self.assertEqual(stats[0]['coalesced'], 1)
+        self.assertEqual(results[0], results[1])
+        self.assertTrue(results[0]['successful'])
+
+    def test_unchanged_page_served_from_validator_store(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        (fd, store_path) = tempfile.mkstemp()
+        os.close(fd)
+        task = self.get_task(self.url)
+        results = self.run_tasks([task, task],
+                                 {'validator_store': store_path},
+                                 self.page_context(html, etag='"v1"'),
+                                 sequential=True)
+        os.remove(store_path)
+
+        self.assertNotIn('unchanged', results[0])
+        # the server answered 304, the page came from the store
+        self.assertTrue(results[1]['unchanged'])
+        self.assertEqual(results[1]['html'], results[0]['html'])
+        self.assertTrue(results[1]['successful'])
+
+    def test_request_log(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        log_dir = tempfile.mkdtemp()
+        log_path = os.path.join(log_dir, 'requests.jsonl')
+        self.run_tasks([self.get_task(self.url)] * 2,
+                       {'request_log': log_path}, self.page_context(html),
+                       sequential=True)
+
+        # the browsers of the process wrote the same file, closed along with
+        # the last one of them
+        process_log_path = '{0}.{1}'.format(log_path, os.getpid())
+        with open(process_log_path, 'r') as log_file:
+            entries = [json.loads(line) for line in log_file]
+        shutil.rmtree(log_dir)
+
+        self.assertEqual(len(entries), 2)
+        self.assertLess(entries[0]['id'], entries[1]['id'])
+        self.assertNotEqual(entries[0]['browser'], entries[1]['browser'])
+        self.assertEqual(entries[0]['url'], self.url)
+        self.assertEqual(entries[0]['method'], 'GET')
+        self.assertEqual(entries[0]['status'], 200)
+        self.assertEqual(entries[0]['error'], 0)
+        self.assertEqual(entries[0]['bytes'], len(html))
+        self.assertFalse(entries[0]['from_cache'])
+        self.assertEqual(entries[0]['bytes_saved'], 0)
+        self.assertEqual(entries[0]['response_headers']['content-type'],
+                         'text/html;')
+
+    def test_waterfall_in_result(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        stats = []
+
+        def load(browser, tab):
+            stats.append(browser._network_manager.timing_stats)
+            browser.make('get', self.url, {})
+
+        results = self.run_tasks([load], {'waterfall': True},
+                                 self.page_context(html, delay=0.2))
+
+        timings = results[0]['timings']
+        self.assertEqual(timings['requests'], 1)
+        self.assertEqual(timings['bytes'], len(html))
+        # the server delays the response headers
+        self.assertGreaterEqual(timings['waiting'], 0.2)
+        self.assertGreaterEqual(timings['elapsed'], timings['span'])
+        (entry, ) = timings['waterfall']
+        self.assertEqual(entry['url'], self.url)
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['started'], 0)
+        self.assertEqual(stats[0].hosts[self.address].count, 1)
+
+    def test_har_written_per_task(self):
+        with open('html/simple_page.html', 'r') as html_file:
+            html = html_file.read()
+
+        url = self.url + '?q=1'
+        har_dir = tempfile.mkdtemp()
+        results = self.run_tasks([self.get_task(url)], {'har_dir': har_dir},
+                                 self.page_context(html))
+
+        with open(results[0]['har'], 'r') as har_file:
+            log = json.load(har_file)['log']
+        shutil.rmtree(har_dir)
+
+        self.assertEqual(log['version'], '1.2')
+        self.assertEqual(len(log['pages']), 1)
+        (entry, ) = log['entries']
+        self.assertEqual(entry['pageref'], log['pages'][0]['id'])
+        self.assertEqual(entry['request']['url'], url)
+        self.assertEqual(entry['request']['queryString'],
+                         [{'name': 'q', 'value': '1'}])
+        self.assertEqual(entry['response']['status'], 200)
+        self.assertEqual(entry['response']['content'],
+                         {'size': len(html), 'mimeType': 'text/html;'})
+
+    def test_circuit_breaker_fails_fast(self):
+        # nothing listens on this port, the connection is refused
+        task = self.get_task('http://127.0.0.1:8089/')
+        breakers = HostCircuitBreakers(failure_threshold=1)
+        results = self.run_tasks([task, task], {'circuit_breakers': breakers},
+                                 sequential=True)
+
+        self.assertFalse(results[0]['successful'])
+        self.assertIn('ConnectionRefusedError', results[0]['errors'][-1])
+        # the second request never went to the network
+        self.assertFalse(results[1]['successful'])
+        self.assertIn('Circuit breaker open for host 127.0.0.1',
+                      results[1]['errors'][-1])
+        self.assertEqual(breakers.state('127.0.0.1'), 'open')
+
 
 if __name__ == '__main__':
     app = QApplication([])
@@ -0,0 +1,97 @@
+import unittest
+
+from retrying import backoff_delay, CircuitBreaker, HostCircuitBreakers
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class BackoffDelayTest(unittest.TestCase):
+
+    def test_exponential_growth(self):
+        no_jitter = lambda: 1.0
+        delays = [backoff_delay(i, base=0.5, rand=no_jitter) for i in range(4)]
+        self.assertEqual(delays, [0.5, 1.0, 2.0, 4.0])
+
+    def test_cap(self):
+        self.assertEqual(backoff_delay(20, base=0.5, cap=30.0,
+                                       rand=lambda: 1.0), 30.0)
+
+    def test_jitter(self):
+        self.assertEqual(backoff_delay(3, rand=lambda: 0.0), 0.0)
+        for _ in range(100):
+            self.assertTrue(0.0 <= backoff_delay(3, base=0.5) <= 4.0)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10,
+                                      clock=self.clock)
+
+    def fail(self, times):
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self.fail(1)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_success_resets_failures(self):
+        self.fail(2)
+        self.breaker.record_success()
+        self.fail(2)
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_trial(self):
+        self.fail(3)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # only one trial at a time
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_failed_trial_reopens(self):
+        self.fail(3)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_lost_trial_is_replaced(self):
+        self.fail(3)
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+        self.clock.now += 10
+        self.assertTrue(self.breaker.allow())
+
+
+class HostCircuitBreakersTest(unittest.TestCase):
+
+    def test_hosts_are_independent(self):
+        breakers = HostCircuitBreakers(failure_threshold=1,
+                                       clock=FakeClock())
+        breakers.record_failure('down.example.com')
+        self.assertFalse(breakers.allow('down.example.com'))
+        self.assertTrue(breakers.allow('up.example.com'))
+        self.assertEqual(breakers.state('down.example.com'),
+                         CircuitBreaker.OPEN)
+
+
+if __name__ == '__main__':
+    unittest.main()
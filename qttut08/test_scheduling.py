@@ -0,0 +1,105 @@
+import unittest
+
+from scheduling import TokenBucket, HostLimits, HostScheduler
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock)
+        self.assertEqual([bucket.take() for _ in range(4)],
+                         [True, True, True, False])
+        self.assertAlmostEqual(bucket.delay(), 0.5)
+
+        clock.now += 0.5
+        self.assertTrue(bucket.take())
+        self.assertFalse(bucket.take())
+
+    def test_tokens_capped_at_burst(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=10, burst=2, clock=clock)
+        clock.now += 60
+        self.assertEqual([bucket.take() for _ in range(3)],
+                         [True, True, False])
+
+
+class HostLimitsTest(unittest.TestCase):
+
+    def test_first_matching_rule(self):
+        limits = HostLimits([{'host': 'api.example.com', 'concurrency': 1},
+                             {'host': '*.example.com', 'concurrency': 4}])
+        self.assertEqual(limits.limit_for('api.example.com')['concurrency'],
+                         1)
+        self.assertEqual(limits.limit_for('www.Example.com')['concurrency'],
+                         4)
+        self.assertIsNone(limits.limit_for('example.org'))
+
+
+class HostSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        limits = HostLimits([{'host': 'slow.com', 'concurrency': 2},
+                             {'host': 'rate.com', 'rate': 1}])
+        self.scheduler = HostScheduler(limits, self.clock)
+
+    def test_unlimited_host(self):
+        for _ in range(100):
+            self.assertTrue(self.scheduler.acquire('example.org'))
+
+    def test_concurrency(self):
+        self.assertTrue(self.scheduler.acquire('slow.com'))
+        self.assertTrue(self.scheduler.acquire('slow.com'))
+        self.assertFalse(self.scheduler.acquire('slow.com'))
+        self.scheduler.enqueue('slow.com', 'a')
+        self.scheduler.enqueue('slow.com', 'b')
+        self.assertEqual(self.scheduler.ready(), [])
+        # waiting for a slot, not for time to pass
+        self.assertIsNone(self.scheduler.next_delay())
+
+        self.scheduler.release('slow.com')
+        self.assertEqual(self.scheduler.ready(), ['a'])
+        self.assertEqual(self.scheduler.queued_count, 1)
+        self.assertEqual(list(self.scheduler.queued()), ['b'])
+
+    def test_queue_keeps_order(self):
+        self.scheduler.acquire('slow.com')
+        self.scheduler.acquire('slow.com')
+        self.scheduler.enqueue('slow.com', 'a')
+        self.scheduler.release('slow.com')
+        # a slot is free, but 'a' was first
+        self.assertFalse(self.scheduler.acquire('slow.com'))
+
+    def test_rate(self):
+        self.assertTrue(self.scheduler.acquire('rate.com'))
+        self.assertFalse(self.scheduler.acquire('rate.com'))
+        self.scheduler.enqueue('rate.com', 'a')
+        self.assertAlmostEqual(self.scheduler.next_delay(), 1.0)
+
+        self.clock.now += 1
+        self.assertEqual(self.scheduler.ready(), ['a'])
+        self.assertIsNone(self.scheduler.next_delay())
+
+    def test_dead_items_dropped(self):
+        self.scheduler.acquire('slow.com')
+        self.scheduler.acquire('slow.com')
+        self.scheduler.enqueue('slow.com', 'dead')
+        self.scheduler.enqueue('slow.com', 'a')
+        self.scheduler.release('slow.com')
+        self.assertEqual(self.scheduler.ready(lambda item: item != 'dead'),
+                         ['a'])
+        self.assertEqual(self.scheduler.queued_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
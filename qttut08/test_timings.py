@@ -0,0 +1,89 @@
+import unittest
+
+from timings import breakdown, LatencyHistogram, TimingStats
+
+
+class BreakdownTest(unittest.TestCase):
+
+    def test_phases(self):
+        self.assertEqual(breakdown(100.0, 0.5, 101.0, 101.25),
+                         {'queued': 0.5, 'waiting': 0.5, 'receiving': 0.25})
+
+    def test_no_response(self):
+        self.assertEqual(breakdown(100.0, 0.0, None, 102.0),
+                         {'queued': 0.0, 'waiting': 2.0, 'receiving': 0.0})
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = LatencyHistogram()
+        self.assertIsNone(histogram.percentile(50))
+        self.assertEqual(histogram.summary(), {'count': 0, 'mean': None,
+                                               'p50': None, 'p90': None,
+                                               'p99': None})
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram(bounds=(10, 100, 1000))
+        for seconds in [0.005] * 5 + [0.05] * 4 + [0.5]:
+            histogram.add(seconds)
+        self.assertEqual(histogram.counts, [5, 4, 1, 0])
+        self.assertEqual(histogram.percentile(50), 10)
+        self.assertEqual(histogram.percentile(90), 100)
+        self.assertEqual(histogram.percentile(99), 1000)
+        self.assertAlmostEqual(histogram.summary()['mean'], 72.5)
+
+    def test_unbounded_bucket(self):
+        histogram = LatencyHistogram(bounds=(10, ))
+        histogram.add(5.0)
+        self.assertEqual(histogram.counts, [0, 1])
+        self.assertIsNone(histogram.percentile(50))
+
+
+class TimingStatsTest(unittest.TestCase):
+
+    def entry(self, started, queued, waiting, receiving, size, url):
+        return {'started': started, 'queued': queued, 'waiting': waiting,
+                'receiving': receiving, 'bytes': size, 'url': url}
+
+    def test_totals(self):
+        stats = TimingStats()
+        stats.add(1, 'a.com', self.entry(10.0, 0.0, 0.5, 0.5, 100, '/'))
+        stats.add(1, 'b.com', self.entry(10.5, 1.0, 0.25, 0.25, 50, '/x'))
+        stats.add(2, 'a.com', self.entry(20.0, 0.0, 0.1, 0.0, 10, '/'))
+
+        self.assertEqual(stats.task_totals(1), {'requests': 2,
+                                                'bytes': 150,
+                                                'queued': 1.0,
+                                                'waiting': 0.75,
+                                                'receiving': 0.75,
+                                                'span': 2.0})
+        self.assertEqual(stats.hosts['a.com'].count, 2)
+        self.assertEqual(stats.host_summary()['b.com']['count'], 1)
+        # not kept unless asked for
+        self.assertEqual(stats.waterfall_for(1), [])
+
+    def test_waterfall(self):
+        stats = TimingStats(waterfall=True)
+        stats.add(1, 'a.com', self.entry(10.5, 0.0, 0.25, 0.25, 50, '/x'))
+        stats.add(1, 'a.com', self.entry(10.0, 0.0, 0.5, 0.5, 100, '/'))
+
+        self.assertEqual(stats.waterfall_for(1), [
+            {'started': 0, 'queued': 0, 'waiting': 500, 'receiving': 500,
+             'bytes': 100, 'url': '/'},
+            {'started': 500, 'queued': 0, 'waiting': 250, 'receiving': 250,
+             'bytes': 50, 'url': '/x'}
+        ])
+
+    def test_forget(self):
+        stats = TimingStats(waterfall=True)
+        stats.add(1, 'a.com', self.entry(10.0, 0.0, 0.5, 0.5, 100, '/'))
+        stats.forget(1)
+        self.assertEqual(stats.task_totals(1)['requests'], 0)
+        self.assertEqual(stats.waterfall_for(1), [])
+        # the hosts' latencies outlive the tasks
+        self.assertEqual(stats.hosts['a.com'].count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
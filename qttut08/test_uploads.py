@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+
+from uploads import MultipartBody, MultipartReader
+
+
+class MultipartBodyTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.txt')
+        with os.fdopen(fd, 'wb') as upload:
+            upload.write('x' * 100000)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def read_all(self, reader, size=1000):
+        chunks = []
+        while True:
+            chunk = reader.read(size)
+            if not chunk:
+                return ''.join(chunks)
+            chunks.append(chunk)
+
+    def test_encoding(self):
+        body = MultipartBody([{'name': 'comment', 'value': u'\u010dau'},
+                              {'name': 'file', 'path': self.path,
+                               'filename': 'a.txt'}],
+                             boundary='BOUNDARY')
+        data = self.read_all(body.reader())
+        expected = ('--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="comment"\r\n'
+                    '\r\n'
+                    '\xc4\x8dau\r\n'
+                    '--BOUNDARY\r\n'
+                    'Content-Disposition: form-data; name="file"; '
+                    'filename="a.txt"\r\n'
+                    'Content-Type: text/plain\r\n'
+                    '\r\n' + 'x' * 100000 + '\r\n'
+                    '--BOUNDARY--\r\n')
+        self.assertEqual(data, expected)
+        self.assertEqual(body.size, len(expected))
+        self.assertEqual(body.content_type,
+                         'multipart/form-data; boundary=BOUNDARY')
+
+    def test_readers_are_independent(self):
+        body = MultipartBody([{'name': 'file', 'path': self.path}])
+        first = body.reader()
+        first.read(500)
+        # e.g. a retry while the first attempt is not done yet
+        self.assertEqual(len(self.read_all(body.reader(), 7)), body.size)
+        first.close()
+
+    def test_reads_span_segments(self):
+        reader = MultipartReader([('data', 'ab'), ('path', self.path),
+                                  ('data', 'cd')])
+        self.assertEqual(reader.read(5), 'abxxx')
+        self.assertEqual(len(reader.read(200000)), 100000 - 3 + 2)
+        self.assertEqual(reader.read(5), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
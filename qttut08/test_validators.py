@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+from validators import ValidatorStore
+
+
+class ValidatorStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.store = ValidatorStore(':memory:', max_body_size=100)
+
+    def test_round_trip(self):
+        self.store.put('http://Example.com/page#top', '"abc"', None,
+                       [('Content-Type', 'text/html')], '<html></html>')
+        self.assertEqual(self.store.get('http://example.com/page'),
+                         {'etag': '"abc"',
+                          'last_modified': None,
+                          'headers': [('Content-Type', 'text/html')],
+                          'body': '<html></html>'})
+
+    def test_replaced(self):
+        self.store.put('http://example.com/', None, 'Mon, 01 Jan 2018', [],
+                       'old')
+        self.store.put('http://example.com/', None, 'Tue, 02 Jan 2018', [],
+                       'new')
+        entry = self.store.get('http://example.com/')
+        self.assertEqual(entry['last_modified'], 'Tue, 02 Jan 2018')
+        self.assertEqual(entry['body'], 'new')
+
+    def test_not_stored(self):
+        # nothing to revalidate with
+        self.store.put('http://example.com/a', None, None, [], 'body')
+        # too large
+        self.store.put('http://example.com/b', '"x"', None, [], 'x' * 101)
+        self.assertIsNone(self.store.get('http://example.com/a'))
+        self.assertIsNone(self.store.get('http://example.com/b'))
+
+
+class BatchedCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self.path) = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def stored_count(self):
+        # what another process would see
+        reader = ValidatorStore(self.path)
+        count = reader._db.execute('SELECT COUNT(*) FROM validators')
+        return count.fetchone()[0]
+
+    def test_committed_in_batches(self):
+        store = ValidatorStore(self.path, commit_every=2,
+                               commit_interval=60.0)
+        store.put('http://example.com/a', '"a"', None, [], 'a')
+        self.assertEqual(store.get('http://example.com/a')['body'], 'a')
+        self.assertEqual(self.stored_count(), 0)
+
+        store.put('http://example.com/b', '"b"', None, [], 'b')
+        self.assertEqual(self.stored_count(), 2)
+
+        store.put('http://example.com/c', '"c"', None, [], 'c')
+        store.flush()
+        self.assertEqual(self.stored_count(), 3)
+
+    def test_shared_between_stores(self):
+        # e.g. the browsers of two farm workers
+        first = ValidatorStore(self.path, commit_every=2)
+        second = ValidatorStore(self.path, commit_every=1)
+        first.put('http://example.com/a', '"a"', None, [], 'a')
+        # the first one's waiting response doesn't lock the database
+        second.put('http://example.com/b', '"b"', None, [], 'b')
+        self.assertEqual(self.stored_count(), 1)
+        self.assertEqual(first.get('http://example.com/b')['body'], 'b')
+
+        first.flush()
+        self.assertEqual(second.get('http://example.com/a')['body'], 'a')
+
+    def test_locked_batch_kept(self):
+        store = ValidatorStore(self.path, commit_every=1, lock_timeout=0.0)
+        other = ValidatorStore(self.path)
+        other._db.execute('BEGIN IMMEDIATE')
+        store.put('http://example.com/a', '"a"', None, [], 'a')
+        self.assertFalse(store.flush())
+        self.assertEqual(store.get('http://example.com/a')['body'], 'a')
+
+        other._db.rollback()
+        self.assertTrue(store.flush())
+        self.assertEqual(self.stored_count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
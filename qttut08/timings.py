@@ -0,0 +1,163 @@
+import math
+import bisect
+
+
+# upper bounds of the latency buckets, in milliseconds
+DEFAULT_BOUNDS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+PHASES = ('queued', 'waiting', 'receiving')
+
+
+def breakdown(created, queue_wait, responded, completed):
+    """
+    Split the seconds a request took into the time it was queued for a slot
+    of its host, waiting for the response headers (connecting, sending the
+    request and the server working on it), and receiving the body. A request
+    which never got a response spent all its time waiting.
+    """
+    sent = created + queue_wait
+    if responded is None:
+        responded = completed
+    return {'queued': queue_wait,
+            'waiting': max(responded - sent, 0.0),
+            'receiving': max(completed - responded, 0.0)}
+
+
+class LatencyHistogram(object):
+    """
+    Counts of the latencies falling into buckets with the given upper bounds
+    in milliseconds, plus one for anything slower. Takes the same memory no
+    matter how many latencies are added, and is good enough for percentiles.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        milliseconds = seconds * 1000
+        self.counts[bisect.bisect_left(self.bounds, milliseconds)] += 1
+        self.count += 1
+        self.total += milliseconds
+
+    def percentile(self, percent):
+        """
+        Return the upper bound of the bucket the percentile falls into, or
+        None if it's the last, unbounded one, or nothing was added yet.
+        """
+        if not self.count:
+            return None
+
+        rank = max(int(math.ceil(self.count * percent / 100.0)), 1)
+        seen = 0
+        for (bound, count) in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99)}
+
+
+class TimingStats(object):
+    """
+    Timings of the finished requests, aggregated into a latency histogram
+    per host and totals per task (page). With waterfall set, the timings of
+    each request of a task are kept too, until the task is forgotten.
+
+    The entries added are dicts with the started timestamp, the seconds
+    spent in each of the PHASES and the bytes received, any other keys (e.g.
+    the url) are just passed on to the waterfall.
+    """
+
+    def __init__(self, waterfall=False, bounds=DEFAULT_BOUNDS):
+        self.waterfall = waterfall
+        self.bounds = bounds
+        self.hosts = dict()
+        self._tasks = dict()
+        self._waterfalls = dict()
+
+    def add(self, page, host, entry):
+        duration = sum(entry[phase] for phase in PHASES)
+        histogram = self.hosts.get(host)
+        if histogram is None:
+            histogram = self.hosts[host] = LatencyHistogram(self.bounds)
+        histogram.add(duration)
+
+        totals = self._tasks.get(page)
+        if totals is None:
+            totals = self._tasks[page] = {'requests': 0,
+                                          'bytes': 0,
+                                          'started': entry['started'],
+                                          'completed': 0.0}
+            totals.update((phase, 0.0) for phase in PHASES)
+        totals['requests'] += 1
+        totals['bytes'] += entry['bytes']
+        for phase in PHASES:
+            totals[phase] += entry[phase]
+        totals['started'] = min(totals['started'], entry['started'])
+        totals['completed'] = max(totals['completed'],
+                                  entry['started'] + duration)
+
+        if self.waterfall:
+            self._waterfalls.setdefault(page, []).append(entry)
+
+    def task_totals(self, page):
+        """
+        The number of requests and bytes of the task, the seconds its
+        requests spent in each phase summed up, and the span from the start
+        of the first to the end of the last one.
+        """
+        totals = self._tasks.get(page)
+        if totals is None:
+            return {'requests': 0, 'bytes': 0, 'span': 0.0,
+                    'queued': 0.0, 'waiting': 0.0, 'receiving': 0.0}
+
+        result = dict((key, value) for (key, value) in totals.items()
+                      if key not in ('started', 'completed'))
+        result['span'] = totals['completed'] - totals['started']
+        return result
+
+    def waterfall_for(self, page):
+        """
+        The requests of the task in the order they were started, with the
+        timestamps replaced by the milliseconds since the first one started,
+        and the phases in milliseconds too.
+        """
+        entries = sorted(self._waterfalls.get(page, []),
+                         key=lambda entry: entry['started'])
+        if not entries:
+            return []
+
+        first = entries[0]['started']
+        waterfall = []
+        for entry in entries:
+            compact = dict(entry)
+            compact['started'] = int((entry['started'] - first) * 1000)
+            for phase in PHASES:
+                compact[phase] = int(entry[phase] * 1000)
+            waterfall.append(compact)
+        return waterfall
+
+    def forget(self, page=None):
+        """
+        Drop the totals and the waterfall of the task, or of all of them,
+        the host histograms are kept.
+        """
+        if page is None:
+            self._tasks.clear()
+            self._waterfalls.clear()
+        else:
+            self._tasks.pop(page, None)
+            self._waterfalls.pop(page, None)
+
+    def host_summary(self):
+        return dict((host, histogram.summary())
+                    for (host, histogram) in self.hosts.items())
@@ -0,0 +1,164 @@
+import os
+import uuid
+import mimetypes
+
+from PySide.QtCore import QIODevice
+
+
+def _encode(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+class MultipartBody(object):
+    """
+    A multipart/form-data upload, made of parts which are dicts with a name
+    and either a value, or the path of a file to upload:
+
+        {'name': 'comment', 'value': u'Some text'}
+        {'name': 'attachment', 'path': '/tmp/video.mp4',
+         'filename': 'video.mp4', 'content_type': 'video/mp4'}
+
+    filename and content_type are optional for files. Nothing is read when
+    the body is created, files are streamed from the disk by every device
+    opened for it, so a retried upload reads them again instead of keeping
+    a copy around.
+    """
+
+    def __init__(self, parts, boundary=None):
+        self.boundary = boundary or '----qttut08' + uuid.uuid4().hex
+        # strings are sent as they are, paths are read from the disk
+        self._segments = []
+        self.size = 0
+
+        for part in parts:
+            if 'path' in part:
+                self._add_file_part(part)
+            else:
+                self._add(self._part_header(part['name']) +
+                          _encode(part['value']) + '\r\n')
+        self._add('--{0}--\r\n'.format(self.boundary))
+
+    def _part_header(self, name, filename=None, content_type=None):
+        disposition = 'form-data; name="{0}"'.format(_encode(name))
+        if filename is not None:
+            disposition += '; filename="{0}"'.format(_encode(filename))
+
+        header = '--{0}\r\nContent-Disposition: {1}\r\n'.format(
+            self.boundary, disposition
+        )
+        if content_type is not None:
+            header += 'Content-Type: {0}\r\n'.format(content_type)
+        return header + '\r\n'
+
+    def _add_file_part(self, part):
+        path = part['path']
+        filename = part.get('filename', os.path.basename(path))
+        content_type = (part.get('content_type') or
+                        mimetypes.guess_type(filename)[0] or
+                        'application/octet-stream')
+
+        self._add(self._part_header(part['name'], filename, content_type))
+        self._segments.append(('path', path))
+        self.size += os.path.getsize(path)
+        self._add('\r\n')
+
+    def _add(self, data):
+        self._segments.append(('data', data))
+        self.size += len(data)
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={0}'.format(self.boundary)
+
+    def reader(self):
+        return MultipartReader(self._segments)
+
+    def open(self):
+        """
+        Return a new sequential device streaming the whole body.
+        """
+        return MultipartDevice(self.reader(), self.size)
+
+
+class MultipartReader(object):
+    """
+    Reads the segments of a body one after the other, with only one file
+    open at a time.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, segments):
+        self._segments = iter(segments)
+        self._data = ''
+        self._file = None
+
+    def _next_segment(self):
+        for (kind, value) in self._segments:
+            if kind == 'data':
+                self._data = value
+            else:
+                self._file = open(value, 'rb')
+            return True
+        return False
+
+    def read(self, size):
+        chunks = []
+        while size > 0:
+            if self._data:
+                chunk = self._data[:size]
+                self._data = self._data[size:]
+            elif self._file is not None:
+                chunk = self._file.read(min(size, self.chunk_size))
+                if not chunk:
+                    self._file.close()
+                    self._file = None
+                    continue
+            elif not self._next_segment():
+                break
+            else:
+                continue
+
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class MultipartDevice(QIODevice):
+    """
+    A read only, sequential device over a multipart body, which is what the
+    network manager streams the upload from.
+    """
+
+    def __init__(self, reader, size, parent=None):
+        QIODevice.__init__(self, parent)
+        self._reader = reader
+        self._remaining = size
+        self.open(QIODevice.ReadOnly | QIODevice.Unbuffered)
+
+    def isSequential(self):
+        return True
+
+    def bytesAvailable(self):
+        return self._remaining + QIODevice.bytesAvailable(self)
+
+    def readData(self, max_size):
+        chunk = self._reader.read(min(max_size, self._remaining))
+        self._remaining -= len(chunk)
+        if not chunk:
+            self._reader.close()
+        return chunk
+
+    def writeData(self, data):
+        return -1
+
+    def close(self):
+        self._reader.close()
+        QIODevice.close(self)
@@ -0,0 +1,102 @@
+import json
+import time
+import sqlite3
+
+from coalescing import canonical_url
+
+
+class ValidatorStore(object):
+    """
+    Remembers the validators (ETag and Last-Modified) of the responses to
+    GET requests along with their bodies, so when a url is requested again
+    the server can answer with 304 Not Modified, and the body is taken from
+    here instead. Responses larger than max_body_size bytes aren't stored,
+    and only the resource types listed are (see blocking.RESOURCE_TYPES),
+    by default the documents pages are loaded from.
+
+    Responses are kept in memory and written in batches, each in one short
+    transaction, once commit_every of them or max_body_size bytes are
+    waiting, or commit_interval seconds have passed since the last write.
+    No transaction is left open in between, so many processes can share the
+    database. A batch which can't get sqlite's lock within lock_timeout
+    seconds is kept for the next one. Whoever stops using the store should
+    flush it.
+    """
+
+    def __init__(self, path, max_body_size=10 * 1024 * 1024,
+                 resource_types=('document', ), commit_every=50,
+                 commit_interval=5.0, lock_timeout=0.1):
+        self.max_body_size = max_body_size
+        self.resource_types = frozenset(resource_types)
+        self._commit_every = commit_every
+        self._commit_interval = commit_interval
+        # canonical url -> row, waiting to be written
+        self._pending = dict()
+        self._pending_bytes = 0
+        self._last_commit = time.time()
+        self._db = sqlite3.connect(path, timeout=lock_timeout)
+        self._db.execute('CREATE TABLE IF NOT EXISTS validators ('
+                         'url TEXT PRIMARY KEY, '
+                         'etag TEXT, '
+                         'last_modified TEXT, '
+                         'headers TEXT NOT NULL, '
+                         'body BLOB NOT NULL)')
+        self._db.commit()
+
+    def get(self, url):
+        url = canonical_url(url)
+        row = self._pending.get(url)
+        if row is None:
+            row = self._db.execute('SELECT etag, last_modified, headers, '
+                                   'body FROM validators WHERE url = ?',
+                                   (url, )).fetchone()
+        if row is None:
+            return None
+
+        (etag, last_modified, headers, body) = row
+        return {'etag': etag and str(etag),
+                'last_modified': last_modified and str(last_modified),
+                'headers': [(str(name), str(value))
+                            for (name, value) in json.loads(headers)],
+                'body': str(body)}
+
+    def put(self, url, etag, last_modified, headers, body):
+        """
+        Store the response, headers being the (name, value) pairs to answer
+        with when it's served from the store.
+        """
+        if not (etag or last_modified) or len(body) > self.max_body_size:
+            return
+
+        url = canonical_url(url)
+        replaced = self._pending.pop(url, None)
+        if replaced is not None:
+            self._pending_bytes -= len(replaced[3])
+        self._pending[url] = (etag, last_modified, json.dumps(headers), body)
+        self._pending_bytes += len(body)
+        if (len(self._pending) >= self._commit_every or
+                self._pending_bytes >= self.max_body_size or
+                time.time() - self._last_commit >= self._commit_interval):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the waiting responses, return False if the database was locked
+        by someone else, in which case they keep waiting.
+        """
+        self._last_commit = time.time()
+        if not self._pending:
+            return True
+
+        rows = [(url, ) + row[:3] + (buffer(row[3]), )
+                for (url, row) in self._pending.items()]
+        try:
+            with self._db:
+                self._db.executemany('INSERT OR REPLACE INTO validators '
+                                     'VALUES (?, ?, ?, ?, ?)', rows)
+        except sqlite3.OperationalError:
+            return False
+
+        self._pending = dict()
+        self._pending_bytes = 0
+        return True